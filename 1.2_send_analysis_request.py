@@ -3,30 +3,11 @@
 # NOTE: This generates random data which is likely to fail analysis and 
 #       cause the API server to return an Error object.
 
-import json
-import requests
 import os
 import random
 import sys
 from datetime import datetime
-
-TOKEN_PATH_KEY = 'MCG_API_TOKEN_FILE'
-TOKEN_KEY = 'MCG_API_TOKEN'
-
-def get_api_token():
-    if TOKEN_KEY in os.environ:
-        return os.environ[TOKEN_KEY]
-    elif TOKEN_PATH_KEY in os.environ:
-        with open(os.environ[TOKEN_PATH_KEY], 'rb') as f:
-            return f.read().strip()
-    else:
-        raise "Missing token! Set either MCG_API_TOKEN or MCG_API_TOKEN_FILE in environment."
-
-def send_api_request(server_url, token, data):
-    header = { 'Authorization': token,
-               'Content-Type': 'application/json' }
-    response = requests.post(url=server_url, headers=header, json=data)
-    return response
+from mcg_client import get_api_token, send_api_request, decode_response
 
 def build_empty_request():
     return {
@@ -85,15 +66,6 @@ def build_valid_request():
     req['input'].append( build_ecg_input() )
     return req
 
-def decode_response(resp):
-    if resp.status_code != 200:
-        return {
-                "object-type": "http-error",
-                "timestamp": str(datetime.now),
-                "message": "Unknown error: HTTP %d" % resp.status_code
-        }
-    return json.loads(resp.text)
-
 if __name__ == '__main__':
     url = "https://api.premierheart.com/api/v1/analyze"
     if len(sys.argv) > 1:
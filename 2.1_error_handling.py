@@ -3,32 +3,14 @@
 
 import json
 import requests
-import os
 import random
 import sys
 from datetime import datetime
-
-TOKEN_PATH_KEY = 'MCG_API_TOKEN_FILE'
-TOKEN_KEY = 'MCG_API_TOKEN'
+from mcg_client import get_api_token, send_api_request
 
 def fake_token():
     return "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVcj9.EYjPC3mIoIjODhrWczovL3d3dy5wcmVtAwvYAgvHCNqUy29TiIWIC3viIjoiaHR0cHM6Ly9hcGkucHJlbWllcmhlYXJ0LmNvbSIsImF1ZCI6WyJodHRwczovL2FwaS5wcmVtaWVyaGVhcnQuY29tL2FwaSJdLCJleHAiOjI1MjQ2MDgwMDAsIm5iZiI6MTY4NjU4NTQzMCwiaWF0IjoxNjg2NTg1NDMwLCJqDgKIoJmSiMjSBci6mtiZndu2lCJzcHQiOjEyMzQ1Nn0=.YTc5MWRkN2JmZmQ1ZmM4YmZlMWVmMjNmMTRlYzRmYTE1YTRjOWYwYTY4MmY4Y2E5YTNkYzYyNzJiOTA4ODY4OA=="
 
-def get_api_token():
-    if TOKEN_KEY in os.environ:
-        return os.environ[TOKEN_KEY]
-    elif TOKEN_PATH_KEY in os.environ:
-        with open(os.environ[TOKEN_PATH_KEY], 'r') as f:
-            return f.read().strip()
-    else:
-        raise "Missing token! Set either MCG_API_TOKEN or MCG_API_TOKEN_FILE in environment."
-
-def send_api_request(server_url, token, data):
-    header = { 'Authorization': token,
-               'Content-Type': 'application/json' }
-    response = requests.post(url=server_url, headers=header, json=data)
-    return response
-
 def build_empty_request():
     return {
       "object-type": "analysis-request",
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Throughput benchmark: sequential send_api_request vs. AsyncMCGClient.
+#
+# By default a local stub server (mcg_stub_server.py) is started in-process
+# with a simulated service latency, so no billable requests are made.
+#
+# Usage: python benchmark_async_client.py [num_requests] [concurrency] [latency_seconds]
+
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from mcg_client import MCGClient, send_api_request, decode_response
+from mcg_async_client import AsyncMCGClient
+from mcg_stub_server import start_stub_server
+
+def build_request(inputs):
+    return {
+      "object-type": "analysis-request",
+      "analysis": {
+        "type": "mcg-aggregate",
+        "options": {
+          "diagnosis-matrix": True
+        }
+      },
+      "output": { },
+      "input": inputs,
+      "comment": "(FAKE DATA) Generated by " + os.path.basename(__file__)
+    }
+
+def input_for_ecg_json(json_str, age=40, gender='M'):
+    ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return {
+      "type": "ecg",
+      "format": "json",
+      "timestamp": ts,
+      "age": age,
+      "gender": gender,
+      "data": json.loads(json_str)
+    }
+
+def load_inputs():
+    inputs = [ ]
+    for x in range(3):
+        fname = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', ("ecg_%d.json" % (x+1)))
+        with open(fname, 'r') as f:
+            inputs.append(input_for_ecg_json(f.read()))
+    return inputs
+
+def run_sequential(url, token, reqs):
+    start = time.perf_counter()
+    for data in reqs:
+        decode_response(send_api_request(url, token, data))
+    return time.perf_counter() - start
+
+def run_async(url, token, reqs, concurrency):
+    async def run():
+        client = MCGClient(pool_maxsize=concurrency)
+        async with AsyncMCGClient(client, concurrency=concurrency) as aclient:
+            start = time.perf_counter()
+            results = await aclient.gather(url, token, reqs)
+            elapsed = time.perf_counter() - start
+        client.close()
+        failed = len([ r for r in results if r['object-type'] != 'analysis-result' ])
+        return elapsed, failed
+    return asyncio.run(run())
+
+if __name__ == '__main__':
+    num_requests = 50
+    concurrency = 8
+    latency = 0.05
+    if len(sys.argv) > 1:
+        num_requests = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        concurrency = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        latency = float(sys.argv[3])
+
+    server = start_stub_server(latency=latency)
+    url = server.url
+    token = "stub-token"
+    reqs = [ build_request(load_inputs()) for x in range(num_requests) ]
+    print("Benchmarking %d requests against %s (latency %0.3fs)" % (num_requests, url, latency))
+
+    elapsed = run_sequential(url, token, reqs)
+    print("\tsequential        : %6.2fs  %7.1f req/s" % (elapsed, num_requests / elapsed))
+
+    elapsed, failed = run_async(url, token, reqs, concurrency)
+    print("\tasync (conc. %3d) : %6.2fs  %7.1f req/s  (%d failed)" % (concurrency, elapsed, num_requests / elapsed, failed))
+
+    server.shutdown()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Compare request-body encodings for an ECG AnalysisRequest.
+#
+# Each supported Content-Encoding is sent to a local stub server
+# (mcg_stub_server.py), which reports the bytes received and the achieved
+# compression ratio. Upload time is estimated for the given uplink speed,
+# since on localhost the transfer itself is effectively free.
+#
+# 'saved' is the estimated upload time saved relative to an uncompressed
+# body, net of the time spent compressing.
+#
+# Usage: python benchmark_compression.py [request.json] [uplink_mbit_per_s] [repeat]
+
+import json
+import os
+import sys
+import time
+from mcg_client import MCGClient
+from mcg_compression import supported_encodings, compress_body, choose_level
+from mcg_stub_server import start_stub_server
+
+DEFAULT_REQUEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data',
+                               'analysis-request-for-ecg-files.json')
+
+def upload_seconds(num_bytes, mbit_per_s):
+    return (num_bytes * 8) / (mbit_per_s * 1000000.0)
+
+def measure(server, data, encoding, repeat):
+    server.reset_stats()
+    client = MCGClient(compression=encoding)
+    for x in range(repeat):
+        client.post(server.url, "stub-token", data)
+    client.close()
+    return server.upload_report()
+
+if __name__ == '__main__':
+    fname = DEFAULT_REQUEST
+    uplink = 10.0
+    repeat = 5
+    if len(sys.argv) > 1:
+        fname = sys.argv[1]
+    if len(sys.argv) > 2:
+        uplink = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        repeat = int(sys.argv[3])
+
+    with open(fname, 'r') as f:
+        data = json.loads(f.read())
+    body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+    server = start_stub_server()
+    print("Request: %s (%d bytes compact JSON), uplink %0.1f Mbit/s" % (fname, len(body), uplink))
+    print("\t%-8s %5s %10s %7s %10s %10s %10s" % ('encoding', 'level', 'bytes', 'ratio', 'compress', 'upload', 'saved'))
+
+    base = None
+    for encoding in [ None ] + supported_encodings():
+        h = measure(server, data, encoding, repeat)
+        wire = h['wire-bytes'] // repeat
+        level = '-'
+        compress_time = 0.0
+        if encoding:
+            level = str(choose_level(len(body), encoding))
+            start = time.perf_counter()
+            compress_body(body, encoding)
+            compress_time = time.perf_counter() - start
+        upload = upload_seconds(wire, uplink)
+        if base is None:
+            base = upload
+        saved = base - (upload + compress_time)
+        print("\t%-8s %5s %10d %6.2fx %9.1fms %9.1fms %9.1fms" % (encoding or 'identity', level, wire, h['ratio'], compress_time * 1000, upload * 1000, saved * 1000))
+
+    server.shutdown()
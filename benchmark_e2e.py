@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# End-to-end benchmark of the request submission path.
+#
+# Each request goes through the whole client path: build the AnalysisRequest
+# from the ECG JSON files, serialize and POST it through the shared client,
+# decode the AnalysisResult, and extract every attachment the way
+# 5.1_list_extract_attachments.py does. Requests are sent from a thread
+# pool at the given concurrency, for each analysis type the examples use:
+#   mcg-aggregate       : ecg_1-3, outputs as in multiple_output_request.py
+#   mcg-differential    : ecg_pre_1-5 vs. ecg_post_1-3, outputs as in
+#                         differential_analysis_request.py
+#   ecg-tracing-quality : ecg_1-3
+#
+# The stand-in server (mcg_stub_server.py) runs in a separate process, so
+# the CPU time reported is the client's alone. Results are printed and
+# saved as JSON; if a baseline JSON from an earlier run is given, the
+# change in each metric is printed too. The client's own per-phase timings
+# (mcg_timing.py) are included for each analysis type.
+#
+# Usage: python benchmark_e2e.py [num_requests] [concurrency] [latency] [output.json] [baseline.json]
+
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from mcg_client import MCGClient, decode_response, retrieve_attachment
+from mcg_timing import PHASES, TimingRecorder
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+STUB_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mcg_stub_server.py')
+DEFAULT_OUTPUT = 'benchmark_e2e.json'
+
+SCENARIOS = {
+    'mcg-aggregate': {
+        'inputs': [ ('ecg_%d' % (x+1), None) for x in range(3) ],
+        'options': { 'diagnosis-matrix': True },
+        'output': {
+            'result-json': { 'in-place-json': True },
+            'result-explain-json': { 'in-place-json': True },
+            'feature-json': { 'in-place-json': True },
+            'transform-json': { 'in-place-json': True },
+            'transform-heatmap': { },
+            'report-json': { 'in-place-json': True }
+        }
+    },
+    'mcg-differential': {
+        'inputs': [ ('ecg_pre_%d' % (x+1), 'pre') for x in range(5) ] +
+                  [ ('ecg_post_%d' % (x+1), 'post') for x in range(3) ],
+        'options': { },
+        'output': {
+            'result-diff-csv': { 'delimiter': '|' },
+            'result-json': { 'in-place-json': True },
+            'transform-heatmap': { },
+            'transform-json': { 'in-place-json': True }
+        }
+    },
+    'ecg-tracing-quality': {
+        'inputs': [ ('ecg_%d' % (x+1), None) for x in range(3) ],
+        'options': { },
+        'output': { }
+    }
+}
+
+# metrics compared against the baseline: lower is better for all of them
+COMPARED = [ ('latency', 'p50'), ('latency', 'p95'), ('latency', 'p99'),
+             ('cpu-per-request', None), ('bytes-up-per-request', None),
+             ('bytes-down-per-request', None) ]
+
+def load_ecg_files(scenario):
+    files = { }
+    for name, group in scenario['inputs']:
+        with open(os.path.join(DATA_DIR, name + '.json'), 'r') as f:
+            files[name] = f.read()
+    return files
+
+def input_for_ecg_json(json_str, age=40, gender='M'):
+    ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return {
+      "type": "ecg",
+      "format": "json",
+      "timestamp": ts,
+      "age": age,
+      "gender": gender,
+      "data": json.loads(json_str)
+    }
+
+def build_request(analysis_type, scenario, files):
+    inputs = [ ]
+    for name, group in scenario['inputs']:
+        h_input = input_for_ecg_json(files[name])
+        h_input['name'] = name
+        if group:
+            h_input['group'] = group
+        inputs.append(h_input)
+    return {
+      "object-type": "analysis-request",
+      "analysis": {
+        "type": analysis_type,
+        "options": scenario['options']
+      },
+      "output": scenario['output'],
+      "input": inputs,
+      "comment": "(FAKE DATA) Generated by " + os.path.basename(__file__)
+    }
+
+def percentile(values, pct):
+    # nearest-rank percentile of a sorted list
+    if not values:
+        return None
+    idx = max(0, min(len(values) - 1, int(math.ceil(pct / 100.0 * len(values))) - 1))
+    return values[idx]
+
+# ----------------------------------------------------------------------
+# STUB SERVER
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def start_stub_process(latency, jitter=0.0):
+    port = free_port()
+    proc = subprocess.Popen([ sys.executable, STUB_SERVER, str(port), str(latency), str(jitter) ],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return proc, "http://127.0.0.1:%d/api/v1/analyze" % port
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("Stub server did not start on port %d" % port)
+
+# ----------------------------------------------------------------------
+# BENCHMARK
+
+# Submit one request through the full path; returns per-request metrics
+def submit_one(client, url, token, analysis_type, scenario, files, recorder):
+    t0 = time.perf_counter()
+    data = build_request(analysis_type, scenario, files)
+    t1 = time.perf_counter()
+    resp = client.post(url, token, data)
+    t2 = time.perf_counter()
+    res = decode_response(resp)
+    t3 = time.perf_counter()
+    atts = 0
+    for att in res.get('attachments') or [ ]:
+        retrieve_attachment(att, recorder)
+        atts += 1
+    t4 = time.perf_counter()
+    return {
+        'ok': res.get('object-type') == 'analysis-result',
+        'latency': t4 - t0,
+        'build': t1 - t0,
+        'post': t2 - t1,
+        'decode': t3 - t2,
+        'extract': t4 - t3,
+        'bytes-up': len(resp.request.body or b''),
+        'bytes-down': len(resp.content),
+        'attachments': atts
+    }
+
+def run_scenario(url, token, analysis_type, num_requests, concurrency):
+    scenario = SCENARIOS[analysis_type]
+    files = load_ecg_files(scenario)
+    recorder = TimingRecorder()
+    client = MCGClient(pool_maxsize=concurrency, timings=recorder)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # warm up connections (and the server) before measuring
+        list(pool.map(lambda i: submit_one(client, url, token, analysis_type, scenario, files, recorder),
+                      range(concurrency)))
+
+        recorder.reset()
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        samples = list(pool.map(lambda i: submit_one(client, url, token, analysis_type, scenario, files, recorder),
+                                range(num_requests)))
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+    client.close()
+
+    latencies = sorted(s['latency'] for s in samples)
+    h = {
+        'requests': num_requests,
+        'failed': len([ s for s in samples if not s['ok'] ]),
+        'elapsed': elapsed,
+        'requests-per-second': num_requests / elapsed,
+        'latency': {
+            'mean': sum(latencies) / len(latencies),
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1]
+        },
+        'phases': { phase: sum(s[phase] for s in samples) / len(samples)
+                    for phase in [ 'build', 'post', 'decode', 'extract' ] },
+        'bytes-up': sum(s['bytes-up'] for s in samples),
+        'bytes-down': sum(s['bytes-down'] for s in samples),
+        'attachments-per-request': samples[0]['attachments'],
+        'cpu': cpu,
+        'cpu-per-request': cpu / num_requests,
+        'timings': recorder.report()
+    }
+    h['bytes-up-per-request'] = h['bytes-up'] / num_requests
+    h['bytes-down-per-request'] = h['bytes-down'] / num_requests
+    return h
+
+def print_scenario(name, h):
+    lat = h['latency']
+    print("%s: %d requests (%d failed) in %0.2fs  %0.1f req/s" % (name, h['requests'], h['failed'], h['elapsed'], h['requests-per-second']))
+    print("\tLatency  p50: %7.1fms  p95: %7.1fms  p99: %7.1fms  max: %7.1fms" % (lat['p50'] * 1000, lat['p95'] * 1000, lat['p99'] * 1000, lat['max'] * 1000))
+    print("\tPhases   " + "  ".join("%s: %0.1fms" % (k, v * 1000) for k, v in h['phases'].items()))
+    print("\tBytes    up: %d/req  down: %d/req  (%d attachments)" % (h['bytes-up-per-request'], h['bytes-down-per-request'], h['attachments-per-request']))
+    print("\tCPU      %0.1fms/req" % (h['cpu-per-request'] * 1000))
+    mean = h['timings']['mean']
+    print("\tClient   " + "  ".join("%s: %0.1fms" % (k, mean[k] * 1000) for k in PHASES) + "  (%d connections)" % h['timings']['connections'])
+
+def metric(h, key, sub):
+    v = h.get(key)
+    if sub is not None and isinstance(v, dict):
+        v = v.get(sub)
+    return v
+
+def print_comparison(report, baseline):
+    print("Change vs. baseline from %s:" % baseline.get('timestamp', '?'))
+    for name, h in report['scenarios'].items():
+        old = baseline.get('scenarios', { }).get(name)
+        if not old:
+            continue
+        changes = [ ]
+        for key, sub in [ ('requests-per-second', None) ] + COMPARED:
+            a = metric(old, key, sub)
+            b = metric(h, key, sub)
+            if a:
+                changes.append("%s %+0.1f%%" % (sub or key, 100.0 * (b - a) / a))
+        print("\t%s: %s" % (name, "  ".join(changes)))
+
+if __name__ == '__main__':
+    num_requests = 50
+    concurrency = 8
+    latency = 0.05
+    output = DEFAULT_OUTPUT
+    baseline = None
+    if len(sys.argv) > 1:
+        num_requests = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        concurrency = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        latency = float(sys.argv[3])
+    if len(sys.argv) > 4:
+        output = sys.argv[4]
+    if len(sys.argv) > 5:
+        with open(sys.argv[5], 'r') as f:
+            baseline = json.loads(f.read())
+
+    proc, url = start_stub_process(latency)
+    token = "stub-token"
+    print("Benchmarking %d requests per analysis type, concurrency %d, against %s (latency %0.3fs)" % (num_requests, concurrency, url, latency))
+    report = {
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'config': { 'requests': num_requests, 'concurrency': concurrency,
+                    'latency': latency, 'compression': os.environ.get('MCG_API_COMPRESSION') },
+        'python': platform.python_version(),
+        'scenarios': { }
+    }
+    try:
+        for analysis_type in SCENARIOS:
+            h = run_scenario(url, token, analysis_type, num_requests, concurrency)
+            report['scenarios'][analysis_type] = h
+            print_scenario(analysis_type, h)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    with open(output, 'w') as f:
+        f.write(json.dumps(report, indent=2))
+    print("Results saved to %s" % output)
+    if baseline is not None:
+        print_comparison(report, baseline)
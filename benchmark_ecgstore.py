@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Benchmark of the binary ECG store (mcg_ecgstore.py) against ECG JSON files.
+#
+# An archive of num_recordings recordings is made by copying the files in
+# data/ecg_*.json, once as JSON files and once as a store file. Reported:
+#   size        : bytes on disk
+#   one lead    : time to get one lead of one recording as an array (JSON:
+#                 parse the file; store: open the store and map the lead)
+#   all leads   : time to get every lead of every recording as an array
+#                 and sum it (so that every sample is read)
+#   RSS         : peak resident memory of a separate process reading all
+#                 leads, above that of a process that only imports numpy
+#
+# Usage: python benchmark_ecgstore.py [num_recordings]
+
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from mcg_ecgstore import ECGStore, write_store
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+def make_archive(tmp, num_recordings):
+    sources = sorted(glob.glob(os.path.join(DATA_DIR, 'ecg_*.json')))
+    json_dir = os.path.join(tmp, 'json')
+    os.makedirs(json_dir)
+    recordings = [ ]
+    for i in range(num_recordings):
+        src = sources[i % len(sources)]
+        name = "%s-%d" % (os.path.basename(src)[:-len('.json')], i)
+        with open(src, 'rb') as f:
+            raw = f.read()
+        with open(os.path.join(json_dir, name + '.json'), 'wb') as f:
+            f.write(raw)
+        recordings.append((name, json.loads(raw)))
+    store = os.path.join(tmp, 'archive.ecgs')
+    write_store(store, recordings)
+    return json_dir, store
+
+def json_files(json_dir):
+    return sorted(glob.glob(os.path.join(json_dir, '*.json')))
+
+def json_lead(path, lead):
+    with open(path, 'r') as f:
+        ecg = json.loads(f.read())
+    for sig in ecg['signals']:
+        if sig['name'] == lead:
+            return np.array(sig['data'])
+
+def json_all(json_dir):
+    arrays = [ ]
+    total = 0
+    for path in json_files(json_dir):
+        with open(path, 'r') as f:
+            ecg = json.loads(f.read())
+        for sig in ecg['signals']:
+            a = np.array(sig['data'], dtype=np.int32)
+            total += int(a.sum())
+            arrays.append(a)
+    return total, arrays
+
+def store_all(path):
+    arrays = [ ]
+    total = 0
+    store = ECGStore(path)
+    for name in store.names():
+        for lead in store.leads(name):
+            a = store.lead(name, lead)
+            total += int(a.sum(dtype=np.int64))
+            arrays.append(a)
+    return total, arrays
+
+def best_of(n, fn, *args):
+    times = [ ]
+    for i in range(n):
+        start = time.perf_counter()
+        res = fn(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), res
+
+# Peak RSS of this process in KB. ru_maxrss can include the parent's RSS at
+# fork time on Linux, so VmHWM (reset by exec) is used where available.
+def max_rss_kb():
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# Peak RSS of a child process reading all leads (mode: 'json', 'store' or
+# 'none'), in KB
+def child_rss(mode, target):
+    out = subprocess.check_output([ sys.executable, os.path.abspath(__file__), 'rss', mode, target ])
+    return int(out)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'rss':
+        mode, target = sys.argv[2], sys.argv[3]
+        if mode == 'json':
+            res = json_all(target)
+        elif mode == 'store':
+            res = store_all(target)
+        print(max_rss_kb())
+        sys.exit(0)
+
+    num_recordings = 500
+    if len(sys.argv) > 1:
+        num_recordings = int(sys.argv[1])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_dir, store = make_archive(tmp, num_recordings)
+        files = json_files(json_dir)
+        json_size = sum([ os.path.getsize(p) for p in files ])
+        store_size = os.path.getsize(store)
+        name = os.path.basename(files[0])[:-len('.json')]
+
+        t_json_one, a = best_of(5, json_lead, files[0], 'II')
+        t_store_one, b = best_of(5, lambda: ECGStore(store).lead(name, 'II'))
+        assert np.array_equal(a, b)
+        store_open = ECGStore(store)
+        t_store_lead, b = best_of(5, store_open.lead, name, 'II')
+        t_json_all, (sum_json, arrays) = best_of(3, json_all, json_dir)
+        del arrays
+        t_store_all, (sum_store, arrays) = best_of(3, store_all, store)
+        del arrays
+        assert sum_json == sum_store
+
+        base = child_rss('none', tmp)
+        rss_json = child_rss('json', json_dir) - base
+        rss_store = child_rss('store', store) - base
+
+        print("%d recordings (copies of data/ecg_*.json)" % num_recordings)
+        print("\t%-10s %12s %16s %16s %12s" % ('format', 'size', 'one lead', 'all leads', 'RSS'))
+        print("\t%-10s %10dKB %14.3fms %14.1fms %10dKB" % ('JSON', json_size // 1024, t_json_one * 1000, t_json_all * 1000, rss_json))
+        print("\t%-10s %10dKB %14.3fms %14.1fms %10dKB" % ('store', store_size // 1024, t_store_one * 1000, t_store_all * 1000, rss_store))
+        print("\tLead of an open store: %0.4fms" % (t_store_lead * 1000))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Benchmark of hedged requests (mcg_hedge.py) against a server with a
+# long latency tail.
+#
+# An interactive caller sends ecg-tracing-quality requests one at a time
+# to the stub server, whose service time has a log-normal jitter. The
+# same sequence is run with a plain client and with a hedging client, and
+# the latency percentiles and the number of duplicates sent are compared.
+# The hedging client warms up its latency window first.
+#
+# Usage: python benchmark_hedge.py [num_requests] [latency] [jitter] [percentile] [max_rate]
+
+import sys
+import time
+from benchmark_e2e import SCENARIOS, build_request, load_ecg_files, start_stub_process
+from mcg_client import MCGClient, decode_response
+from mcg_hedge import HedgePolicy
+from mcg_timing import percentile
+
+ANALYSIS_TYPE = 'ecg-tracing-quality'
+
+def run(client, url, token, data, num_requests):
+    latencies = [ ]
+    failed = 0
+    for i in range(num_requests):
+        start = time.perf_counter()
+        res = decode_response(client.post(url, token, data))
+        latencies.append(time.perf_counter() - start)
+        if res.get('object-type') != 'analysis-result':
+            failed += 1
+    return latencies, failed
+
+def print_line(name, latencies, failed, extra=''):
+    print("\t%-8s: p50 %6.1fms  p95 %6.1fms  p99 %6.1fms  max %6.1fms  (%d failed)%s" % (name, percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000, percentile(latencies, 99) * 1000, max(latencies) * 1000, failed, extra))
+
+if __name__ == '__main__':
+    num_requests = 300
+    latency = 0.05
+    jitter = 0.8
+    pct = 90
+    max_rate = 5.0
+    if len(sys.argv) > 1:
+        num_requests = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        latency = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        jitter = float(sys.argv[3])
+    if len(sys.argv) > 4:
+        pct = float(sys.argv[4])
+    if len(sys.argv) > 5:
+        max_rate = float(sys.argv[5])
+
+    scenario = SCENARIOS[ANALYSIS_TYPE]
+    data = build_request(ANALYSIS_TYPE, scenario, load_ecg_files(scenario))
+    proc, url = start_stub_process(latency, jitter)
+    token = "stub-token"
+    print("Sending %d %s requests one at a time to %s (latency %0.3fs, jitter %0.2f)" % (num_requests, ANALYSIS_TYPE, url, latency, jitter))
+    try:
+        with MCGClient(hedge=False) as client:
+            latencies, failed = run(client, url, token, data, num_requests)
+        print_line('plain', latencies, failed)
+
+        policy = HedgePolicy(percentile=pct, max_rate=max_rate)
+        with MCGClient(hedge=policy) as client:
+            run(client, url, token, data, policy.min_samples)
+            h = policy.report()
+            latencies, failed = run(client, url, token, data, num_requests)
+        report = policy.report()
+        print_line('hedged', latencies, failed,
+                   "  hedged %d (%0.1f%%), won %d, capped %d, hedge after p%g %0.1fms" % (report['hedged'] - h['hedged'], 100.0 * (report['hedged'] - h['hedged']) / num_requests, report['hedge-won'] - h['hedge-won'], report['capped'] - h['capped'], pct, report['delay'][ANALYSIS_TYPE] * 1000))
+    finally:
+        proc.terminate()
+        proc.wait()
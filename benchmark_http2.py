@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Benchmark: pooled HTTP/1.1 vs. multiplexed HTTP/2 (mcg_http2.py).
+#
+# The same AnalysisRequests (ecg_1-3, mcg-aggregate) are sent from a thread
+# pool through a fresh MCGClient for each transport, against the stub
+# server running in a separate process. The stub accepts HTTP/2 with prior
+# knowledge (h2c) when the 'h2' package is installed. Reported per
+# transport: throughput, latency percentiles and the number of connections
+# opened. Connections are counted from a cold start, since their setup
+# (TCP, and TLS against the real server) is what HTTP/2 saves; the local
+# benchmark has no TLS, so the saving against the real server is larger.
+# The fallback run is a server without HTTP/2 reached through the HTTP/2
+# transport, which should keep up with the pooled HTTP/1.1 session.
+#
+# Requires httpx and h2 for the HTTP/2 run (pip install httpx[http2]).
+#
+# Usage: python benchmark_http2.py [num_requests] [concurrency] [latency]
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmark_e2e import SCENARIOS, build_request, load_ecg_files, start_stub_process
+from mcg_client import MCGClient, decode_response
+from mcg_http2 import http2_available
+from mcg_timing import TimingRecorder
+
+ANALYSIS_TYPE = 'mcg-aggregate'
+
+# name, MCGClient arguments
+TRANSPORTS = [
+    ('HTTP/1.1 pooled', { }),
+    ('HTTP/2 (h2c)', { 'http2': 'prior-knowledge' }),
+    # no negotiation over plain http: HTTP/1.1 through the HTTP/2 transport
+    ('HTTP/2 fallback', { 'http2': '1' }),
+]
+
+def run_transport(url, token, data, num_requests, concurrency, kwargs):
+    recorder = TimingRecorder(window=num_requests)
+    kwargs = dict({ 'pool_maxsize': concurrency }, **kwargs)
+    client = MCGClient(timings=recorder, **kwargs)
+    failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        for res in pool.map(lambda i: decode_response(client.post(url, token, data)),
+                            range(num_requests)):
+            if res.get('object-type') != 'analysis-result':
+                failed += 1
+        elapsed = time.perf_counter() - start
+    client.close()
+    h = recorder.report()
+    h['elapsed'] = elapsed
+    h['failed'] = failed
+    h['http-version'] = client.http_version
+    return h
+
+if __name__ == '__main__':
+    num_requests = 200
+    concurrency = 32
+    latency = 0.05
+    if len(sys.argv) > 1:
+        num_requests = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        concurrency = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        latency = float(sys.argv[3])
+
+    scenario = SCENARIOS[ANALYSIS_TYPE]
+    data = build_request(ANALYSIS_TYPE, scenario, load_ecg_files(scenario))
+    proc, url = start_stub_process(latency)
+    token = "stub-token"
+    print("Benchmarking %d %s requests, concurrency %d, against %s (latency %0.3fs)" % (num_requests, ANALYSIS_TYPE, concurrency, url, latency))
+    try:
+        for name, kwargs in TRANSPORTS:
+            if 'http2' in kwargs and not http2_available():
+                print("\t%-16s: skipped (pip install httpx[http2])" % name)
+                continue
+            h = run_transport(url, token, data, num_requests, concurrency, kwargs)
+            print("\t%-16s: %6.2fs  %6.1f req/s  p50 %6.1fms  p95 %6.1fms  p99 %6.1fms  connections %3d  (%s, %d failed)" % (name, h['elapsed'], num_requests / h['elapsed'], h['p50'] * 1000, h['p95'] * 1000, h['p99'] * 1000, h['connections'], h['http-version'], h['failed']))
+    finally:
+        proc.terminate()
+        proc.wait()
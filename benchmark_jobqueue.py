@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Benchmark of job queue state transitions (mcg_jobqueue.py).
+#
+# Jobs are added, then claimed in batches and completed by a few threads,
+# the way queue_batch_request.py drives the queue (without sending
+# anything). Each job makes two transitions (pending -> in-flight -> done).
+# Runs with batch_size 1 (a commit for every completion) and with the
+# default batched commits are compared.
+#
+# Usage: python benchmark_jobqueue.py [num_jobs] [threads] [claim_size]
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from mcg_jobqueue import JobQueue, DEFAULT_BATCH_SIZE
+
+def run(path, num_jobs, threads, claim_size, batch_size):
+    queue = JobQueue(path, batch_size=batch_size)
+    start = time.perf_counter()
+    queue.add_many(("job:%d" % i, 'requests.jsonl', i * 100, i + 1) for i in range(num_jobs))
+    added = time.perf_counter() - start
+
+    def worker():
+        while True:
+            jobs = queue.claim(claim_size)
+            if not jobs:
+                return
+            for job in jobs:
+                queue.done(job['id'], "results/%d.json" % job['id'], "INV-%d" % job['id'])
+
+    start = time.perf_counter()
+    pool = [ threading.Thread(target=worker) for i in range(threads) ]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    queue.flush()
+    elapsed = time.perf_counter() - start
+    counts = queue.counts()
+    queue.close()
+    return added, elapsed, counts
+
+if __name__ == '__main__':
+    num_jobs = 20000
+    threads = 4
+    claim_size = 16
+    if len(sys.argv) > 1:
+        num_jobs = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        threads = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        claim_size = int(sys.argv[3])
+
+    print("%d jobs, %d threads claiming %d at a time" % (num_jobs, threads, claim_size))
+    for batch_size in [ 1, DEFAULT_BATCH_SIZE ]:
+        with tempfile.TemporaryDirectory() as tmp:
+            added, elapsed, counts = run(os.path.join(tmp, 'queue.db'), num_jobs, threads, claim_size, batch_size)
+        print("\tbatch_size %4d: add %6.0f jobs/s  claim+done %7.0f transitions/s  (%d done)" % (batch_size, num_jobs / added, 2 * num_jobs / elapsed, counts['done']))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Benchmark of batched ECG preprocessing (mcg_preprocess.py).
+#
+# num_recordings synthetic recordings (mcg_synth.py) of leads V5 and II are
+# made at the given frequency, with gain 1000 and offset 2048, 82 seconds
+# long. They are converted to 100 Hz, gain 500 and offset 0 by:
+#   python lists : per sample, in Python: linear interpolation between the
+#                  two nearest samples, rescaling, and min/max counts for the
+#                  clipping check
+#   preprocess() : with the samples as lists (as parsed from JSON files)
+#                  and as numpy arrays (as from ECGStore or a device driver)
+# Reported are the time per recording and the difference between the
+# resampled leads of the list and preprocess() outputs, relative to the
+# peak-to-peak amplitude (linear interpolation is not an anti-aliasing
+# filter, so some difference is expected when the rate is reduced).
+#
+# Usage: python benchmark_preprocess.py [num_recordings] [frequency]
+
+import sys
+import time
+import numpy as np
+from mcg_preprocess import preprocess, DEFAULT_FREQUENCY, DEFAULT_GAIN, DEFAULT_OFFSET
+from mcg_synth import ECGGenerator
+
+DURATION = 81.92
+
+# Preprocess one recording with Python lists, sample by sample
+def preprocess_lists(ecg, frequency=DEFAULT_FREQUENCY, gain=DEFAULT_GAIN, offset=DEFAULT_OFFSET):
+    src = float(ecg['frequency'])
+    signals = [ ]
+    for sig in ecg['signals']:
+        x = sig['data']
+        lo = min(x)
+        hi = max(x)
+        at_limits = sum([ 1 for v in x if v == lo or v == hi ])
+        if at_limits > 0.01 * len(x):
+            return None
+        scale = gain / sig['gain']
+        m = int(len(x) * frequency / src)
+        out = [ ]
+        for j in range(m):
+            t = j * src / frequency
+            k = min(int(t), len(x) - 2)
+            v = x[k] + (x[k + 1] - x[k]) * (t - k)
+            out.append(int(round((v - sig['offset']) * scale + offset)))
+        signals.append(dict(sig, gain=gain, offset=offset, data=out))
+    return dict(ecg, frequency=frequency, signals=signals)
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    res = fn(*args)
+    return time.perf_counter() - start, res
+
+if __name__ == '__main__':
+    num_recordings = 200
+    frequency = 500
+    if len(sys.argv) > 1:
+        num_recordings = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        frequency = int(sys.argv[2])
+
+    gen = ECGGenerator(frequency=frequency, samples=int(DURATION * frequency),
+                       gain=1000.0, offset=2048, seed=1)
+    arrays = gen.arrays(num_recordings)
+    as_lists = [ ]
+    as_arrays = [ ]
+    for rec in arrays:
+        as_lists.append({ 'frequency': frequency, 'signals': [
+            { 'name': lead, 'gain': gen.gain, 'offset': gen.offset, 'data': a.tolist() }
+            for lead, a in zip(gen.leads, rec) ] })
+        as_arrays.append({ 'frequency': frequency, 'signals': [
+            { 'name': lead, 'gain': gen.gain, 'offset': gen.offset, 'data': a }
+            for lead, a in zip(gen.leads, rec) ] })
+
+    t_lists, res_lists = timed(lambda: [ preprocess_lists(ecg) for ecg in as_lists ])
+    t_batch, res_batch = timed(preprocess, as_lists)
+    t_arrays, res_arrays = timed(preprocess, as_arrays, DEFAULT_FREQUENCY, DEFAULT_GAIN, DEFAULT_OFFSET, None, 0.01, True)
+    rejected = len([ 1 for ecg, problems in res_batch if ecg is None ])
+
+    diffs = [ ]
+    for a, (b, problems) in zip(res_lists, res_batch):
+        if a is None or b is None:
+            continue
+        for sa, sb in zip(a['signals'], b['signals']):
+            n = min(len(sa['data']), len(sb['data']))
+            x = np.array(sa['data'][:n])
+            y = np.array(sb['data'][:n])
+            diffs.append(np.abs(x - y).mean() / max(1, np.ptp(y)))
+
+    print("%d recordings, leads %s, %d Hz -> %d Hz, %d samples per lead (%d rejected)" % (num_recordings, '/'.join(gen.leads), frequency, DEFAULT_FREQUENCY, gen.samples, rejected))
+    print("\t%-24s %12s %14s" % ('', 'total', 'per recording'))
+    print("\t%-24s %10.1fms %12.3fms" % ('python lists', t_lists * 1000, t_lists * 1000 / num_recordings))
+    print("\t%-24s %10.1fms %12.3fms  (%0.0fx)" % ('preprocess(), lists', t_batch * 1000, t_batch * 1000 / num_recordings, t_lists / t_batch))
+    print("\t%-24s %10.1fms %12.3fms  (%0.0fx)" % ('preprocess(), arrays', t_arrays * 1000, t_arrays * 1000 / num_recordings, t_lists / t_arrays))
+    if diffs:
+        print("\tMean difference, lists vs. preprocess(): %0.2f%% of peak-to-peak" % (100.0 * np.mean(diffs)))
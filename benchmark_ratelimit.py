@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Check of adaptive concurrency (mcg_ratelimit.py) against a healthy server.
+#
+# mcg-aggregate requests are sent from a thread pool through a client with
+# AdaptiveConcurrency to the stub server, which takes per_input seconds
+# longer for each input and never throttles. Scenarios:
+#   uniform : every request has 3 inputs
+#   mixed   : requests alternate between 1 and 6 inputs
+#   jitter  : 3 inputs, with a log-normal jitter (sigma 0.8) on the
+#             service time
+# Reported per scenario: time taken, the final concurrency limit and the
+# number of increases and decreases. A healthy server should never drive
+# the limit down to its minimum; if it does in any scenario, the exit
+# status is 1.
+#
+# Usage: python benchmark_ratelimit.py [num_requests] [threads] [latency] [per_input]
+
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from mcg_client import MCGClient, decode_response
+from mcg_ratelimit import AdaptiveConcurrency, RateController
+from mcg_stub_server import start_stub_server
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# name, input counts (cycled), jitter
+SCENARIOS = [
+    ('uniform', [ 3 ], 0.0),
+    ('mixed', [ 1, 6 ], 0.0),
+    ('jitter', [ 3 ], 0.8),
+]
+
+def build_request(ecg, count):
+    inputs = [ ]
+    for i in range(count):
+        inputs.append({ "type": "ecg", "format": "json", "age": 40, "gender": "M",
+                        "name": "ecg_%d" % i, "data": ecg })
+    return {
+      "object-type": "analysis-request",
+      "analysis": {
+        "type": "mcg-aggregate",
+        "options": { }
+      },
+      "output": { },
+      "input": inputs,
+      "comment": "(FAKE DATA) Generated by " + os.path.basename(__file__)
+    }
+
+def run(url, requests, threads):
+    limiter = RateController(concurrency=AdaptiveConcurrency(maximum=threads))
+    failed = 0
+    with MCGClient(pool_maxsize=threads, limiter=limiter, timings=False) as client:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for res in pool.map(lambda data: decode_response(client.post(url, 'stub-token', data)), requests):
+                if res.get('object-type') != 'analysis-result':
+                    failed += 1
+        elapsed = time.perf_counter() - start
+    return elapsed, failed, limiter.report()
+
+if __name__ == '__main__':
+    num_requests = 400
+    threads = 16
+    latency = 0.05
+    per_input = 0.01
+    if len(sys.argv) > 1:
+        num_requests = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        threads = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        latency = float(sys.argv[3])
+    if len(sys.argv) > 4:
+        per_input = float(sys.argv[4])
+
+    with open(os.path.join(DATA_DIR, 'ecg_1.json'), 'r') as f:
+        ecg = json.loads(f.read())
+    print("Sending %d mcg-aggregate requests from %d threads (latency %0.3fs + %0.3fs per input)" % (num_requests, threads, latency, per_input))
+    collapsed = [ ]
+    for name, counts, jitter in SCENARIOS:
+        requests = [ build_request(ecg, counts[i % len(counts)]) for i in range(num_requests) ]
+        server = start_stub_server(latency=latency, per_input=per_input, jitter=jitter, seed=1)
+        url = server.url
+        try:
+            elapsed, failed, h = run(url, requests, threads)
+        finally:
+            server.shutdown()
+            server.server_close()
+        if h['limit'] <= 1 and h['throttled'] == 0:
+            collapsed.append(name)
+        print("\t%-8s: %6.2fs  limit %2d  increases %4d  decreases %3d  throttled %d  (%d failed)" % (name, elapsed, h['limit'], h['increases'], h['decreases'], h['throttled'], failed))
+    if collapsed:
+        print("Concurrency limit collapsed without throttling: %s" % ', '.join(collapsed))
+        sys.exit(1)
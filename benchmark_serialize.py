@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Compare ways of building and serializing an AnalysisRequest body.
+#
+#   parsed + json    : input_for_ecg_json (json.loads) + json.dumps, as the
+#                      examples did before mcg_serialize.py
+#   parsed + splice  : input_for_ecg_json + serialize_request
+#   raw + splice     : input_for_raw_ecg (file bytes kept as RawJSON) +
+#                      serialize_request
+#   validated + splice : as raw + splice, but loading the file bytes with
+#                      validate=True, which parses them once for the input
+#                      checks of mcg_validate.py
+#   memcpy           : joining the raw file bytes, the lower bound
+#
+# Time is per request (build + serialize); memory is the Python heap held
+# by each queued (built but not yet serialized) request, from tracemalloc.
+#
+# Usage: python benchmark_serialize.py [repeat] [queued]
+
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from mcg_serialize import load_raw_ecg, input_for_raw_ecg, serialize_request, orjson
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+FILES = [ 'ecg_pre_%d.json' % (x+1) for x in range(5) ]
+
+def build_request(inputs):
+    return {
+      "object-type": "analysis-request",
+      "analysis": {
+        "type": "mcg-aggregate",
+        "options": {
+          "diagnosis-matrix": True
+        }
+      },
+      "output": { },
+      "input": inputs,
+      "comment": "(FAKE DATA) Generated by " + os.path.basename(__file__)
+    }
+
+def input_for_ecg_json(json_str, age=40, gender='M'):
+    ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return {
+      "type": "ecg",
+      "format": "json",
+      "timestamp": ts,
+      "age": age,
+      "gender": gender,
+      "data": json.loads(json_str)
+    }
+
+def build_parsed(texts, raws):
+    return build_request([ input_for_ecg_json(t) for t in texts ])
+
+def build_raw(texts, raws):
+    return build_request([ input_for_raw_ecg(r) for r in raws ])
+
+# as build_raw, but loading the files' text again so that each request
+# holds its own copy of the bytes (for the memory measurement)
+def build_raw_loaded(texts, raws):
+    return build_request([ input_for_raw_ecg(t) for t in texts ])
+
+def build_validated(texts, raws):
+    return build_request([ input_for_raw_ecg(t, validate=True) for t in texts ])
+
+def dumps_json(data):
+    return json.dumps(data).encode('utf-8')
+
+# name, build, serialize, build for the memory measurement
+METHODS = [
+    ('parsed + json', build_parsed, dumps_json, build_parsed),
+    ('parsed + splice', build_parsed, serialize_request, build_parsed),
+    ('raw + splice', build_raw, serialize_request, build_raw_loaded),
+    ('validated + splice', build_validated, serialize_request, build_validated),
+]
+
+def time_method(build, serialize, texts, raws, repeat):
+    size = 0
+    start = time.perf_counter()
+    for i in range(repeat):
+        size = len(serialize(build(texts, raws)))
+    return (time.perf_counter() - start) / repeat, size
+
+def time_memcpy(raws, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        b''.join(r.raw for r in raws)
+    return (time.perf_counter() - start) / repeat
+
+def queued_memory(build, texts, raws, queued):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    queue = [ build(texts, raws) for i in range(queued) ]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del queue
+    return (after - before) / queued
+
+if __name__ == '__main__':
+    repeat = 20
+    queued = 10
+    if len(sys.argv) > 1:
+        repeat = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        queued = int(sys.argv[2])
+
+    texts = [ ]
+    for fname in FILES:
+        with open(os.path.join(DATA_DIR, fname), 'r') as f:
+            texts.append(f.read())
+    raws = [ load_raw_ecg(t) for t in texts ]
+    print("Request with %d inputs (%d bytes of ECG JSON), orjson %s" % (len(texts), sum(len(r.raw) for r in raws), orjson.__version__ if orjson else 'not installed'))
+    print("\t%-20s %10s %10s %12s" % ('method', 'time', 'body', 'queued mem'))
+    for name, build, serialize, build_queued in METHODS:
+        elapsed, size = time_method(build, serialize, texts, raws, repeat)
+        mem = queued_memory(build_queued, texts, raws, queued)
+        print("\t%-20s %8.2fms %10d %10dKB" % (name, elapsed * 1000, size, mem / 1024))
+    elapsed = time_memcpy(raws, repeat)
+    print("\t%-20s %8.2fms" % ('memcpy', elapsed * 1000))
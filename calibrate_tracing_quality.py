@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Calibrate the local tracing quality estimate (mcg_quality.py) against
+# the API server's ecg-tracing-quality scores.
+#
+# The calibration set is every data/ecg_*.json recording, plus copies
+# degraded with added noise, baseline wander, or a too-low voltage (seeded,
+# so every run sends the same recordings). Each recording is sent as its
+# own ecg-tracing-quality request, and scored locally. The report gives,
+# for each score, the bias, mean and max absolute error, correlation and a
+# linear fit of the server's score on the local one, and how often the
+# threshold on the overall score agrees. The fit is printed as JSON for
+# use as estimate(recordings, calibration=...).
+#
+# Run this against the real API server before pre-screening recordings
+# with mcg_quality.prescreen(). The stub server's scores are synthesized,
+# so a fit against the stub is meaningless.
+#
+# Usage: python calibrate_tracing_quality.py [url] [threshold] [workers]
+
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from mcg_client import MCGClient, API_URL
+from mcg_quality import estimate, calibrate, calibration_fit, print_calibration
+from mcg_token import default_token_provider
+from tracing_quality_request import build_request
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# noise sigma and wander amplitude, as fractions of the peak-to-peak range
+NOISE_LEVELS = [ 0.01, 0.03, 0.06, 0.1 ]
+WANDER_LEVELS = [ 0.1, 0.25, 0.5 ]
+WANDER_HZ = 0.2
+LOW_VOLTAGE = 0.05
+
+def degrade(ecg, rng, noise=0.0, wander=0.0, scale=1.0):
+    ecg = dict(ecg)
+    freq = ecg.get('frequency') or 100
+    signals = [ ]
+    for sig in ecg['signals']:
+        x = np.array(sig['data'], dtype=np.float64)
+        mid = np.median(x)
+        span = x.max() - x.min()
+        x = mid + (x - mid) * scale
+        if noise:
+            x += rng.normal(0.0, noise * span, len(x))
+        if wander:
+            t = np.arange(len(x)) / float(freq)
+            x += wander * span * np.sin(2 * np.pi * WANDER_HZ * t + rng.uniform(0, 2 * np.pi))
+        signals.append(dict(sig, data=[ int(v) for v in np.rint(x) ]))
+    ecg['signals'] = signals
+    return ecg
+
+# [ (description, ECG JSON object) ] for the calibration set
+def calibration_set(seed=1):
+    rng = np.random.default_rng(seed)
+    res = [ ]
+    for fname in sorted(glob.glob(os.path.join(DATA_DIR, 'ecg_*.json'))):
+        with open(fname, 'r') as f:
+            ecg = json.loads(f.read())
+        name = os.path.basename(fname)
+        res.append((name, ecg))
+        for level in NOISE_LEVELS:
+            res.append(("%s noise %g" % (name, level), degrade(ecg, rng, noise=level)))
+        for level in WANDER_LEVELS:
+            res.append(("%s wander %g" % (name, level), degrade(ecg, rng, wander=level)))
+        res.append(("%s voltage x%g" % (name, LOW_VOLTAGE), degrade(ecg, rng, scale=LOW_VOLTAGE)))
+    return res
+
+def input_for_ecg(ecg):
+    return {
+      "type": "ecg",
+      "format": "json",
+      "age": 40,
+      "gender": 'M',
+      "data": ecg
+    }
+
+if __name__ == '__main__':
+    url = API_URL
+    threshold = 60
+    workers = 8
+    if len(sys.argv) > 1:
+        url = sys.argv[1]
+    if len(sys.argv) > 2:
+        threshold = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        workers = int(sys.argv[3])
+
+    recordings = calibration_set()
+    ecgs = [ ecg for name, ecg in recordings ]
+    start = time.perf_counter()
+    local = estimate(ecgs)
+    local_time = time.perf_counter() - start
+
+    token = default_token_provider()
+    token.get_token()
+    client = MCGClient(pool_maxsize=workers)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda ecg: client.analyze(url, token, build_request([ input_for_ecg(ecg) ])), ecgs))
+    server_time = time.perf_counter() - start
+
+    server = [ ]
+    pairs = [ ]
+    scored = [ ]
+    for (name, ecg), tq, res in zip(recordings, local, results):
+        if res.get('object-type') != 'analysis-result':
+            print("%s: %s" % (name, res.get('message')))
+            continue
+        server.append(res['results']['tracing-quality'])
+        pairs.append(tq)
+        scored.append(ecg)
+        print("\t%-28s local %3d  server %3d" % (name, tq['all']['tracing quality'], server[-1]['all']['tracing quality']))
+
+    print("Scored %d recordings locally in %0.1fms (%0.3fms each); server round trips took %0.2fs" % (len(ecgs), local_time * 1000, local_time * 1000 / len(ecgs), server_time))
+    report = calibrate(pairs, server, threshold)
+    print("Local vs. server scores:")
+    print_calibration(report)
+    fit = calibration_fit(report)
+    print("Calibration: %s" % json.dumps(fit))
+    print("Calibrated local vs. server scores:")
+    print_calibration(calibrate(estimate(scored, fit), server, threshold))
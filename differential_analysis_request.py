@@ -7,29 +7,11 @@ import json
 import math
 import os
 import random
-import requests
 import sys
 from datetime import datetime
 import pandas as pd
 import matplotlib.pyplot as plt
-
-TOKEN_PATH_KEY = 'MCG_API_TOKEN_FILE'
-TOKEN_KEY = 'MCG_API_TOKEN'
-
-def get_api_token():
-    if TOKEN_KEY in os.environ:
-        return os.environ[TOKEN_KEY]
-    elif TOKEN_PATH_KEY in os.environ:
-        with open(os.environ[TOKEN_PATH_KEY], 'r') as f:
-            return f.read().strip()
-    else:
-        raise "Missing token! Set either MCG_API_TOKEN or MCG_API_TOKEN_FILE in environment."
-
-def send_api_request(server_url, token, data):
-    header = { 'Authorization': token,
-               'Content-Type': 'application/json' }
-    response = requests.post(url=server_url, headers=header, json=data)
-    return response
+from mcg_client import get_api_token, send_api_request, decode_response
 
 def build_request(inputs):
     return {
@@ -66,15 +48,6 @@ def input_for_ecg_json(json_str, age=40, gender='M'):
       "data": json.loads(json_str)
     }
 
-def decode_response(resp):
-    if resp.status_code != 200:
-        return {
-                "object-type": "http-error",
-                "timestamp": str(datetime.now),
-                "message": "Unknown error: HTTP %d" % resp.status_code
-        }
-    return json.loads(resp.text)
-
 def print_results_summary(res, indent="\t"):
     if 'comment' in res:
         print(indent + "Comment: " + res['comment'])
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Submit a file of AnalysisRequests, running the full mcg-aggregate
+# analysis only on recordings of sufficient tracing quality.
+#
+# Each input (recording) of an mcg-aggregate request is first sent on its
+# own as an ecg-tracing-quality request. When all inputs of a request have
+# been scored, the request is gated on the threshold:
+#   drop : inputs scoring below the threshold are removed, and the request
+#          is sent with the remaining inputs (if any are left)
+#   flag : requests with an input below the threshold are not sent
+# Inputs whose quality check failed count as below the threshold. Both
+# stages share one worker pool: the full analysis of a request is sent as
+# soon as its inputs are scored, while the quality checks of later requests
+# are still running. Other requests are sent unchanged, and lines that
+# could not be read are written with their 'client-error' and counted as not
+# submitted.
+#
+# Results are written in completion order as
+#   {"line": N, "result": <AnalysisResult, error, or null if not sent>,
+#    "gate": {"tracing-quality": {input: score}, "below-threshold": [inputs],
+#             "errors": {input: message}, "submitted": true/false}}
+# ("gate" only for gated requests). See jsonl_batch_request.py for the
+# input format, retries and rate limiting.
+#
+# Usage: python gated_batch_request.py requests.jsonl results.jsonl [threshold] [drop|flag] [url] [workers]
+
+import copy
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from jsonl_batch_request import DEFAULT_WORKERS, read_requests, build_client, submit_request
+from mcg_client import API_URL
+from mcg_metrics import shutdown_exporters
+from mcg_token import default_token_provider
+
+DEFAULT_THRESHOLD = 60
+MODES = [ 'drop', 'flag' ]
+GATED_TYPES = [ 'mcg-aggregate' ]
+
+def input_name(h_input, idx):
+    if isinstance(h_input, dict) and h_input.get('name'):
+        return str(h_input['name'])
+    return str(idx)
+
+def is_gated(data):
+    analysis = data.get('analysis')
+    return isinstance(analysis, dict) and analysis.get('type') in GATED_TYPES and \
+           isinstance(data.get('input'), list) and len(data['input']) > 0
+
+# ecg-tracing-quality request for one input of a request
+def quality_request(h_input):
+    return {
+      "object-type": "analysis-request",
+      "analysis": {
+        "type": "ecg-tracing-quality",
+        "options": { }
+      },
+      "output": {
+      },
+      "input": [ h_input ]
+    }
+
+# Overall tracing quality from an ecg-tracing-quality result, or None
+def quality_score(result):
+    if result.get('object-type') != 'analysis-result':
+        return None
+    try:
+        return result['results']['tracing-quality']['all']['tracing quality']
+    except (KeyError, TypeError):
+        return None
+
+class GatedRequest:
+    def __init__(self, data):
+        self.data = data
+        self.names = [ input_name(h, idx) for idx, h in enumerate(data['input']) ]
+        self.scores = { }
+        self.errors = { }
+        self.remaining = len(self.names)
+
+    def add_score(self, idx, result):
+        name = self.names[idx]
+        score = quality_score(result)
+        if score is None:
+            self.errors[name] = result.get('message') or result.get('object-type')
+        else:
+            self.scores[name] = score
+        self.remaining -= 1
+
+    # Return (request to send or None, gate record)
+    def gate(self, threshold, mode):
+        keep = [ name not in self.errors and self.scores[name] >= threshold
+                 for name in self.names ]
+        below = [ name for name, ok in zip(self.names, keep) if not ok ]
+        gated = None
+        if not below:
+            gated = self.data
+        elif mode == 'drop' and any(keep):
+            gated = copy.copy(self.data)
+            gated['input'] = [ h for h, ok in zip(self.data['input'], keep) if ok ]
+        h = {
+          'tracing-quality': self.scores,
+          'below-threshold': below,
+          'submitted': gated is not None
+        }
+        if self.errors:
+            h['errors'] = self.errors
+        return gated, h
+
+def write_result(out, lineno, result, gate=None):
+    h = { 'line': lineno, 'result': result }
+    if gate is not None:
+        h['gate'] = gate
+    out.write(json.dumps(h))
+    out.write('\n')
+    out.flush()
+
+# Submit every request in infile through the quality gate and write results
+# to outfile. Returns a dict of counts.
+def run_pipeline(infile, outfile, url, token, threshold=DEFAULT_THRESHOLD, mode='drop',
+                 workers=DEFAULT_WORKERS, client=None):
+    if mode not in MODES:
+        raise ValueError("Unknown gate mode '%s'" % mode)
+    if client is None:
+        client = build_client(workers)
+    max_pending = workers * 2
+    stats = dict.fromkeys([ 'requests', 'quality-checks', 'below-threshold',
+                            'submitted', 'failed', 'not-submitted' ], 0)
+    # future : (line number, gate record, GatedRequest, input index); the
+    # last two are only set for quality checks
+    pending = { }
+
+    def submit(data, lineno, gate=None, req=None, idx=None):
+        pending[pool.submit(submit_request, client, url, token, data)] = (lineno, gate, req, idx)
+
+    def collect():
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            lineno, gate, req, idx = pending.pop(fut)
+            result = fut.result()
+            if req is None:
+                if result.get('object-type') != 'analysis-result':
+                    stats['failed'] += 1
+                write_result(out, lineno, result, gate)
+                continue
+            req.add_score(idx, result)
+            if req.remaining > 0:
+                continue
+            # all inputs scored: send the full analysis now
+            gated, gate = req.gate(threshold, mode)
+            stats['below-threshold'] += len(gate['below-threshold'])
+            if gated is None:
+                stats['not-submitted'] += 1
+                write_result(out, lineno, None, gate)
+            else:
+                stats['submitted'] += 1
+                submit(gated, lineno, gate)
+
+    with open(infile, 'r') as f, open(outfile, 'w') as out, \
+         ThreadPoolExecutor(max_workers=workers) as pool:
+        for lineno, data in read_requests(f):
+            while len(pending) >= max_pending:
+                collect()
+            stats['requests'] += 1
+            if data.get('object-type') == 'client-error':
+                stats['not-submitted'] += 1
+                write_result(out, lineno, data)
+            elif data.get('object-type') == 'analysis-request' and is_gated(data):
+                req = GatedRequest(data)
+                for idx, h_input in enumerate(data['input']):
+                    while len(pending) >= max_pending:
+                        collect()
+                    submit(quality_request(h_input), lineno, None, req, idx)
+                    stats['quality-checks'] += 1
+            else:
+                stats['submitted'] += 1
+                submit(data, lineno)
+        while pending:
+            collect()
+    return stats
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.stderr.write("Usage: %s requests.jsonl results.jsonl [threshold] [drop|flag] [url] [workers]\n" % sys.argv[0])
+        sys.exit(-1)
+
+    infile = sys.argv[1]
+    outfile = sys.argv[2]
+    threshold = DEFAULT_THRESHOLD
+    mode = 'drop'
+    url = API_URL
+    workers = DEFAULT_WORKERS
+    if len(sys.argv) > 3:
+        threshold = float(sys.argv[3])
+    if len(sys.argv) > 4:
+        mode = sys.argv[4]
+    if len(sys.argv) > 5:
+        url = sys.argv[5]
+    if len(sys.argv) > 6:
+        workers = int(sys.argv[6])
+    if mode not in MODES:
+        sys.stderr.write("Unknown mode '%s' (expected %s)\n" % (mode, ' or '.join(MODES)))
+        sys.exit(-1)
+
+    token = default_token_provider()
+    token.get_token()
+    client = build_client(workers)
+    try:
+        h = run_pipeline(infile, outfile, url, token, threshold, mode, workers, client)
+    finally:
+        shutdown_exporters()
+    print("Read %d requests. Results in %s" % (h['requests'], outfile))
+    print("Tracing quality checks: %d  Inputs below %g: %d" % (h['quality-checks'], threshold, h['below-threshold']))
+    print("Submitted: %d (%d failed)  Not submitted: %d" % (h['submitted'], h['failed'], h['not-submitted']))
+    if client.timings is not None:
+        print("Request timings:")
+        client.timings.print_report()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Submit a file of AnalysisRequests, one JSON object per line, and write
+# one result per line to an output JSONL file.
+#
+# Input lines are read lazily and at most 2x the worker count are held in
+# memory at once, so memory use does not depend on the size of the input.
+# Results are written in completion order as
+#   {"line": <input line number>, "result": <AnalysisResult or error>}
+# Blank lines are skipped; lines that are not a valid JSON object produce
+# a 'client-error' result and are not sent (nor counted as submitted).
+# Transient failures are retried with backoff (up to DEFAULT_MAX_ATTEMPTS
+# attempts, or MCG_API_MAX_ATTEMPTS), and a circuit breaker stops the run
+# from hammering a degraded API server. Set MCG_API_ADAPTIVE_CONCURRENCY=1
+# to adapt the number of requests in flight to the server's latency and
+# throttling (up to the worker count), and MCG_API_RATE_LIMIT to cap
+# requests per second. A summary of the client's per-phase request timings
+# (see mcg_timing.py) is printed at the end. Set MCG_API_METRICS_PORT or
+# MCG_API_METRICS_FILE to export Prometheus metrics while the batch runs
+# (see mcg_metrics.py).
+#
+# Usage: python jsonl_batch_request.py requests.jsonl results.jsonl [url] [workers]
+
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from mcg_client import MCGClient, API_URL, client_error, _env_int, _env_float, MAX_ATTEMPTS_KEY, RATE_LIMIT_KEY
+from mcg_metrics import shutdown_exporters
+from mcg_token import default_token_provider
+from mcg_ratelimit import AdaptiveConcurrency, RateController
+from mcg_retry import RetryPolicy, CircuitBreaker
+
+DEFAULT_WORKERS = 8
+# attempts per request when MCG_API_MAX_ATTEMPTS is not set (the client's
+# own default is 1, i.e. no retries)
+DEFAULT_MAX_ATTEMPTS = 4
+
+ADAPTIVE_KEY = 'MCG_API_ADAPTIVE_CONCURRENCY'
+
+# Yield (line number, request) for every non-blank line of the input file
+def read_requests(f):
+    for lineno, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield lineno, client_error("Invalid JSON in input: %s" % str(e))
+            continue
+        if not isinstance(data, dict):
+            data = client_error("Input is not a JSON object")
+        yield lineno, data
+
+# Client for a batch run: the environment settings of MCGClient apply, with
+# retries and a circuit breaker on by default, and adaptive concurrency (up
+# to the worker count) when MCG_API_ADAPTIVE_CONCURRENCY is set
+def build_client(workers):
+    rate = _env_float(RATE_LIMIT_KEY, None)
+    concurrency = None
+    if os.environ.get(ADAPTIVE_KEY, '0') != '0':
+        concurrency = AdaptiveConcurrency(maximum=workers)
+    limiter = None
+    if rate or concurrency is not None:
+        limiter = RateController(rate=rate, concurrency=concurrency)
+    retry = RetryPolicy(max_attempts=_env_int(MAX_ATTEMPTS_KEY, DEFAULT_MAX_ATTEMPTS))
+    return MCGClient(pool_maxsize=workers, retry=retry, breaker=CircuitBreaker(),
+                     limiter=limiter)
+
+def submit_request(client, url, token, data):
+    if data.get('object-type') == 'client-error':
+        return data
+    try:
+        return client.analyze(url, token, data)
+    except Exception as e:
+        return client_error("%s: %s" % (e.__class__.__name__, str(e)))
+
+def write_result(out, lineno, result):
+    out.write(json.dumps({ 'line': lineno, 'result': result }))
+    out.write('\n')
+    out.flush()
+
+# Wait for at least one pending request to finish and write its result.
+# Returns the number of completed requests that did not succeed.
+def collect_results(pending, out):
+    failed = 0
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for fut in done:
+        result = fut.result()
+        if result.get('object-type') != 'analysis-result':
+            failed += 1
+        write_result(out, pending.pop(fut), result)
+    return failed
+
+# Submit every request in infile and write results to outfile.
+# Returns (number submitted, number of non-analysis-result responses,
+# number of unreadable lines).
+def run_batch(infile, outfile, url, token, workers=DEFAULT_WORKERS, client=None):
+    if client is None:
+        client = build_client(workers)
+    max_pending = workers * 2
+    count = 0
+    failed = 0
+    unreadable = 0
+    with open(infile, 'r') as f, open(outfile, 'w') as out, \
+         ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = { }
+        for lineno, data in read_requests(f):
+            if data.get('object-type') == 'client-error':
+                unreadable += 1
+                write_result(out, lineno, data)
+                continue
+            if len(pending) >= max_pending:
+                failed += collect_results(pending, out)
+            pending[pool.submit(submit_request, client, url, token, data)] = lineno
+            count += 1
+        while pending:
+            failed += collect_results(pending, out)
+    return count, failed, unreadable
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.stderr.write("Usage: %s requests.jsonl results.jsonl [url] [workers]\n" % sys.argv[0])
+        sys.exit(-1)
+
+    infile = sys.argv[1]
+    outfile = sys.argv[2]
+    url = API_URL
+    workers = DEFAULT_WORKERS
+    if len(sys.argv) > 3:
+        url = sys.argv[3]
+    if len(sys.argv) > 4:
+        workers = int(sys.argv[4])
+
+    # the provider re-checks token expiry (and reloads a rotated token
+    # file) before each request of a long-running batch
+    token = default_token_provider()
+    token.get_token()
+    client = build_client(workers)
+    try:
+        count, failed, unreadable = run_batch(infile, outfile, url, token, workers, client)
+    finally:
+        # final values for the textfile collector
+        shutdown_exporters()
+    print("Submitted %d requests (%d failed), %d unreadable lines. Results in %s" % (count, failed, unreadable, outfile))
+    h = client.retry_stats.snapshot()
+    print("Attempts: %d  Retries: %d  Gave up: %d  Circuit open: %d" % (h['attempts'], h['retries'], h['gave-up'], h['circuit-open']))
+    for reason, n in h['failures'].items():
+        print("\t%s : %d" % (reason, n))
+    if client.limiter is not None:
+        h = client.limiter.report()
+        print("Concurrency limit: %d  Latency/baseline: %s  Throttled: %d" % (h['limit'], ("%0.2f" % h['latency-ratio']) if h['latency-ratio'] is not None else '-', h['throttled']))
+    if client.cache is not None:
+        h = client.cache.statistics()
+        print("Cache hits: %d  misses: %d  (%0.0f%%)" % (h['hits'], h['misses'], h['hit-rate'] * 100))
+    if client.timings is not None:
+        print("Request timings:")
+        client.timings.print_report()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Asyncio front-end for the shared MCG API client.
+#
+# Requests are sent through the pooled mcg_client.MCGClient on a thread
+# executor, so keep-alive connections are shared with the blocking examples.
+# A semaphore bounds the number of requests in flight; keep it at or below
+# the client's pool_maxsize, otherwise extra requests just wait for a
+# free connection.
+#
+# Identical requests submitted while one is already in flight (same server,
+# token and canonical request hash) are coalesced: the duplicate tasks
+# await the first task's result and use no concurrency slot of their own.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from mcg_client import default_client, client_error, coalesce_key
+
+DEFAULT_CONCURRENCY = 8
+
+class AsyncMCGClient:
+    # client      : blocking MCGClient to send through (default: shared client)
+    # concurrency : max number of requests in flight
+    # timeout     : default per-request timeout in seconds (None: no limit)
+    # coalesce    : share one in-flight request between identical submissions
+    def __init__(self, client=None, concurrency=DEFAULT_CONCURRENCY, timeout=None,
+                 coalesce=True):
+        self.client = client if client is not None else default_client()
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.coalesce = coalesce
+        self.inflight = { }
+        self.coalesced = 0
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency,
+                                           thread_name_prefix='mcg-async')
+
+    def _send(self, server_url, token, data, timeout, key):
+        return self.client.analyze(server_url, token, data, timeout=timeout, key=key)
+
+    async def _submit(self, server_url, token, data, timeout, key):
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            fut = loop.run_in_executor(self.executor, self._send,
+                                       server_url, token, data, timeout, key)
+            if timeout is None:
+                return await fut
+            return await asyncio.wait_for(fut, timeout)
+
+    # Submit one AnalysisRequest and return the decoded response. Raises
+    # asyncio.TimeoutError if no response arrives within the timeout.
+    # Coalesced results are shared between callers and must not be modified.
+    async def submit(self, server_url, token, data, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        if not self.coalesce:
+            return await self._submit(server_url, token, data, timeout, None)
+
+        key = coalesce_key(server_url, token, data)
+        shared = self.inflight.get(key)
+        if shared is not None:
+            self.coalesced += 1
+            if timeout is None:
+                return await asyncio.shield(shared)
+            return await asyncio.wait_for(asyncio.shield(shared), timeout)
+
+        shared = asyncio.get_running_loop().create_future()
+        self.inflight[key] = shared
+        try:
+            res = await self._submit(server_url, token, data, timeout, key)
+            shared.set_result(res)
+            return res
+        except asyncio.CancelledError:
+            shared.cancel()
+            raise
+        except BaseException as e:
+            shared.set_exception(e)
+            # mark the exception as retrieved in case nobody else awaits it
+            shared.exception()
+            raise
+        finally:
+            del self.inflight[key]
+
+    async def _submit_indexed(self, idx, server_url, token, data, timeout):
+        try:
+            res = await self.submit(server_url, token, data, timeout)
+        except asyncio.TimeoutError:
+            res = client_error("Timed out after %0.1fs" % timeout)
+        except Exception as e:
+            res = client_error("%s: %s" % (e.__class__.__name__, str(e)))
+        return idx, res
+
+    # Yield (index, result) for each request as it completes. Failures are
+    # reported as 'client-error' objects rather than raised, so one bad
+    # request does not abort the batch.
+    async def as_completed(self, server_url, token, requests, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        tasks = [ asyncio.ensure_future(self._submit_indexed(idx, server_url, token, data, timeout))
+                  for idx, data in enumerate(requests) ]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                yield await fut
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    # Submit all requests and return their results in input order.
+    async def gather(self, server_url, token, requests, timeout=None):
+        results = [ None ] * len(requests)
+        async for idx, res in self.as_completed(server_url, token, requests, timeout):
+            results[idx] = res
+        return results
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+# Blocking convenience wrapper for scripts without an event loop.
+def submit_batch(server_url, token, requests, concurrency=DEFAULT_CONCURRENCY, timeout=None):
+    async def run():
+        async with AsyncMCGClient(concurrency=concurrency, timeout=timeout) as client:
+            return await client.gather(server_url, token, requests)
+    return asyncio.run(run())
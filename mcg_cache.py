@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Content-addressed, disk-backed cache of AnalysisResults.
+#
+# Results are keyed by a SHA-256 hash of the canonical JSON form of the
+# request's 'analysis', 'output' and 'input' sections and the server URL
+# (so that results from a stub or test server sharing the cache directory
+# are never returned for production requests). Fields that change
+# on every submission without affecting the analysis (the input
+# 'timestamp' set by input_for_ecg_json, the request 'comment') are left
+# out, so resubmitting the same recordings hits the cache.
+#
+# Entries are gzip-compressed JSON files in the cache directory. They
+# expire after a TTL that may differ per analysis framework version
+# (results['framework']['version']), and the least recently used entries
+# are evicted when the cache exceeds max_bytes or max_entries. Only
+# 'analysis-result' objects are cached, never errors. Cache files are read
+# and written outside the cache's lock, so lookups run concurrently; an
+# expired or unreadable entry is only deleted if it is still the file that
+# was read, not a newer one stored by put() meanwhile. Temporary files left
+# by a put() that was interrupted are deleted when the cache is opened,
+# once they are older than TMP_MAX_AGE.
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from mcg_serialize import digest_default
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL = 30 * 24 * 3600
+
+# age in seconds after which a temporary file is taken to be left over from
+# an interrupted put() (rather than one being written by another process)
+TMP_MAX_AGE = 3600
+
+# input fields that do not affect the analysis
+VOLATILE_INPUT_FIELDS = [ 'timestamp' ]
+
+def canonical_request(data, server_url=None):
+    inputs = [ ]
+    for h_input in data.get('input') or [ ]:
+        if isinstance(h_input, dict):
+            h_input = { k: v for k, v in h_input.items() if k not in VOLATILE_INPUT_FIELDS }
+        inputs.append(h_input)
+    return {
+        'server': server_url,
+        'object-type': data.get('object-type'),
+        'analysis': data.get('analysis'),
+        'output': data.get('output'),
+        'input': inputs
+    }
+
+def request_key(data, server_url=None):
+    body = json.dumps(canonical_request(data, server_url), sort_keys=True, separators=(',', ':'),
+                      default=digest_default)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+def framework_version(result):
+    framework = result.get('framework')
+    if isinstance(framework, dict):
+        return framework.get('version')
+    return None
+
+class ResultCache:
+    # path           : cache directory (created if missing)
+    # max_bytes      : evict LRU entries when total size exceeds this
+    # max_entries    : evict LRU entries when there are more than this
+    # ttl            : default entry lifetime in seconds (None: no expiry)
+    # ttl_by_version : { framework version : ttl } overriding the default
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, max_entries=DEFAULT_MAX_ENTRIES,
+                 ttl=DEFAULT_TTL, ttl_by_version=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.ttl_by_version = ttl_by_version or { }
+        self.lock = threading.Lock()
+        self.stats = { 'hits': 0, 'misses': 0, 'expired': 0,
+                       'stores': 0, 'evictions': 0 }
+        os.makedirs(path, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        # { key : [size, last used] }, ordered on demand for eviction
+        self.index = { }
+        self.total_bytes = 0
+        now = time.time()
+        for fname in os.listdir(self.path):
+            try:
+                st = os.stat(os.path.join(self.path, fname))
+                if fname.endswith('.tmp') and now - st.st_mtime > TMP_MAX_AGE:
+                    os.remove(os.path.join(self.path, fname))
+            except FileNotFoundError:
+                continue
+            if not fname.endswith('.json.gz'):
+                continue
+            self.index[fname[:-len('.json.gz')]] = [ st.st_size, st.st_mtime ]
+            self.total_bytes += st.st_size
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.json.gz')
+
+    def _ttl_for(self, version):
+        return self.ttl_by_version.get(version, self.ttl)
+
+    # st : os.stat() of the entry's file when it was read; if given, the
+    #      entry is kept if its file has been replaced since
+    def _remove(self, key, st=None):
+        if st is not None:
+            try:
+                current = os.stat(self._file(key))
+            except FileNotFoundError:
+                current = None
+            if current is not None and (current.st_ino, current.st_dev) != (st.st_ino, st.st_dev):
+                return
+        size, _ = self.index.pop(key, [ 0, 0 ])
+        self.total_bytes -= size
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            pass
+
+    # Return the cached result for request data sent to server_url, or
+    # None. key may be given if request_key(data, server_url) has already
+    # been computed.
+    def get(self, data, key=None, server_url=None):
+        if key is None:
+            key = request_key(data, server_url)
+        with self.lock:
+            if key not in self.index:
+                self.stats['misses'] += 1
+                return None
+        st = None
+        try:
+            with open(self._file(key), 'rb') as raw:
+                st = os.fstat(raw.fileno())
+                with gzip.GzipFile(fileobj=raw) as f:
+                    entry = json.loads(f.read())
+        except FileNotFoundError:
+            # evicted meanwhile
+            with self.lock:
+                self.stats['misses'] += 1
+            return None
+        except (OSError, ValueError):
+            with self.lock:
+                self._remove(key, st)
+                self.stats['misses'] += 1
+            return None
+
+        now = time.time()
+        ttl = self._ttl_for(entry.get('framework-version'))
+        if ttl is not None and now - entry['stored-at'] > ttl:
+            with self.lock:
+                self._remove(key, st)
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+            return None
+
+        with self.lock:
+            if key in self.index:
+                self.index[key][1] = now
+            self.stats['hits'] += 1
+        try:
+            os.utime(self._file(key), (now, now))
+        except OSError:
+            pass
+        return entry['result']
+
+    # Store an AnalysisResult for request data sent to server_url. Other
+    # objects are ignored.
+    def put(self, data, result, key=None, server_url=None):
+        if result.get('object-type') != 'analysis-result':
+            return False
+        if key is None:
+            key = request_key(data, server_url)
+        entry = {
+            'stored-at': time.time(),
+            'framework-version': framework_version(result),
+            'result': result
+        }
+        body = gzip.compress(json.dumps(entry).encode('utf-8'), compresslevel=1)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        with self.lock:
+            # readers see either the old file or the new one; under the
+            # lock, so that get() cannot delete the new one as stale
+            os.replace(tmp, self._file(key))
+            if key in self.index:
+                self.total_bytes -= self.index[key][0]
+            self.index[key] = [ len(body), time.time() ]
+            self.total_bytes += len(body)
+            self.stats['stores'] += 1
+            self._evict()
+        return True
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes and len(self.index) <= self.max_entries:
+            return
+        for key, _ in sorted(self.index.items(), key=lambda kv: kv[1][1]):
+            if self.total_bytes <= self.max_bytes and len(self.index) <= self.max_entries:
+                break
+            self._remove(key)
+            self.stats['evictions'] += 1
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.index):
+                self._remove(key)
+
+    def statistics(self):
+        with self.lock:
+            h = dict(self.stats)
+            h['entries'] = len(self.index)
+            h['bytes'] = self.total_bytes
+        lookups = h['hits'] + h['misses']
+        h['hit-rate'] = (h['hits'] / lookups) if lookups else 0.0
+        return h
@@ -0,0 +1,525 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Shared HTTP client for the MCG API examples.
+#
+# All examples submit through a single long-lived requests.Session so that
+# TCP and TLS connections to the API server are kept alive and reused
+# between AnalysisRequests instead of being re-established for every POST.
+#
+# Pool sizing can be tuned from the environment:
+#   MCG_API_POOL_CONNECTIONS : number of hosts to keep connection pools for
+#   MCG_API_POOL_MAXSIZE     : max keep-alive connections per host
+#   MCG_API_TIMEOUT          : connect/read timeout in seconds (default: none)
+#   MCG_API_COMPRESSION      : Content-Encoding for request bodies
+#                              (gzip, deflate or zstd; default: none)
+#   MCG_API_MAX_ATTEMPTS     : attempts per request for transient failures
+#                              (default: 1, i.e. no retries; see mcg_retry.py)
+#   MCG_API_CACHE_DIR        : directory for cached AnalysisResults used by
+#                              analyze() (default: no cache; see mcg_cache.py)
+#   MCG_API_RATE_LIMIT       : max requests/second; also enables adaptive
+#                              concurrency up to pool_maxsize (default: off;
+#                              see mcg_ratelimit.py)
+#   MCG_API_VALIDATE         : set to 0 to send requests without checking
+#                              them locally first, or to 'inputs',
+#                              'extensions' or 'inputs,extensions' to add
+#                              those checks (see mcg_validate.py)
+#   MCG_API_TIMINGS          : set to 0 to turn off per-request phase
+#                              timings (see mcg_timing.py)
+#   MCG_API_METRICS_PORT     : serve Prometheus metrics on this local port
+#   MCG_API_METRICS_FILE     : write Prometheus metrics to this textfile
+#                              (see mcg_metrics.py)
+#   MCG_API_HTTP2            : '1' or 'prior-knowledge' to send requests
+#                              over HTTP/2 (see mcg_http2.py)
+#   MCG_API_HEDGE            : latency percentile after which a duplicate of
+#                              a slow request is sent (default: off; see
+#                              mcg_hedge.py)
+
+import base64
+import json
+import os
+import hashlib
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from datetime import datetime
+import requests
+from requests.adapters import HTTPAdapter
+from mcg_cache import ResultCache, request_key
+from mcg_compression import compress_body, check_encoding, accepted_encodings
+from mcg_hedge import hedge_from_env, hedged_call
+from mcg_http2 import HTTP2Session, http2_available
+from mcg_metrics import metrics_from_env
+from mcg_ratelimit import AdaptiveConcurrency, RateController, latency_key
+from mcg_retry import RetryPolicy, RetryStats, call_with_retry
+from mcg_serialize import serialize_request
+from mcg_timing import RequestTimings, TimedHTTPAdapter, TimedResponse, current, set_current, default_recorder
+from mcg_token import default_token_provider
+from mcg_validate import validate_request
+
+API_URL = "https://api.premierheart.com/api/v1/analyze"
+
+POOL_CONNECTIONS_KEY = 'MCG_API_POOL_CONNECTIONS'
+POOL_MAXSIZE_KEY = 'MCG_API_POOL_MAXSIZE'
+TIMEOUT_KEY = 'MCG_API_TIMEOUT'
+COMPRESSION_KEY = 'MCG_API_COMPRESSION'
+MAX_ATTEMPTS_KEY = 'MCG_API_MAX_ATTEMPTS'
+CACHE_DIR_KEY = 'MCG_API_CACHE_DIR'
+RATE_LIMIT_KEY = 'MCG_API_RATE_LIMIT'
+HTTP2_KEY = 'MCG_API_HTTP2'
+VALIDATE_KEY = 'MCG_API_VALIDATE'
+TIMINGS_KEY = 'MCG_API_TIMINGS'
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+
+# consecutive 415 answers to compressed requests after which compression
+# is switched off, when the server does not list the encodings it accepts
+COMPRESSION_REJECTS = 3
+
+# Get MCG API Token from OS environment (see mcg_token.py). The token is
+# cached and checked for expiry; to have it re-checked (and reloaded from
+# MCG_API_TOKEN_FILE) on every request, pass default_token_provider() to
+# send_api_request instead of the token string.
+def get_api_token():
+    return default_token_provider().get_token()
+
+def _env_int(key, default):
+    if key in os.environ:
+        return int(os.environ[key])
+    return default
+
+def _env_float(key, default):
+    if key in os.environ:
+        return float(os.environ[key])
+    return default
+
+class MCGClient:
+    # pool_connections : number of per-host pools cached by the session
+    # pool_maxsize     : connections kept alive per host; this is also the
+    #                    upper bound on concurrent requests to one host
+    # pool_block       : if True, threads wait for a free connection rather
+    #                    than opening (and discarding) extra ones
+    # compression      : Content-Encoding for request bodies, or None. If the
+    #                    server answers 415, the request is resent
+    #                    uncompressed. Compression is switched off when the
+    #                    415 lists accepted encodings (Accept-Encoding) that
+    #                    do not include it, or after COMPRESSION_REJECTS 415s
+    #                    in a row. Raises ValueError for an unknown encoding,
+    #                    or zstd without the zstandard package.
+    # retry            : mcg_retry.RetryPolicy for transient failures
+    # breaker          : mcg_retry.CircuitBreaker shared by all requests
+    # cache            : mcg_cache.ResultCache consulted by analyze()
+    # coalesce         : if True, identical requests made by analyze() while
+    #                    one is already in flight wait for its result
+    #                    instead of being sent again
+    # limiter          : mcg_ratelimit.RateController pacing every attempt
+    # validate         : if True, requests are checked locally and invalid
+    #                    ones are answered with the API server's 'error'
+    #                    object without being sent (counted in rejected);
+    #                    a string lists extra checks, comma-separated:
+    #                    'inputs' (an invalid input is answered with a
+    #                    'client-error') and 'extensions' (unknown analysis
+    #                    types and outputs are rejected; see mcg_validate.py)
+    # timings          : mcg_timing.TimingRecorder receiving the phase timings
+    #                    of every request (default: the process-wide
+    #                    recorder), or False to turn timings off
+    # metrics          : mcg_metrics.MCGMetrics collecting this client's
+    #                    requests (needs timings), or False for none
+    # http2            : mcg_http2 mode ('1' or 'prior-knowledge') to send
+    #                    requests over HTTP/2, multiplexed on as few
+    #                    connections as the server's stream limit allows
+    #                    (at most pool_maxsize, which a server answering in
+    #                    HTTP/1.1 needs). Falls back to the HTTP/1.1
+    #                    session if httpx/h2 are not installed.
+    #                    client.http_version is the protocol of the latest
+    #                    response (None before the first with HTTP/2), and
+    #                    each response has it in response.http_version.
+    # hedge            : mcg_hedge.HedgePolicy to send a duplicate of slow
+    #                    requests of billing-safe analysis types
+    # Retry counters are available from client.retry_stats.snapshot(), and
+    # current limits and latency from client.limiter.report().
+    def __init__(self, pool_connections=None, pool_maxsize=None,
+                 pool_block=True, timeout=None, compression=None,
+                 retry=None, breaker=None, cache=None, coalesce=True,
+                 limiter=None, validate=None, timings=None, metrics=None,
+                 http2=None, hedge=None):
+        if pool_connections is None:
+            pool_connections = _env_int(POOL_CONNECTIONS_KEY, DEFAULT_POOL_CONNECTIONS)
+        if pool_maxsize is None:
+            pool_maxsize = _env_int(POOL_MAXSIZE_KEY, DEFAULT_POOL_MAXSIZE)
+        if timeout is None:
+            timeout = _env_float(TIMEOUT_KEY, None)
+        if compression is None:
+            compression = os.environ.get(COMPRESSION_KEY) or None
+        if compression:
+            check_encoding(compression)
+        if retry is None:
+            retry = RetryPolicy(max_attempts=_env_int(MAX_ATTEMPTS_KEY, 1))
+        if cache is None and os.environ.get(CACHE_DIR_KEY):
+            cache = ResultCache(os.environ[CACHE_DIR_KEY])
+        if limiter is None and os.environ.get(RATE_LIMIT_KEY):
+            limiter = RateController(rate=_env_float(RATE_LIMIT_KEY, None),
+                                     concurrency=AdaptiveConcurrency(maximum=pool_maxsize))
+        if validate is None:
+            validate = os.environ.get(VALIDATE_KEY, '1')
+            validate = validate != '0' if validate in [ '0', '1' ] else validate
+        if timings is None and os.environ.get(TIMINGS_KEY, '1') != '0':
+            timings = default_recorder()
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self.compression = compression
+        self.compression_lock = threading.Lock()
+        self.compression_rejects = 0
+        self.retry = retry
+        self.breaker = breaker
+        self.cache = cache
+        self.coalesce = coalesce
+        self.limiter = limiter
+        self.validate = validate
+        self.rejected = 0
+        self.timings = timings or None
+        if metrics is None:
+            metrics = metrics_from_env()
+        if http2 is None:
+            http2 = os.environ.get(HTTP2_KEY) or None
+        if hedge is None:
+            hedge = hedge_from_env()
+        self.hedge = hedge or None
+        self.metrics = metrics or None
+        self.retry_stats = RetryStats()
+        self.inflight = { }
+        self.inflight_lock = threading.Lock()
+        self.coalesced = 0
+
+        if http2 and http2_available():
+            self.session = HTTP2Session(http2, max_connections=pool_maxsize)
+        else:
+            self.session = requests.Session()
+            self.session.headers.update({ 'Connection': 'keep-alive' })
+            adapter_class = TimedHTTPAdapter if self.timings is not None else HTTPAdapter
+            adapter = adapter_class(pool_connections=pool_connections,
+                                    pool_maxsize=pool_maxsize,
+                                    pool_block=pool_block)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+        if self.metrics is not None:
+            self.metrics.track_client(self)
+
+    # Protocol the server answered in: negotiated per connection with HTTP/2
+    @property
+    def http_version(self):
+        if isinstance(self.session, HTTP2Session):
+            return self.session.http_version
+        return 'HTTP/1.1'
+
+    # token may be a string or a mcg_token.TokenProvider; a provider is
+    # asked for a valid token on every attempt, before anything is uploaded
+    def build_headers(self, token):
+        if hasattr(token, 'get_token'):
+            token = token.get_token()
+        return { 'Authorization': token,
+                 'Content-Type': 'application/json' }
+
+    # stream : if True, the response body is not read until accessed
+    #          (see mcg_stream.py)
+    # The response has the request's mcg_timing.RequestTimings as
+    # response.timings (if timings are on). Unless streamed, the body is
+    # decoded and the record passed to the recorder before post() returns;
+    # a streamed response's record is passed on when the response is read
+    # or closed (see mcg_timing.TimedResponse).
+    def post(self, server_url, token, data, timeout=None, stream=False):
+        if self.validate and data is not None:
+            checks = self.validate.split(',') if isinstance(self.validate, str) else [ ]
+            h_err = validate_request(data, 'inputs' in checks, 'extensions' in checks)
+            if h_err is not None:
+                self.rejected += 1
+                return local_response(server_url, h_err)
+
+        hedge = None
+        headers = None
+        if self.hedge is not None and self.hedge.hedgeable(data):
+            hedge = self.hedge
+            if hedge.idempotency_header:
+                # the same key for every copy and retry of this request
+                headers = { hedge.idempotency_header: uuid.uuid4().hex }
+
+        analysis = None
+        if isinstance(data, dict) and isinstance(data.get('analysis'), dict):
+            analysis = data['analysis'].get('type')
+        limit_key = latency_key(data)
+
+        def attempt():
+            if hedge is None:
+                return self._post_once(server_url, token, data, timeout, stream)
+            return self._post_hedged(hedge, analysis, server_url, token, data, timeout, stream, headers, limit_key)
+
+        def send():
+            if self.limiter is None:
+                return attempt()
+            self.limiter.acquire()
+            if hedge is not None:
+                # released by hedged_call() when the primary copy completes,
+                # which may be after a duplicate has answered
+                return attempt()
+            start = time.monotonic()
+            try:
+                response = attempt()
+            except BaseException as e:
+                self.limiter.release(time.monotonic() - start, None, e, limit_key)
+                raise
+            self.limiter.release(time.monotonic() - start, response.status_code, None, limit_key)
+            return response
+        if self.timings is None:
+            return call_with_retry(send, self.retry, self.breaker, self.retry_stats)
+
+        rec = RequestTimings(server_url, self.timings)
+        rec.analysis = analysis
+        outer = current()
+        set_current(rec)
+        try:
+            response = call_with_retry(send, self.retry, self.breaker, self.retry_stats)
+        except Exception as e:
+            rec.outcome = e.__class__.__name__
+            rec.finish()
+            raise
+        finally:
+            set_current(outer)
+        rec.status = response.status_code
+        response.timings = rec
+        response.__class__ = TimedResponse
+        if not stream:
+            response.finish_downloaded()
+        return response
+
+    def _post_once(self, server_url, token, data, timeout, stream, headers=None):
+        if timeout is None:
+            timeout = self.timeout
+        rec = current()
+        header = self.build_headers(token)
+        if headers:
+            header.update(headers)
+        start = time.perf_counter()
+        body = serialize_request(data) if data is not None else None
+        if rec is not None:
+            rec.add('serialize', time.perf_counter() - start)
+        if not self.compression or body is None:
+            return self._send(server_url, header, body, timeout, stream)
+
+        start = time.perf_counter()
+        encoded, encoding = compress_body(body, self.compression)
+        if rec is not None:
+            rec.add('compress', time.perf_counter() - start)
+        if encoding:
+            header['Content-Encoding'] = encoding
+        response = self._send(server_url, header, encoded, timeout, stream)
+        if encoding and response.status_code == 415:
+            # not accepted compressed: resend this request as it is
+            self._compression_rejected(encoding, response)
+            del header['Content-Encoding']
+            response.close()
+            response = self._send(server_url, header, body, timeout, stream)
+        elif encoding and self.compression_rejects:
+            with self.compression_lock:
+                self.compression_rejects = 0
+        return response
+
+    # Switch compression off if the server does not support the encoding
+    def _compression_rejected(self, encoding, response):
+        accepted = accepted_encodings(response.headers)
+        with self.compression_lock:
+            self.compression_rejects += 1
+            if accepted is not None:
+                unsupported = encoding not in accepted
+            else:
+                unsupported = self.compression_rejects >= COMPRESSION_REJECTS
+            if unsupported and self.compression == encoding:
+                self.compression = None
+
+    # One attempt, hedged: each copy is timed separately, and the timings
+    # of the copy that answered are added to the request's record. With a
+    # limiter, the caller holds a slot for the primary copy.
+    def _post_hedged(self, hedge, analysis, server_url, token, data, timeout, stream, headers, limit_key=None):
+        rec = current()
+
+        def send_copy():
+            if rec is None:
+                return self._post_once(server_url, token, data, timeout, stream, headers)
+            copy = RequestTimings(server_url)
+            outer = current()
+            set_current(copy)
+            try:
+                response = self._post_once(server_url, token, data, timeout, stream, headers)
+            finally:
+                set_current(outer)
+            response.timings = copy
+            return response
+
+        response = hedged_call(hedge, analysis, send_copy, self.limiter, limit_key)
+        if rec is not None:
+            rec.merge(response.timings)
+        return response
+
+    def _send(self, server_url, header, body, timeout, stream):
+        rec = current()
+        if rec is None:
+            return self.session.post(url=server_url, headers=header, data=body,
+                                     timeout=timeout, stream=stream)
+        rec.attempts += 1
+        rec.headers_at = None
+        response = self.session.post(url=server_url, headers=header, data=body,
+                                     timeout=timeout, stream=stream)
+        if body is not None:
+            rec.bytes_up += len(body)
+        if not stream and rec.headers_at is not None:
+            # requests has read the whole body by now
+            rec.add('download', time.perf_counter() - rec.headers_at)
+            rec.bytes_down += len(response.content)
+        return response
+
+    # Send an AnalysisRequest and return the decoded response. The result
+    # cache (if any) is checked first, and if an identical request is
+    # already in flight on another thread, its result is shared rather than
+    # sending the request again. Shared results are the same object for
+    # every caller and must not be modified.
+    def analyze(self, server_url, token, data, timeout=None, key=None):
+        if key is None and (self.cache is not None or self.coalesce):
+            key = coalesce_key(server_url, token, data)
+        if self.cache is not None:
+            res = self.cache.get(data, key[2], server_url)
+            if res is not None:
+                return res
+        if not self.coalesce:
+            return self._analyze(server_url, token, data, timeout, key)
+
+        with self.inflight_lock:
+            fut = self.inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = Future()
+                self.inflight[key] = fut
+            else:
+                self.coalesced += 1
+        if not leader:
+            return fut.result(timeout)
+
+        try:
+            res = self._analyze(server_url, token, data, timeout, key)
+            fut.set_result(res)
+            return res
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self.inflight_lock:
+                del self.inflight[key]
+
+    def _analyze(self, server_url, token, data, timeout, key):
+        res = decode_response(self.post(server_url, token, data, timeout=timeout))
+        if self.cache is not None:
+            self.cache.put(data, res, key[2] if key else None, server_url)
+        return res
+
+    def close(self):
+        if self.metrics is not None:
+            self.metrics.untrack_client(self)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# ----------------------------------------------------------------------
+# Process-wide client shared by all examples
+
+_default_client = None
+_default_lock = threading.Lock()
+
+def default_client():
+    global _default_client
+    if _default_client is None:
+        with _default_lock:
+            if _default_client is None:
+                _default_client = MCGClient()
+    return _default_client
+
+def set_default_client(client):
+    global _default_client
+    with _default_lock:
+        _default_client = client
+
+# Key identifying duplicate requests: (server, account token, request hash).
+# A TokenProvider is identified by the object itself. The request hash
+# includes the server and is also the result cache key.
+def coalesce_key(server_url, token, data):
+    if isinstance(token, (str, bytes)):
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        token = hashlib.sha256(token).hexdigest()
+    elif token is not None:
+        token = id(token)
+    return (server_url, token, request_key(data, server_url))
+
+def send_api_request(server_url, token, data):
+    return default_client().post(server_url, token, data)
+
+def analyze(server_url, token, data):
+    return default_client().analyze(server_url, token, data)
+
+def client_error(message):
+    return {
+            "object-type": "client-error",
+            "timestamp": str(datetime.now()),
+            "message": message
+    }
+
+# A response carrying an object produced locally, as if the server had
+# returned it
+def local_response(server_url, h):
+    resp = requests.Response()
+    resp.status_code = 200
+    resp.url = server_url
+    resp.encoding = 'utf-8'
+    resp.headers['Content-Type'] = 'application/json'
+    resp._content = json.dumps(h).encode('utf-8')
+    resp._content_consumed = True
+    return resp
+
+def decode_response(resp):
+    timings = getattr(resp, 'timings', None)
+    if resp.status_code != 200:
+        if timings is not None:
+            timings.outcome = "http-%d" % resp.status_code
+            timings.finish()
+        return {
+                "object-type": "http-error",
+                "timestamp": str(datetime.now()),
+                "message": "Unknown error: HTTP %d" % resp.status_code
+        }
+    if timings is None:
+        return json.loads(resp.text)
+    if getattr(resp, 'decoded', None) is not None:
+        return resp.decoded
+    start = time.perf_counter()
+    res = json.loads(resp.content)
+    timings.add('decode', time.perf_counter() - start)
+    timings.outcome = res.get('object-type') if isinstance(res, dict) else None
+    timings.finish(res)
+    return res
+
+# Return the data of an attachment: base64 is decoded, and JSON strings
+# parsed. The time taken is added to the recorder's attachment timings.
+def retrieve_attachment(att, recorder=None):
+    start = time.perf_counter()
+    data = att['data']
+    if att['encoding'] == 'base64':
+        data = base64.b64decode(data)
+    if att['mime-type'] == 'application/json':
+        data = json.loads(data)
+    if recorder is None:
+        recorder = default_recorder()
+    recorder.record_attachments(time.perf_counter() - start)
+    return data
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Content-Encoding helpers for AnalysisRequest bodies.
+#
+# ECG inputs are sent as JSON integer arrays, which compress very well
+# (typically 4-6x with gzip). The compression level is chosen from the
+# payload size: small bodies are sent as-is, mid-sized ones get a high
+# level (cheap at that size), and very large ones a fast level so that
+# compression time does not eat the upload-time savings.
+#
+# zstd requires the optional 'zstandard' package (pip install zstandard).
+
+import gzip
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ENCODINGS = [ 'gzip', 'deflate', 'zstd' ]
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+DECODE_ERRORS = (OSError, EOFError, zlib.error)
+if zstandard is not None:
+    DECODE_ERRORS += (zstandard.ZstdError,)
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+# (max payload size, gzip/deflate level, zstd level), checked in order
+LEVELS_BY_SIZE = [
+    (   64 * 1024, 9, 9 ),
+    ( 1024 * 1024, 6, 6 ),
+    ( 8192 * 1024, 3, 3 ),
+    ( None,        1, 1 ),
+]
+
+def zstd_available():
+    return zstandard is not None
+
+def supported_encodings():
+    return [ enc for enc in ENCODINGS if enc != 'zstd' or zstd_available() ]
+
+# Raises ValueError if encoding cannot be used for request bodies here
+def check_encoding(encoding):
+    if encoding not in ENCODINGS:
+        raise ValueError("Unsupported Content-Encoding '%s' (expected one of %s)" % (encoding, ', '.join(ENCODINGS)))
+    if encoding == 'zstd' and not zstd_available():
+        raise ValueError("zstd encoding requires the 'zstandard' package")
+
+# Encodings listed in the Accept-Encoding header of a 415 response
+# (RFC 7694), or None if the server did not say
+def accepted_encodings(headers):
+    value = headers.get('Accept-Encoding')
+    if value is None:
+        return None
+    return [ e.split(';')[0].strip().lower() for e in value.split(',') if e.strip() ]
+
+def choose_level(size, encoding):
+    for max_size, zlib_level, zstd_level in LEVELS_BY_SIZE:
+        if max_size is None or size <= max_size:
+            if encoding == 'zstd':
+                return zstd_level
+            return zlib_level
+
+# Compress body (bytes) with the given Content-Encoding. Returns
+# (encoded body, encoding), where encoding is None if the body was left
+# uncompressed because it is too small.
+def compress_body(body, encoding, level=None):
+    if encoding not in ENCODINGS:
+        raise ValueError("Unsupported Content-Encoding '%s'" % encoding)
+    if len(body) < MIN_COMPRESS_SIZE:
+        return body, None
+    if level is None:
+        level = choose_level(len(body), encoding)
+
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=level, mtime=0), encoding
+    elif encoding == 'deflate':
+        # HTTP 'deflate' is the zlib format (RFC 1950), not raw deflate
+        return zlib.compress(body, level), encoding
+    else:
+        if not zstd_available():
+            raise ValueError("zstd encoding requires the 'zstandard' package")
+        return zstandard.ZstdCompressor(level=level).compress(body), encoding
+
+# Raises UnsupportedEncoding if the encoding is unsupported, or ValueError
+# if the body is corrupt
+def decompress_body(body, encoding):
+    if not encoding or encoding == 'identity':
+        return body
+    if encoding not in supported_encodings():
+        raise UnsupportedEncoding("Unsupported Content-Encoding '%s'" % encoding)
+    try:
+        if encoding == 'gzip':
+            return gzip.decompress(body)
+        elif encoding == 'deflate':
+            return zlib.decompress(body)
+        elif encoding == 'zstd' and zstd_available():
+            return zstandard.ZstdDecompressor().decompress(body)
+    except DECODE_ERRORS as e:
+        raise ValueError("Corrupt %s body: %s" % (encoding, str(e)))
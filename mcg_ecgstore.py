@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Compact binary store for ECG recordings, read through numpy.memmap.
+#
+# ECG JSON files (like data/ecg_pre_1.json) hold about 100 KB of decimal
+# text per recording and must be parsed completely to read one lead. A
+# store file keeps many recordings with each lead's samples as a raw
+# little-endian int16 array (int32 when the values do not fit, float64 if
+# they are not integers), and an index of the recordings by name:
+#   header   : 8-byte magic, uint64 offset of the index
+#   for each recording:
+#     data   : sample arrays, each aligned to 8 bytes
+#     meta   : JSON of the ECG JSON object (frequency, ratio, timestamp,
+#              ...) where each signal has its metadata (name, gain, offset,
+#              timestamp, ...) plus the dtype, count and position of its
+#              samples instead of 'data'
+#   index    : JSON { name : [ position, length ] of the recording's meta }
+# Only the index is read when a store is opened; a recording's metadata is
+# parsed when it is first used. All keys and values other than the
+# samples are kept as they were, so ecg_json() returns
+# the same object the JSON file held, in the shape input_for_ecg_json()
+# consumes (or input_for_raw_ecg(), see mcg_serialize.py).
+#
+# ECGStore maps the file once; lead() returns a read-only view of the
+# mapped samples, so only the pages actually read are loaded.
+#
+# Convert JSON files with:
+#   python mcg_ecgstore.py archive.ecgs data/ecg_*.json
+# (recordings are named after their file, without .json)
+#
+# Requires numpy.
+
+import json
+import os
+import struct
+import sys
+import numpy as np
+
+MAGIC = b'MCGECG1\x00'
+HEADER = struct.Struct('<8sQ')
+ALIGN = 8
+
+# Smallest lossless dtype for a lead's samples
+def sample_dtype(samples):
+    a = np.asarray(samples)
+    if a.size == 0:
+        return np.dtype('<i2')
+    if a.dtype.kind == 'f':
+        return np.dtype('<f8')
+    if a.dtype.kind not in 'iu':
+        raise ValueError("Samples are not numbers")
+    lo, hi = int(a.min()), int(a.max())
+    for dtype in [ '<i2', '<i4', '<i8' ]:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return np.dtype(dtype)
+    raise ValueError("Sample values out of range for int64")
+
+# Write recordings to a store file. recordings: iterable of (name, ECG JSON
+# object). The file is written to a temporary name and renamed when done.
+def write_store(path, recordings):
+    index = { }
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, 0))
+        for name, ecg in recordings:
+            if name in index:
+                raise ValueError("Duplicate recording name '%s'" % name)
+            h = { k: v for k, v in ecg.items() if k != 'signals' }
+            h['signals'] = [ ]
+            for sig in ecg.get('signals') or [ ]:
+                samples = sig.get('data') or [ ]
+                dtype = sample_dtype(samples)
+                a = np.asarray(samples, dtype=dtype)
+                pad = -f.tell() % ALIGN
+                f.write(b'\x00' * pad)
+                entry = { k: v for k, v in sig.items() if k != 'data' }
+                entry['_samples'] = { 'dtype': dtype.str, 'count': int(a.size), 'pos': f.tell() }
+                f.write(a.tobytes())
+                h['signals'].append(entry)
+            meta = json.dumps(h).encode('utf-8')
+            index[name] = [ f.tell(), len(meta) ]
+            f.write(meta)
+        pos = f.tell()
+        f.write(json.dumps(index).encode('utf-8'))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, pos))
+    os.replace(tmp, path)
+    return len(index)
+
+# (name, ECG JSON object) for JSON files; names are file names without .json
+def read_json_files(paths):
+    for path in paths:
+        name = os.path.basename(path)
+        if name.endswith('.json'):
+            name = name[:-len('.json')]
+        with open(path, 'r') as f:
+            yield name, json.loads(f.read())
+
+class ECGStore:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, pos = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError("%s is not an ECG store" % path)
+            f.seek(pos)
+            self.index = json.loads(f.read().decode('utf-8'))
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        self.meta = { }
+
+    # Recording names, in the order they were written
+    def names(self):
+        return list(self.index.keys())
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    # The stored metadata of a recording, parsed on first use
+    def _meta(self, name):
+        h = self.meta.get(name)
+        if h is None:
+            pos, length = self.index[name]
+            h = json.loads(self.data[pos:pos + length].tobytes().decode('utf-8'))
+            self.meta[name] = h
+        return h
+
+    def _samples(self, entry):
+        h = entry['_samples']
+        dtype = np.dtype(h['dtype'])
+        end = h['pos'] + h['count'] * dtype.itemsize
+        return self.data[h['pos']:end].view(dtype)
+
+    # Lead names of a recording
+    def leads(self, name):
+        return [ sig.get('name') for sig in self._meta(name)['signals'] ]
+
+    # Samples of one lead as a read-only array backed by the file
+    def lead(self, name, lead):
+        for sig in self._meta(name)['signals']:
+            if sig.get('name') == lead:
+                return self._samples(sig)
+        raise KeyError("No lead '%s' in recording '%s'" % (lead, name))
+
+    # Metadata of a recording (the ECG JSON object without the samples)
+    def metadata(self, name):
+        h = dict(self._meta(name))
+        h['signals'] = [ { k: v for k, v in sig.items() if k != '_samples' }
+                         for sig in h['signals'] ]
+        return h
+
+    # The recording as an ECG JSON object; samples as arrays if
+    # arrays=True, otherwise as lists of Python numbers (as in the file)
+    def recording(self, name, arrays=False):
+        h = dict(self._meta(name))
+        signals = [ ]
+        for sig in h['signals']:
+            samples = self._samples(sig)
+            s = { k: v for k, v in sig.items() if k != '_samples' }
+            s['data'] = samples if arrays else samples.tolist()
+            signals.append(s)
+        h['signals'] = signals
+        return h
+
+    # The recording as a JSON string, for input_for_ecg_json()
+    def ecg_json(self, name):
+        return json.dumps(self.recording(name))
+
+    # The file stays mapped until arrays returned by lead() are released
+    def close(self):
+        self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.stderr.write("Usage: %s store.ecgs ecg.json [ecg.json ...]\n" % sys.argv[0])
+        sys.exit(-1)
+    n = write_store(sys.argv[1], read_json_files(sys.argv[2:]))
+    size = sum([ os.path.getsize(p) for p in sys.argv[2:] ])
+    print("Wrote %d recordings to %s: %d bytes (JSON: %d bytes, %0.1fx)" % (n, sys.argv[1], os.path.getsize(sys.argv[1]), size, float(size) / os.path.getsize(sys.argv[1])))
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Hedged requests for the shared MCG API client.
+#
+# An occasional slow server node sets the tail latency of an interactive
+# caller waiting on one request. With hedging, if no response has arrived
+# after the given percentile of recent latency (per analysis type), one
+# duplicate of the request is sent, and whichever copy answers first is
+# used. The other copy is left to complete in the background and its
+# response is discarded.
+#
+# Every copy sent may be billed. Hedging is off unless the client is given
+# a HedgePolicy (or MCG_API_HEDGE is set), and even then only these
+# requests are hedged:
+#   - analysis types listed in safe_types (default: ecg-tracing-quality)
+#   - any request, if idempotency_header is set: both copies carry the
+#     same unique key in that header, for servers that process (and bill)
+#     a key once. Only set it for a server known to do so.
+# Hedges are capped at max_rate per second, so a slow server is not sent
+# twice the traffic, and no request is hedged until min_samples latencies
+# of its analysis type have been seen. With a client limiter
+# (mcg_ratelimit.py), a duplicate is only sent if the limiter has a free
+# slot and token right away. Each copy holds its own slot until it
+# completes, including a copy whose response is discarded.
+# The latencies are those of the primary copies, whether or not a duplicate
+# answered first, so hedging does not lower its own delay.
+#
+#   MCG_API_HEDGE      : latency percentile after which to hedge (e.g. 95)
+#   MCG_API_HEDGE_RATE : max hedged requests per second (default: 1)
+
+import collections
+import os
+import threading
+import time
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from mcg_ratelimit import TokenBucket
+from mcg_retry import classify
+from mcg_timing import percentile
+
+HEDGE_KEY = 'MCG_API_HEDGE'
+HEDGE_RATE_KEY = 'MCG_API_HEDGE_RATE'
+
+SAFE_TYPES = [ 'ecg-tracing-quality' ]
+
+class HedgePolicy:
+    # percentile         : hedge when no response after this percentile of
+    #                      recent latency
+    # max_rate           : max hedged requests per second
+    # safe_types         : analysis types that may be sent twice
+    # idempotency_header : header carrying a per-request key the server
+    #                      deduplicates on; if set, all types are hedged
+    # window             : recent latencies kept per analysis type
+    # min_samples        : latencies needed before hedging a type
+    # min_delay          : never hedge sooner than this, in seconds
+    def __init__(self, percentile=95, max_rate=1.0, safe_types=None,
+                 idempotency_header=None, window=200, min_samples=20, min_delay=0.0):
+        self.percentile = percentile
+        self.bucket = TokenBucket(max_rate, burst=max(1.0, max_rate))
+        self.safe_types = list(SAFE_TYPES if safe_types is None else safe_types)
+        self.idempotency_header = idempotency_header
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.lock = threading.Lock()
+        self.latencies = { }
+        self.counters = { 'requests': 0, 'hedged': 0, 'hedge-won': 0, 'capped': 0 }
+
+    # Whether a request may be hedged
+    def hedgeable(self, data):
+        if self.idempotency_header:
+            return True
+        analysis = data.get('analysis') if isinstance(data, dict) else None
+        return isinstance(analysis, dict) and analysis.get('type') in self.safe_types
+
+    # Seconds to wait before hedging, or None while too few latencies are known
+    def delay(self, analysis):
+        with self.lock:
+            samples = list(self.latencies.get(analysis) or [ ])
+        if len(samples) < self.min_samples:
+            return None
+        return max(self.min_delay, percentile(samples, self.percentile))
+
+    def observe(self, analysis, latency):
+        with self.lock:
+            if analysis not in self.latencies:
+                self.latencies[analysis] = collections.deque(maxlen=self.window)
+            self.latencies[analysis].append(latency)
+
+    def incr(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def report(self):
+        with self.lock:
+            h = dict(self.counters)
+        h['delay'] = { analysis: self.delay(analysis) for analysis in list(self.latencies) }
+        return h
+
+# HedgePolicy configured from MCG_API_HEDGE / MCG_API_HEDGE_RATE, or None
+def hedge_from_env():
+    if not os.environ.get(HEDGE_KEY):
+        return None
+    return HedgePolicy(percentile=float(os.environ[HEDGE_KEY]),
+                       max_rate=float(os.environ.get(HEDGE_RATE_KEY) or 1.0))
+
+def _spawn(fn, *args):
+    fut = Future()
+    def run():
+        try:
+            fut.set_result(fn(*args))
+        except BaseException as e:
+            fut.set_exception(e)
+    threading.Thread(target=run, daemon=True).start()
+    return fut
+
+def _answered(fut):
+    return fut.exception() is None and classify(response=fut.result()) != 'retryable'
+
+def _discard(fut):
+    if fut.exception() is None:
+        fut.result().close()
+
+# Call send() holding a limiter slot, and release it when send() completes
+def _send_limited(limiter, key, send):
+    start = time.monotonic()
+    try:
+        response = send()
+    except BaseException as e:
+        limiter.release(time.monotonic() - start, None, e, key)
+        raise
+    limiter.release(time.monotonic() - start, response.status_code, None, key)
+    return response
+
+# Call send() and, if it has not answered within the policy's delay, call
+# it again concurrently. Returns the response of the first copy that
+# answers (a response that is not a retryable failure); if neither does,
+# the primary's outcome is returned (or raised) for the retry policy to
+# handle. send() is called in other threads once hedging is possible.
+# If limiter (a RateController) is given, the caller has taken a slot for
+# the primary copy, which is released when that copy completes; the
+# duplicate takes its own slot with try_acquire(), and is not sent (but
+# counted as capped) if no slot is free. limit_key is the request's
+# mcg_ratelimit.latency_key().
+def hedged_call(policy, analysis, send, limiter=None, limit_key=None):
+    policy.incr('requests')
+    delay = policy.delay(analysis)
+    start = time.monotonic()
+    if delay is None:
+        if limiter is None:
+            response = send()
+        else:
+            response = _send_limited(limiter, limit_key, send)
+        if classify(response=response) != 'retryable':
+            policy.observe(analysis, time.monotonic() - start)
+        return response
+
+    if limiter is None:
+        primary = _spawn(send)
+    else:
+        primary = _spawn(_send_limited, limiter, limit_key, send)
+
+    def observe_primary(fut):
+        if _answered(fut):
+            policy.observe(analysis, time.monotonic() - start)
+    primary.add_done_callback(observe_primary)
+    copies = [ primary ]
+    done, _ = wait(copies, timeout=delay)
+    if not done:
+        if not policy.bucket.try_acquire():
+            policy.incr('capped')
+        elif limiter is None:
+            policy.incr('hedged')
+            copies.append(_spawn(send))
+        elif limiter.try_acquire():
+            policy.incr('hedged')
+            copies.append(_spawn(_send_limited, limiter, limit_key, send))
+        else:
+            policy.incr('capped')
+
+    winner = None
+    waiting = list(copies)
+    while waiting:
+        done, _ = wait(waiting, return_when=FIRST_COMPLETED)
+        for fut in done:
+            waiting.remove(fut)
+            if winner is None and _answered(fut):
+                winner = fut
+        if winner is not None:
+            break
+    if winner is None:
+        winner = primary
+    if winner is not primary:
+        policy.incr('hedge-won')
+    for fut in copies:
+        if fut is not winner:
+            fut.add_done_callback(_discard)
+    return winner.result()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# HTTP/2 transport for the shared MCG API client.
+#
+# With HTTP/1.1 every concurrent request needs its own connection (and TLS
+# session). HTTP2Session sends requests through an httpx client with HTTP/2
+# enabled, so concurrent AnalysisRequests are multiplexed over a few
+# connections. It provides the part of requests.Session that MCGClient and
+# the examples use (request, get, post, headers, close) and returns
+# requests.Response objects, so the rest of the client (retries, streaming,
+# timings) works unchanged.
+#
+# httpx's synchronous HTTP/2 connections are not safe to share between
+# threads, so the session runs an httpx.AsyncClient on its own event loop
+# thread, and post() waits for the request to complete there.
+#
+# Requires the optional 'httpx' and 'h2' packages (pip install httpx[http2]).
+# MCGClient falls back to its HTTP/1.1 session when they are missing, and
+# servers that do not offer HTTP/2 in TLS negotiation (ALPN) are spoken to
+# in HTTP/1.1 over the same client. Such a server needs a connection per
+# concurrent request, so the connection limit is sized like the HTTP/1.1
+# pool (MCGClient passes pool_maxsize); HTTP/2 connections are only opened
+# when the ones open have no free streams, so the limit costs nothing when
+# HTTP/2 is negotiated. session.http_version is the protocol of the latest
+# response (None before the first). Modes:
+#   '1'               : HTTP/2 where the server offers it (https only)
+#   'prior-knowledge' : HTTP/2 without negotiation, also over plain http
+#                       (h2c, e.g. for the stub server)
+#
+# Set MCG_API_HTTP2 to one of the modes to use HTTP/2 in the shared client.
+
+import asyncio
+import importlib.util
+import threading
+import time
+import requests
+from requests.structures import CaseInsensitiveDict
+from mcg_timing import current
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+# httpx only imports h2 when an HTTP/2 connection is made
+if importlib.util.find_spec('h2') is None:
+    httpx = None
+
+MODES = [ '1', 'prior-knowledge' ]
+
+# connections open at once, in total (httpx limits are not per host); an
+# HTTP/2 connection carries up to the server's stream limit (usually 100 or
+# more) of concurrent requests, an HTTP/1.1 connection one
+DEFAULT_MAX_CONNECTIONS = 10
+
+# httpcore trace events timed into the current RequestTimings
+TRACE_PHASES = {
+    'connection.connect_tcp': 'connect',
+    'connection.start_tls': 'tls',
+    'send_request_headers': 'upload',
+    'send_request_body': 'upload',
+    'receive_response_headers': 'ttfb'
+}
+
+def http2_available():
+    return httpx is not None
+
+class _TraceTimings:
+    # httpcore 'trace' extension callback recording phases into rec
+    def __init__(self, rec):
+        self.rec = rec
+        self.started = { }
+
+    async def __call__(self, name, info):
+        prefix, _, state = name.rpartition('.')
+        phase = TRACE_PHASES.get(prefix) or TRACE_PHASES.get(prefix.partition('.')[2])
+        if phase is None:
+            return
+        now = time.perf_counter()
+        if state == 'started':
+            self.started[prefix] = now
+        elif prefix in self.started:
+            self.rec.add(phase, now - self.started.pop(prefix))
+            if phase == 'connect':
+                self.rec.connections += 1
+            elif phase == 'ttfb':
+                self.rec.headers_at = now
+
+async def _next_chunk(chunks):
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return None
+
+class _RawStream:
+    # Stands in for the urllib3 response behind a streamed requests.Response
+    def __init__(self, session, response):
+        self.session = session
+        self.response = response
+
+    def stream(self, chunk_size, decode_content=True):
+        chunks = self.response.aiter_bytes(chunk_size)
+        while True:
+            chunk = self.session.call(_next_chunk(chunks))
+            if chunk is None:
+                return
+            yield chunk
+
+    def read(self, amt=None):
+        return self.session.call(self.response.aread())
+
+    def tell(self):
+        return self.response.num_bytes_downloaded
+
+    def close(self):
+        if not self.response.is_closed:
+            self.session.call(self.response.aclose())
+
+    def release_conn(self):
+        pass
+
+class HTTP2Session:
+    # mode            : '1' or 'prior-knowledge' (see MODES)
+    # max_connections : connections open at once, to all hosts together
+    def __init__(self, mode='1', max_connections=DEFAULT_MAX_CONNECTIONS):
+        if not http2_available():
+            raise ValueError("HTTP/2 requires the 'httpx' and 'h2' packages")
+        if mode not in MODES:
+            raise ValueError("Unknown HTTP/2 mode '%s'" % mode)
+        self.mode = mode
+        self.http_version = None
+        self.headers = CaseInsensitiveDict()
+        limits = httpx.Limits(max_connections=max_connections,
+                              max_keepalive_connections=max_connections)
+        self.client = httpx.AsyncClient(http2=True, http1=(mode != 'prior-knowledge'),
+                                        limits=limits)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    # Run a coroutine on the session's event loop and return its result
+    def call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def _send(self, request, stream):
+        response = await self.client.send(request, stream=True)
+        if not stream:
+            try:
+                await response.aread()
+            finally:
+                await response.aclose()
+        return response
+
+    # Send a request, with the arguments of requests.Session.request() that
+    # the client and the examples use
+    def request(self, method, url, headers=None, data=None, json=None,
+                timeout=None, stream=False):
+        h = dict(self.headers)
+        h.update(headers or { })
+        # HTTP/2 has no Connection header
+        h.pop('Connection', None)
+        extensions = { }
+        rec = current()
+        if rec is not None:
+            extensions['trace'] = _TraceTimings(rec)
+        request = self.client.build_request(method, url, headers=h, content=data,
+                                            json=json, extensions=extensions,
+                                            timeout=httpx.Timeout(timeout, pool=None))
+        try:
+            response = self.call(self._send(request, stream))
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e))
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e))
+        self.http_version = response.http_version
+        resp = to_requests_response(method, url, h, request.content, response)
+        if stream:
+            resp.raw = _RawStream(self, response)
+        else:
+            resp._content = response.content
+            resp._content_consumed = True
+        return resp
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        self.call(self.client.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+# Wrap an httpx response as a requests.Response (without the body)
+def to_requests_response(method, url, headers, body, response):
+    prepared = requests.PreparedRequest()
+    prepared.method = method
+    prepared.url = url
+    prepared.headers = CaseInsensitiveDict(headers)
+    prepared.body = body
+
+    resp = requests.Response()
+    resp.status_code = response.status_code
+    resp.headers = CaseInsensitiveDict(response.headers)
+    resp.url = url
+    resp.encoding = response.encoding
+    resp.reason = response.reason_phrase
+    resp.request = prepared
+    resp.http_version = response.http_version
+    return resp
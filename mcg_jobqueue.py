@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Crash-safe job queue for batch submissions, kept in SQLite.
+#
+# Every AnalysisRequest of a batch is a job with a state:
+#   pending   : not sent yet
+#   in-flight : claimed by a worker and being sent
+#   done      : an AnalysisResult was received and saved
+#   failed    : the API (or the client) returned an error
+# A job refers to its request by position in the source JSONL file (the
+# request itself is not copied into the database), and records where its
+# result was saved and the 'invoice-id' from its results.
+#
+# Workers claim jobs in one transaction (BEGIN IMMEDIATE), so several
+# threads or processes can share a queue without sending a job twice.
+# State changes after a claim are buffered and committed in batches (every
+# commit_interval seconds or batch_size changes), which keeps the queue at
+# thousands of transitions per second. A result file is always written
+# before its job is marked done, so a crash can only lose the buffered
+# state changes, and recover() repairs them from the result files:
+#   - in-flight jobs with a result file are marked done
+#   - other in-flight jobs of workers that are no longer running go back
+#     to pending and are sent again
+# NOTE: a job that was being sent when the process died may have been
+#       processed (and billed) by the server without its result arriving.
+#       Such jobs are counted in 'attempts'.
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+STATES = [ 'pending', 'in-flight', 'done', 'failed' ]
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_COMMIT_INTERVAL = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          INTEGER PRIMARY KEY,
+    key         TEXT NOT NULL UNIQUE,
+    source      TEXT,
+    offset      INTEGER,
+    line        INTEGER,
+    state       TEXT NOT NULL DEFAULT 'pending',
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    worker      TEXT,
+    updated     REAL,
+    result      TEXT,
+    invoice_id  TEXT,
+    error       TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+"""
+
+JOB_COLUMNS = [ 'id', 'key', 'source', 'offset', 'line', 'state', 'attempts',
+                'worker', 'updated', 'result', 'invoice_id', 'error' ]
+
+# Name of this process as a worker: host:pid
+def worker_name():
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # a killed process whose parent has not reaped it yet (Linux)
+    try:
+        with open('/proc/%d/stat' % pid, 'r') as f:
+            return f.read().rpartition(')')[2].split()[0] != 'Z'
+    except (OSError, IndexError):
+        return True
+
+class JobQueue:
+    # path            : SQLite database file (created if missing)
+    # batch_size      : buffered state changes that force a commit
+    # commit_interval : longest time a state change stays buffered
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE,
+                 commit_interval=DEFAULT_COMMIT_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.worker = worker_name()
+        self.lock = threading.Lock()
+        self.buffer = [ ]
+        self.last_commit = time.monotonic()
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    # Add jobs from (key, source, offset, line) tuples; keys already in the
+    # queue are skipped, so a batch can be loaded again on restart.
+    # Returns the number of jobs added.
+    def add_many(self, jobs):
+        now = time.time()
+        with self.lock:
+            before = self.db.total_changes
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                self.db.executemany('INSERT OR IGNORE INTO jobs (key, source, offset, line, updated) '
+                                    'VALUES (?, ?, ?, ?, ?)', (job + (now, ) for job in jobs))
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            return self.db.total_changes - before
+
+    # Claim up to n pending jobs for this worker; returns a list of job dicts
+    def claim(self, n=1):
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                self._write_buffer()
+                rows = self.db.execute(
+                    "UPDATE jobs SET state = 'in-flight', attempts = attempts + 1, worker = ?, updated = ? "
+                    "WHERE id IN (SELECT id FROM jobs WHERE state = 'pending' ORDER BY id LIMIT ?) "
+                    "RETURNING %s" % ', '.join(JOB_COLUMNS),
+                    (self.worker, time.time(), n)).fetchall()
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.last_commit = time.monotonic()
+        jobs = [ dict(zip(JOB_COLUMNS, row)) for row in rows ]
+        jobs.sort(key=lambda job: job['id'])
+        return jobs
+
+    def done(self, job_id, result=None, invoice_id=None):
+        self._transition(job_id, 'done', result, invoice_id, None)
+
+    def failed(self, job_id, error, result=None):
+        self._transition(job_id, 'failed', result, None, error)
+
+    # Return a claimed job to pending (e.g. when stopping early)
+    def release(self, job_id):
+        self._transition(job_id, 'pending', None, None, None)
+
+    def _transition(self, job_id, state, result, invoice_id, error):
+        with self.lock:
+            self.buffer.append((state, result, invoice_id, error, time.time(), job_id))
+            if len(self.buffer) >= self.batch_size or \
+               time.monotonic() - self.last_commit >= self.commit_interval:
+                self._commit()
+
+    def _write_buffer(self):
+        if self.buffer:
+            self.db.executemany('UPDATE jobs SET state = ?, result = ?, invoice_id = ?, error = ?, updated = ? '
+                                'WHERE id = ?', self.buffer)
+            self.buffer = [ ]
+
+    def _commit(self):
+        if self.buffer:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                self._write_buffer()
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+        self.last_commit = time.monotonic()
+
+    # Commit buffered state changes now
+    def flush(self):
+        with self.lock:
+            self._commit()
+
+    # Repair in-flight jobs left by workers that died. result_exists(job)
+    # tells whether the job's result was saved. Jobs of workers on other
+    # hosts are only recovered once they are older than stale_after seconds.
+    # Returns (jobs marked done, jobs returned to pending).
+    def recover(self, result_exists, stale_after=None):
+        self.flush()
+        host = socket.gethostname()
+        now = time.time()
+        with self.lock:
+            rows = self.db.execute("SELECT %s FROM jobs WHERE state = 'in-flight'" % ', '.join(JOB_COLUMNS)).fetchall()
+        done = 0
+        reset = 0
+        for row in rows:
+            job = dict(zip(JOB_COLUMNS, row))
+            worker_host, _, pid = (job['worker'] or '').rpartition(':')
+            if worker_host == host and pid.isdigit():
+                if _process_alive(int(pid)):
+                    continue
+            elif stale_after is None or now - job['updated'] < stale_after:
+                continue
+            found = result_exists(job)
+            if found:
+                self.done(job['id'], found[0], found[1])
+                done += 1
+            else:
+                self.release(job['id'])
+                reset += 1
+        self.flush()
+        return done, reset
+
+    # Send failed jobs again; returns the number of jobs reset
+    def retry_failed(self):
+        self.flush()
+        with self.lock:
+            cur = self.db.execute("UPDATE jobs SET state = 'pending', error = NULL WHERE state = 'failed'")
+            return cur.rowcount
+
+    # Number of jobs in each state
+    def counts(self):
+        self.flush()
+        h = dict.fromkeys(STATES, 0)
+        with self.lock:
+            for state, n in self.db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state'):
+                h[state] = n
+        return h
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# ----------------------------------------------------------------------
+# JSONL SOURCES AND RESULT FILES
+
+# Add a job for every non-blank line of a JSONL file of AnalysisRequests,
+# keyed by file name and line number. Returns the number of jobs added.
+def load_jsonl(queue, path):
+    path = os.path.abspath(path)
+    name = os.path.basename(path)
+    def jobs():
+        offset = 0
+        with open(path, 'rb') as f:
+            for lineno, line in enumerate(f, 1):
+                if line.strip():
+                    yield ("%s:%d" % (name, lineno), path, offset, lineno)
+                offset += len(line)
+    return queue.add_many(jobs())
+
+# The request of a job, read from its source file
+def read_job_request(job):
+    with open(job['source'], 'rb') as f:
+        f.seek(job['offset'])
+        return json.loads(f.readline())
+
+def result_path(results_dir, job):
+    return os.path.join(results_dir, "%d.json" % job['id'])
+
+# Write a result file atomically, so it is either complete or missing
+def save_result(results_dir, job, result):
+    path = result_path(results_dir, job)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(json.dumps(result))
+    os.replace(tmp, path)
+    return path
+
+def invoice_id(result):
+    if isinstance(result, dict):
+        return (result.get('results') or { }).get('invoice-id')
+    return None
+
+# result_exists() for recover(): (path, invoice-id) of the job's saved
+# AnalysisResult, or None
+def saved_result(results_dir):
+    def result_exists(job):
+        path = result_path(results_dir, job)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            result = json.loads(f.read())
+        if result.get('object-type') != 'analysis-result':
+            return None
+        return path, invoice_id(result)
+    return result_exists
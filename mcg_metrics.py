@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Prometheus metrics for MCG API traffic.
+#
+# MCGMetrics keeps counters and histograms in the Prometheus text format
+# (no prometheus_client dependency) and exports them either on a local HTTP
+# scrape endpoint (/metrics) or as a file for the node_exporter textfile
+# collector. Per request, from the client's timings (mcg_timing.py):
+#   mcg_api_requests_total{analysis,outcome}       outcome: analysis-result,
+#                                                  error, http-<status> or
+#                                                  the exception name
+#   mcg_api_request_duration_seconds{analysis}     histogram
+#   mcg_api_request_bytes{analysis}                histogram, bytes uploaded
+#   mcg_api_response_bytes{analysis}               histogram, bytes downloaded
+#   mcg_api_tracing_quality{analysis,scope}        histogram of the scores in
+#                                                  results['tracing-quality'];
+#                                                  scope: input, lead or all
+# and read from the client when scraped:
+#   mcg_api_attempts_total, mcg_api_retries_total, mcg_api_gave_up_total,
+#   mcg_api_circuit_open_total, mcg_api_rejected_total (failed local
+#   validation), mcg_api_coalesced_total, mcg_api_cache_{hits,misses}_total
+#
+# Recording a request is a few dictionary updates under a lock. Metrics
+# need the client's timings (on by default).
+#
+# The shared client exports metrics when MCG_API_METRICS_PORT (scrape
+# endpoint on 127.0.0.1) or MCG_API_METRICS_FILE (textfile, rewritten every
+# MCG_API_METRICS_INTERVAL seconds, default 15) is set.
+
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT_KEY = 'MCG_API_METRICS_PORT'
+METRICS_FILE_KEY = 'MCG_API_METRICS_FILE'
+METRICS_INTERVAL_KEY = 'MCG_API_METRICS_INTERVAL'
+
+DEFAULT_INTERVAL = 15.0
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = [ 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0 ]
+BYTES_BUCKETS = [ 1024 * 4 ** x for x in range(9) ]
+TQ_BUCKETS = [ 10, 20, 30, 40, 50, 60, 70, 80, 90, 100 ]
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names, values, extra=None):
+    pairs = [ '%s="%s"' % (n, _escape(v)) for n, v in zip(names, values) ]
+    if extra is not None:
+        pairs.append('%s="%s"' % extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+def _number(v):
+    if v == float('inf'):
+        return '+Inf'
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v)
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = { }
+
+    def inc(self, label_values=(), n=1):
+        self.values[label_values] = self.values.get(label_values, 0) + n
+
+    def render(self):
+        lines = [ '# HELP %s %s' % (self.name, self.help),
+                  '# TYPE %s counter' % self.name ]
+        for key in sorted(self.values):
+            lines.append('%s%s %s' % (self.name, _labels(self.labels, key), _number(self.values[key])))
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = list(buckets)
+        # label values -> [ per-bucket counts (+Inf last), sum ]
+        self.values = { }
+
+    def observe(self, value, label_values=()):
+        h = self.values.get(label_values)
+        if h is None:
+            h = self.values[label_values] = [ [ 0 ] * (len(self.buckets) + 1), 0.0 ]
+        h[0][bisect.bisect_left(self.buckets, value)] += 1
+        h[1] += value
+
+    def render(self):
+        lines = [ '# HELP %s %s' % (self.name, self.help),
+                  '# TYPE %s histogram' % self.name ]
+        for key in sorted(self.values):
+            counts, total = self.values[key]
+            cumulative = 0
+            for le, n in zip(self.buckets + [ float('inf') ], counts):
+                cumulative += n
+                lines.append('%s_bucket%s %d' % (self.name, _labels(self.labels, key, ('le', _number(float(le)))), cumulative))
+            lines.append('%s_sum%s %s' % (self.name, _labels(self.labels, key), _number(total)))
+            lines.append('%s_count%s %d' % (self.name, _labels(self.labels, key), cumulative))
+        return lines
+
+# counters read from a client at scrape time: (metric, help, source, key)
+CLIENT_COUNTERS = [
+    ('mcg_api_attempts_total', 'HTTP attempts, including retries', 'retry', 'attempts'),
+    ('mcg_api_retries_total', 'Attempts that were retries', 'retry', 'retries'),
+    ('mcg_api_gave_up_total', 'Requests that failed after the last retry', 'retry', 'gave-up'),
+    ('mcg_api_circuit_open_total', 'Requests refused by the open circuit breaker', 'retry', 'circuit-open'),
+    ('mcg_api_rejected_total', 'Requests that failed local validation and were not sent', 'client', 'rejected'),
+    ('mcg_api_coalesced_total', 'Requests answered by an identical request in flight', 'client', 'coalesced'),
+    ('mcg_api_cache_hits_total', 'Result cache hits', 'cache', 'hits'),
+    ('mcg_api_cache_misses_total', 'Result cache misses', 'cache', 'misses'),
+    ('mcg_api_hedged_total', 'Duplicate requests sent for slow requests', 'hedge', 'hedged'),
+    ('mcg_api_hedge_wins_total', 'Hedged requests answered first by the duplicate', 'hedge', 'hedge-won'),
+]
+
+class MCGMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = [ ]
+        # final counters of the clients no longer tracked
+        self.retired = dict.fromkeys([ c[0] for c in CLIENT_COUNTERS ], 0)
+        self.requests = Counter('mcg_api_requests_total',
+                                'MCG API requests by analysis type and outcome',
+                                [ 'analysis', 'outcome' ])
+        self.latency = Histogram('mcg_api_request_duration_seconds',
+                                 'MCG API request latency, including retries',
+                                 LATENCY_BUCKETS, [ 'analysis' ])
+        self.request_bytes = Histogram('mcg_api_request_bytes',
+                                       'Bytes uploaded per MCG API request',
+                                       BYTES_BUCKETS, [ 'analysis' ])
+        self.response_bytes = Histogram('mcg_api_response_bytes',
+                                        'Bytes downloaded per MCG API request',
+                                        BYTES_BUCKETS, [ 'analysis' ])
+        self.tracing_quality = Histogram('mcg_api_tracing_quality',
+                                         'Tracing quality scores returned in results',
+                                         TQ_BUCKETS, [ 'analysis', 'scope' ])
+
+    # Collect metrics from a client's requests (a mcg_client.MCGClient
+    # with timings on), and report its retry, cache and coalescing counters.
+    # Clients sharing a TimingRecorder share one hook, so each request is
+    # counted once.
+    def track_client(self, client):
+        if client.timings is None:
+            raise ValueError("MCG API metrics need the client's timings (MCG_API_TIMINGS)")
+        with self.lock:
+            if client in self.clients:
+                return
+            hooked = any([ c.timings is client.timings for c in self.clients ])
+            self.clients.append(client)
+        if not hooked:
+            client.timings.add_hook(self.observe)
+
+    # Stop tracking a client (MCGClient.close() calls this). Its counters
+    # are kept in the totals; the hook is removed with the last client of
+    # its recorder.
+    def untrack_client(self, client):
+        with self.lock:
+            if client not in self.clients:
+                return
+            self.clients.remove(client)
+            hooked = any([ c.timings is client.timings for c in self.clients ])
+        counters = self.counters(client)
+        with self.lock:
+            for name in counters:
+                self.retired[name] += counters[name]
+        if not hooked:
+            client.timings.remove_hook(self.observe)
+
+    # Timing hook: record one completed request
+    def observe(self, timings):
+        analysis = timings.analysis or 'none'
+        key = (analysis, )
+        scores = self.scores(timings.result)
+        with self.lock:
+            self.requests.inc((analysis, timings.outcome or 'unknown'))
+            self.latency.observe(timings.elapsed, key)
+            self.request_bytes.observe(timings.bytes_up, key)
+            self.response_bytes.observe(timings.bytes_down, key)
+            for scope, score in scores:
+                self.tracing_quality.observe(score, (analysis, scope))
+
+    # (scope, score) for each score in results['tracing-quality']: a score
+    # per input (mcg-aggregate, mcg-differential), or per lead and for the
+    # whole recording ('all') for ecg-tracing-quality
+    def scores(self, res):
+        if not isinstance(res, dict):
+            return [ ]
+        tq = (res.get('results') or { }).get('tracing-quality')
+        if not isinstance(tq, dict):
+            return [ ]
+        scores = [ ]
+        for name, v in tq.items():
+            if isinstance(v, dict):
+                v = v.get('tracing quality')
+                scope = 'all' if name == 'all' else 'lead'
+            else:
+                scope = 'input'
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                scores.append((scope, v))
+        return scores
+
+    # The CLIENT_COUNTERS of one client
+    def counters(self, client):
+        sources = { 'client': { 'rejected': client.rejected, 'coalesced': client.coalesced },
+                    'retry': client.retry_stats.snapshot(),
+                    'cache': client.cache.statistics() if client.cache is not None else { },
+                    'hedge': client.hedge.report() if client.hedge is not None else { } }
+        return { name: sources[source].get(key, 0)
+                 for name, help, source, key in CLIENT_COUNTERS }
+
+    def client_counters(self):
+        with self.lock:
+            totals = dict(self.retired)
+            clients = list(self.clients)
+        for client in clients:
+            for name, n in self.counters(client).items():
+                totals[name] += n
+        return totals
+
+    # The metrics in the Prometheus text exposition format
+    def render(self):
+        totals = self.client_counters()
+        with self.lock:
+            lines = [ ]
+            for metric in [ self.requests, self.latency, self.request_bytes,
+                            self.response_bytes, self.tracing_quality ]:
+                lines += metric.render()
+        for name, help, source, key in CLIENT_COUNTERS:
+            lines += [ '# HELP %s %s' % (name, help),
+                       '# TYPE %s counter' % name,
+                       '%s %d' % (name, totals[name]) ]
+        return '\n'.join(lines) + '\n'
+
+    # Write the metrics to path for the textfile collector. The file is
+    # replaced atomically so a scrape never sees a partial file.
+    def write_textfile(self, path):
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+# ----------------------------------------------------------------------
+# EXPORTERS
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in [ '/', '/metrics' ]:
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+# Serve metrics on http://host:port/metrics from a background thread.
+# Port 0 picks a free port; call shutdown() on the returned server to stop.
+def start_http_exporter(metrics, port, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+class TextfileExporter:
+    # Rewrites path every interval seconds from a background thread;
+    # shutdown() writes the final values and stops it
+    def __init__(self, metrics, path, interval=DEFAULT_INTERVAL):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.metrics.write_textfile(self.path)
+
+    def shutdown(self):
+        self.stopped.set()
+        self.thread.join()
+        self.metrics.write_textfile(self.path)
+
+# ----------------------------------------------------------------------
+# Process-wide metrics used by the shared client
+
+_default_metrics = None
+_exporters = [ ]
+_default_lock = threading.Lock()
+
+def default_metrics():
+    global _default_metrics
+    with _default_lock:
+        if _default_metrics is None:
+            _default_metrics = MCGMetrics()
+        return _default_metrics
+
+# If MCG_API_METRICS_PORT or MCG_API_METRICS_FILE is set, start the
+# exporter (once per process) and return the process-wide metrics;
+# otherwise return None
+def metrics_from_env():
+    port = os.environ.get(METRICS_PORT_KEY)
+    path = os.environ.get(METRICS_FILE_KEY)
+    if not port and not path:
+        return None
+    metrics = default_metrics()
+    with _default_lock:
+        if not _exporters:
+            if port:
+                _exporters.append(start_http_exporter(metrics, int(port)))
+            if path:
+                interval = float(os.environ.get(METRICS_INTERVAL_KEY, DEFAULT_INTERVAL))
+                _exporters.append(TextfileExporter(metrics, path, interval))
+    return metrics
+
+# Stop the exporters started by metrics_from_env(); the textfile gets its
+# final values. Batch runners call this before exiting.
+def shutdown_exporters():
+    with _default_lock:
+        while _exporters:
+            _exporters.pop().shutdown()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Split large AnalysisRequests into size-bounded requests and merge the
+# results.
+#
+# build_request() puts every recording into one 'input' list, so the body
+# grows with the batch and one bad recording fails the whole request.
+# plan_requests() splits the inputs into requests of at most max_bytes
+# (serialized input size) and max_inputs inputs, following the semantics
+# of each analysis type:
+#   ecg-tracing-quality : inputs are independent and may be split freely
+#   mcg-aggregate       : the inputs of a 'group' are aggregated together,
+#                         so groups are never split (inputs without a
+#                         group form one group)
+#   mcg-differential    : compares groups with each other, and other types
+#                         are unknown, so the request is never split
+# Inputs and whole groups are packed into as few requests as the limits
+# allow, so a request within the limits is sent unchanged. A group larger
+# than the limits is still sent as one request.
+#
+# submit_planned() sends the requests in parallel through the shared client
+# and merge_results() combines the AnalysisResults into one. Unnamed inputs
+# are given their index in the original request as 'name', so per-input
+# results and attachments keep the original input names:
+#   - attachments and warnings are concatenated in input order
+#   - 'invoice-id' lists the invoice of every request, comma-separated
+#   - ecg-tracing-quality ecg-stats are combined per lead, and each tracing
+#     quality score is the lowest of the requests' scores
+#   - mcg-aggregate results are returned per group, as
+#     results['groups'][group], with the per-input 'tracing-quality'
+#     merged. Groups packed into the same request are not analysed
+#     separately: each of them gets the one aggregate result of that
+#     request, covering the inputs of all its groups. Pass max_inputs (or
+#     max_bytes) small enough to send one group per request when each
+#     group needs its own result.
+# Requests that fail are listed in 'errors' with the names of their inputs;
+# the results of the others are still returned. If every request fails, a
+# 'client-error' is returned with all of their errors.
+
+from concurrent.futures import ThreadPoolExecutor
+from mcg_client import default_client, client_error
+from mcg_serialize import serialize_request
+
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+DEFAULT_MAX_INPUTS = 20
+DEFAULT_WORKERS = 4
+
+# how each analysis type may be split: 'input', 'group' or 'whole'
+SPLIT_POLICY = {
+    'ecg-tracing-quality': 'input',
+    'mcg-aggregate': 'group',
+    'mcg-differential': 'whole'
+}
+
+def analysis_type(data):
+    analysis = data.get('analysis')
+    if isinstance(analysis, dict):
+        return analysis.get('type')
+    return analysis
+
+def input_size(h_input):
+    return len(serialize_request(h_input))
+
+# Return a copy of the inputs with a 'name' on every input (its index in
+# the original request, if it had none)
+def named_inputs(data):
+    inputs = [ ]
+    for idx, h_input in enumerate(data['input']):
+        if isinstance(h_input, dict) and not h_input.get('name'):
+            h_input = dict(h_input, name=str(idx))
+        inputs.append(h_input)
+    return inputs
+
+def input_name(h_input, idx):
+    if isinstance(h_input, dict):
+        return h_input['name']
+    return str(idx)
+
+def input_group(h_input):
+    if isinstance(h_input, dict):
+        return h_input.get('group')
+    return None
+
+# Return lists of input indexes that must be sent in the same request
+def input_units(data):
+    policy = SPLIT_POLICY.get(analysis_type(data), 'whole')
+    indexes = list(range(len(data['input'])))
+    if policy == 'input':
+        return [ [ idx ] for idx in indexes ]
+    if policy == 'group':
+        groups = { }
+        for idx, h_input in enumerate(data['input']):
+            groups.setdefault(input_group(h_input), [ ]).append(idx)
+        return list(groups.values())
+    return [ indexes ]
+
+# Split an AnalysisRequest into a list of (request, input names). The
+# request is returned as it is (with named inputs) if it needs no split.
+def plan_requests(data, max_bytes=DEFAULT_MAX_BYTES, max_inputs=DEFAULT_MAX_INPUTS):
+    inputs = named_inputs(data)
+    chunks = [ ]
+    current = [ ]
+    size = 0
+    for unit in input_units(data):
+        unit_size = sum(input_size(inputs[idx]) for idx in unit)
+        if current and (size + unit_size > max_bytes or
+                        len(current) + len(unit) > max_inputs):
+            chunks.append(current)
+            current = [ ]
+            size = 0
+        current = current + unit
+        size += unit_size
+    if current:
+        chunks.append(current)
+
+    plan = [ ]
+    for chunk in chunks:
+        req = dict(data)
+        req['input'] = [ inputs[idx] for idx in chunk ]
+        plan.append((req, [ input_name(inputs[idx], idx) for idx in chunk ]))
+    return plan
+
+# ----------------------------------------------------------------------
+# MERGING
+
+def merge_lead_stats(a, b):
+    h = dict(a)
+    h['count'] = a['count'] + b['count']
+    h['high'] = max(a['high'], b['high'])
+    h['low'] = min(a['low'], b['low'])
+    h['total'] = a['total'] + b['total']
+    h['peak_count'] = a['peak_count'] + b['peak_count']
+    if h['count']:
+        h['baseline'] = int((a['baseline'] * a['count'] + b['baseline'] * b['count']) / h['count'])
+    h['ppv'] = h['high'] - h['low']
+    # voltage is ppv / gain; recover the gain from either request
+    for s in [ a, b ]:
+        if s.get('ppv'):
+            h['voltage'] = h['ppv'] * s['voltage'] / s['ppv']
+            break
+    return h
+
+def merge_tracing_quality(results):
+    merged = dict(results[0])
+    tq = { }
+    stats = { }
+    for res in results:
+        for lead, h in res.get('tracing-quality', { }).items():
+            if lead not in tq:
+                tq[lead] = dict(h)
+            else:
+                tq[lead] = { k: min(v, h.get(k, v)) for k, v in tq[lead].items() }
+        for lead, h in res.get('ecg-stats', { }).items():
+            stats[lead] = merge_lead_stats(stats[lead], h) if lead in stats else h
+    merged['tracing-quality'] = tq
+    merged['ecg-stats'] = stats
+    return merged
+
+# Every group of a request maps to that request's (shared) results
+def merge_aggregate(results, plan):
+    merged = { 'groups': { }, 'tracing-quality': { } }
+    for res, (req, names) in zip(results, plan):
+        for h_input in req['input']:
+            group = input_group(h_input)
+            merged['groups'][group if group is not None else ''] = res
+        merged['tracing-quality'].update(res.get('tracing-quality', { }))
+    return merged
+
+def merge_by_input(results):
+    merged = dict(results[0])
+    for res in results[1:]:
+        for key, value in res.items():
+            if isinstance(value, dict) and isinstance(merged.get(key), dict):
+                merged[key] = dict(merged[key], **value)
+    return merged
+
+# Combine the AnalysisResults returned for the requests in plan
+def merge_results(data, plan, results):
+    if len(results) == 1:
+        return results[0]
+
+    ok = [ ]
+    ok_plan = [ ]
+    errors = [ ]
+    for res, (req, names) in zip(results, plan):
+        if res.get('object-type') == 'analysis-result':
+            ok.append(res)
+            ok_plan.append((req, names))
+        else:
+            errors.append({ 'inputs': names, 'error': res })
+    if not ok:
+        h = client_error("All %d requests failed" % len(results))
+        h['errors'] = errors
+        return h
+
+    merged = { k: v for k, v in ok[0].items() if k not in [ 'results', 'attachments', 'warnings' ] }
+    kind = analysis_type(data)
+    payloads = [ res.get('results') or { } for res in ok ]
+    if kind == 'ecg-tracing-quality':
+        merged['results'] = merge_tracing_quality(payloads)
+    elif kind == 'mcg-aggregate':
+        merged['results'] = merge_aggregate(payloads, ok_plan)
+    else:
+        merged['results'] = merge_by_input(payloads)
+    invoices = [ r['invoice-id'] for r in payloads if r.get('invoice-id') ]
+    if invoices:
+        merged['results']['invoice-id'] = ', '.join(invoices)
+
+    merged['id'] = ', '.join(str(res.get('id')) for res in ok)
+    merged['attachments'] = [ att for res in ok for att in res.get('attachments') or [ ] ]
+    merged['warnings'] = [ w for res in ok for w in res.get('warnings') or [ ] ]
+    merged['requests'] = len(results)
+    if errors:
+        merged['errors'] = errors
+    return merged
+
+# ----------------------------------------------------------------------
+# SUBMISSION
+
+def _analyze(client, server_url, token, req):
+    try:
+        return client.analyze(server_url, token, req)
+    except Exception as e:
+        return client_error("%s: %s" % (e.__class__.__name__, str(e)))
+
+# Split data, send the requests in parallel and return the merged result
+def submit_planned(server_url, token, data, client=None, workers=DEFAULT_WORKERS,
+                   max_bytes=DEFAULT_MAX_BYTES, max_inputs=DEFAULT_MAX_INPUTS):
+    if client is None:
+        client = default_client()
+    plan = plan_requests(data, max_bytes, max_inputs)
+    if len(plan) == 1:
+        return client.analyze(server_url, token, plan[0][0])
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda p: _analyze(client, server_url, token, p[0]), plan))
+    return merge_results(data, plan, results)
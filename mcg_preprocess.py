@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Batched preprocessing of ECG recordings before submission.
+#
+# The examples send ECG JSON objects (as in data/ecg_*.json) recorded at
+# 100 Hz, with gain and offset set by hand. preprocess() takes recordings
+# from other devices in the same shape, at any sampling frequency, gain and
+# offset, and returns ECG JSON objects ready for the 'data' of an input (as
+# input_for_ecg_json() builds it) in which:
+#   - every lead is resampled to frequency (100 Hz by default)
+#   - samples are rescaled to gain and offset (500 and 0 by default):
+#     sample = round(mV * gain + offset), with mV = (x - offset) / gain of
+#     the source lead
+#   - lead names are the API's (case is corrected, so 'v5' becomes 'V5');
+#     with leads=[ ... ], only those leads are kept, in that order
+# and checks each recording:
+#   - known lead names, no duplicates, none of the wanted leads missing
+#   - non-zero gain
+#   - all leads the same length, at least MIN_DURATION seconds long
+#   - clipping: leads with more than clip_fraction of their samples at
+#     their minimum or maximum value (an amplifier or ADC at its limit, or
+#     a flat line)
+# A recording with a problem is returned as None, with its problems, so it
+# is not submitted.
+#
+# Leads of the same length and frequency are stacked into one 2-D array
+# (mcg_quality.LeadBatch) and processed together. Resampling is done in
+# the frequency domain (numpy.fft), which is also the anti-aliasing filter
+# when the rate is reduced. Samples may be lists or numpy arrays (such as
+# ECGStore.recording(name, arrays=True) returns); with arrays=True the
+# output samples are int64 arrays instead of lists.
+#
+# Preprocess ECG JSON files into a directory:
+#   python mcg_preprocess.py out_dir ecg.json [ecg.json ...]
+#
+# Requires numpy.
+
+import json
+import os
+import sys
+import time
+from fractions import Fraction
+import numpy as np
+from mcg_quality import LeadBatch
+from mcg_validate import LEADS, MIN_DURATION
+
+DEFAULT_FREQUENCY = 100
+DEFAULT_GAIN = 500.0
+DEFAULT_OFFSET = 0
+
+# largest fraction of a lead's samples at its minimum or maximum
+CLIP_FRACTION = 0.01
+
+# lower-case lead name : API lead name
+LEAD_NAMES = { name.lower(): name for name in LEADS }
+
+# Resample the rows of x (leads, samples) from src to dst Hz. Samples at
+# the end that do not make up a whole output sample are dropped. The line
+# from the first to the last sample is subtracted first and added back
+# after, so that the FFT does not see a step where the signal wraps
+# around.
+def resample(x, src, dst):
+    ratio = Fraction(dst) / Fraction(src).limit_denominator(1000)
+    if ratio == 1:
+        return x
+    n = x.shape[1] - x.shape[1] % ratio.denominator
+    m = int(n * ratio)
+    x = x[:, :n]
+    if n < 2 or m < 2:
+        return np.zeros((len(x), m))
+    ramp = x[:, :1] + (x[:, -1:] - x[:, :1]) * (np.arange(n) / (n - 1.0))
+    spec = np.fft.rfft(x - ramp, axis=1)
+    keep = min(n, m) // 2 + 1
+    out = np.zeros((len(x), m // 2 + 1), dtype=spec.dtype)
+    out[:, :keep] = spec[:, :keep]
+    if min(n, m) % 2 == 0:
+        # split the Nyquist bin of the shorter signal
+        out[:, keep - 1] *= 0.5
+    y = np.fft.irfft(out, m, axis=1) * (float(m) / n)
+    t = np.arange(m) * (float(n) / m)
+    return y + x[:, :1] + (x[:, -1:] - x[:, :1]) * (t / (n - 1.0))
+
+# Fraction of the samples in each row of x at the row's minimum or maximum
+def clipped_fraction(x):
+    lo = x.min(axis=1, keepdims=True)
+    hi = x.max(axis=1, keepdims=True)
+    return ((x == lo) | (x == hi)).sum(axis=1) / float(x.shape[1])
+
+# Return a list of (ECG JSON object or None, [ problem, ... ]), one for
+# each recording, in order
+def preprocess(recordings, frequency=DEFAULT_FREQUENCY, gain=DEFAULT_GAIN,
+               offset=DEFAULT_OFFSET, leads=None, clip_fraction=CLIP_FRACTION,
+               arrays=False):
+    recordings = list(recordings)
+    batch = LeadBatch(recordings)
+    samples = [ None ] * len(batch)
+    clipped = np.zeros(len(batch))
+    for idx, x in batch.groups:
+        clipped[idx] = clipped_fraction(x)
+        gains = batch.gains[idx]
+        mv = (x - batch.offsets[idx][:, None]) / np.where(gains == 0, 1.0, gains)[:, None]
+        for src in np.unique(batch.freqs[idx]):
+            rows = np.flatnonzero(batch.freqs[idx] == src)
+            y = resample(mv[rows], src, frequency)
+            y *= gain
+            y += offset
+            y = np.rint(y).astype(np.int64)
+            for r, i in enumerate(idx[rows]):
+                samples[i] = y[r]
+
+    res = [ ]
+    i = 0
+    for ecg in recordings:
+        problems = [ ]
+        signals = [ ]
+        for sig in ecg.get('signals') or [ ]:
+            name = LEAD_NAMES.get(str(sig.get('name')).lower(), sig.get('name'))
+            data = sig.get('data')
+            h = { k: v for k, v in sig.items() if k != 'data' }
+            h.update({ 'name': name, 'gain': gain, 'offset': offset, 'data': samples[i] })
+            if leads is None or name in leads:
+                if data is None or not len(data):
+                    problems.append("signal '%s' has no sample data" % name)
+                    h['data'] = np.zeros(0, dtype=np.int64)
+                elif sig.get('gain') == 0:
+                    problems.append("signal '%s' gain must not be zero" % name)
+                elif clipped[i] > clip_fraction:
+                    problems.append("signal '%s' is clipped (%0.1f%% of samples at its limits)" % (name, 100.0 * clipped[i]))
+            signals.append(h)
+            i += 1
+        problems.extend(check_signals(signals, frequency, leads))
+        if leads:
+            by_name = { sig['name']: sig for sig in signals }
+            signals = [ by_name[name] for name in leads if name in by_name ]
+        if problems:
+            res.append((None, problems))
+            continue
+        if not arrays:
+            for sig in signals:
+                sig['data'] = sig['data'].tolist()
+        h = { k: v for k, v in ecg.items() if k != 'signals' }
+        h['frequency'] = frequency
+        h['signals'] = signals
+        res.append((h, [ ]))
+    return res
+
+# Problems with the names and lengths of a recording's preprocessed signals
+def check_signals(signals, frequency, leads=None):
+    problems = [ ]
+    seen = set()
+    for sig in signals:
+        name = sig['name']
+        if leads and name not in leads:
+            continue
+        if name not in LEADS:
+            problems.append("unknown lead name '%s'" % name)
+        elif name in seen:
+            problems.append("duplicate lead '%s'" % name)
+        seen.add(name)
+    for name in leads or [ ]:
+        if name not in seen:
+            problems.append("missing lead '%s'" % name)
+    lengths = sorted(set([ len(sig['data']) for sig in signals if sig['name'] in seen ]))
+    if len(lengths) > 1:
+        problems.append("signals have different lengths (%d and %d samples)" % (lengths[0], lengths[-1]))
+    elif lengths and lengths[0] < MIN_DURATION * frequency:
+        problems.append("signals are %0.1fs long, at least %ds required" % (lengths[0] / float(frequency), MIN_DURATION))
+    return problems
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.stderr.write("Usage: %s out_dir ecg.json [ecg.json ...]\n" % sys.argv[0])
+        sys.exit(-1)
+    out_dir = sys.argv[1]
+    paths = sys.argv[2:]
+    recordings = [ ]
+    for path in paths:
+        with open(path, 'r') as f:
+            recordings.append(json.loads(f.read()))
+
+    start = time.perf_counter()
+    results = preprocess(recordings)
+    elapsed = time.perf_counter() - start
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    written = 0
+    for path, (ecg, problems) in zip(paths, results):
+        if ecg is None:
+            print("%s: %s" % (path, "; ".join(problems)))
+            continue
+        with open(os.path.join(out_dir, os.path.basename(path)), 'w') as f:
+            f.write(json.dumps(ecg))
+        written += 1
+    print("Preprocessed %d recordings in %0.1fms, wrote %d to %s" % (len(recordings), elapsed * 1000, written, out_dir))
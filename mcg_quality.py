@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Local estimate of ECG tracing quality, to pre-screen recordings before
+# they are uploaded.
+#
+# The API's ecg-tracing-quality analysis scores each lead from 0 to 100
+# (see print_results_summary() in tracing_quality_request.py):
+#   TQ baseline : baseline wander
+#   TQ noise    : high-frequency noise
+#   TQ range    : plausibility of the signal's voltage range
+#   tracing quality : the lowest of the three
+# estimate() computes comparable scores from the signals[].data arrays of
+# ECG JSON objects (as in data/ecg_*.json). Each lead's baseline is a
+# median filter over BASELINE_WINDOW seconds (at least one beat), and its
+# QRS amplitude the median peak-to-peak amplitude of one-second windows
+# with the baseline removed. The metrics are:
+#   wander  : change of the baseline over one window (90th percentile of
+#             the lead), relative to the QRS amplitude
+#   noise   : median absolute second difference of the samples, relative
+#             to the QRS amplitude (the median skips the QRS complexes)
+#   voltage : QRS amplitude in mV (samples / gain); outside VOLTAGE_RANGE
+#             the range score falls in proportion
+# The weights are set so that every recording in data/ passes a threshold
+# of 60. Leads of equal length are stacked and scored together as one 2-D
+# array, so a batch of recordings costs a few NumPy passes over its
+# samples.
+#
+# These are NOT the server's algorithm, and the default scores are not the
+# server's scores. Calibrate against the real API server before using
+# prescreen() to reject recordings: calibrate() compares local scores with
+# the server's for the same recordings, fits a linear correction for each
+# score, and reports how often a threshold on the local score agrees with
+# the same threshold on the server's. Pass the fitted corrections to
+# estimate() to apply them (see calibrate_tracing_quality.py). The stub
+# server's scores are synthesized, so calibrating against it only tests
+# the procedure.
+#
+# Requires numpy.
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+SCORES = [ 'TQ baseline', 'TQ noise', 'TQ range', 'tracing quality' ]
+
+# score = 100 - weight * metric, clipped to 0-100
+WANDER_WEIGHT = 100.0
+NOISE_WEIGHT = 500.0
+# plausible QRS amplitude in mV
+VOLTAGE_RANGE = (0.3, 8.0)
+
+# seconds of signal in the baseline median filter
+BASELINE_WINDOW = 1.0
+# baseline points per window
+BASELINE_STEPS = 10
+# percentile of a lead's baseline changes scored as its wander
+WANDER_PERCENTILE = 90
+# leads filtered at once, which bounds the memory of the median filter
+BLOCK_LEADS = 64
+
+DEFAULT_FREQUENCY = 100
+
+# The leads of a batch of ECG recordings, grouped by length
+class LeadBatch:
+    # recordings : ECG JSON objects ({ 'frequency': ..., 'signals': [ ... ] });
+    #              signals[].data may be lists or numpy arrays
+    def __init__(self, recordings):
+        self.recording = [ ]
+        self.names = [ ]
+        gains = [ ]
+        offsets = [ ]
+        freqs = [ ]
+        samples = [ ]
+        for idx, ecg in enumerate(recordings):
+            freq = ecg.get('frequency') or DEFAULT_FREQUENCY
+            for sig in ecg.get('signals') or [ ]:
+                self.recording.append(idx)
+                self.names.append(str(sig.get('name')))
+                gains.append(float(sig.get('gain') or 1.0))
+                offsets.append(float(sig.get('offset') or 0.0))
+                freqs.append(int(freq))
+                data = sig.get('data')
+                samples.append(data if data is not None and len(data) else [ 0 ])
+        self.count = len(recordings)
+        self.recording = np.array(self.recording, dtype=np.int64)
+        self.gains = np.array(gains)
+        self.offsets = np.array(offsets)
+        self.freqs = np.array(freqs, dtype=np.int64)
+        lengths = np.array([ len(s) for s in samples ], dtype=np.int64)
+        # (lead indexes, samples[len(indexes), n]) for each length n
+        self.groups = [ ]
+        for n in np.unique(lengths):
+            idx = np.flatnonzero(lengths == n)
+            self.groups.append((idx, np.array([ samples[i] for i in idx ], dtype=np.float64)))
+
+    def __len__(self):
+        return len(self.names)
+
+# Median of the windows of w samples of each row of x, every step samples
+def median_baseline(x, w, step):
+    return np.median(sliding_window_view(x, w, axis=1)[:, ::step], axis=2)
+
+# Metrics of the rows of x (leads of n samples at one frequency); returns
+# arrays (wander, noise, QRS amplitude in samples)
+def block_metrics(x, frequency):
+    rows, n = x.shape
+    w = int(min(max(1, round(BASELINE_WINDOW * frequency)), n))
+    step = max(1, w // BASELINE_STEPS)
+    points = median_baseline(x, w, step)
+    # the baseline at every sample, linear between the window centres
+    t = (np.arange(n) - (w - 1) / 2.0) / step
+    j = np.clip(np.floor(t).astype(np.int64), 0, points.shape[1] - 1)
+    k = np.minimum(j + 1, points.shape[1] - 1)
+    frac = np.clip(t - j, 0.0, 1.0)
+    d = x - (points[:, j] * (1.0 - frac) + points[:, k] * frac)
+    m = n // w
+    qrs = np.median(np.ptp(d[:, :m * w].reshape(rows, m, w), axis=2), axis=1)
+    scale = np.maximum(qrs, 1.0)
+    lag = max(1, w // step)
+    wander = np.zeros(rows)
+    if points.shape[1] > lag:
+        change = np.abs(points[:, lag:] - points[:, :-lag])
+        wander = np.percentile(change, WANDER_PERCENTILE, axis=1) / scale
+    noise = np.zeros(rows)
+    if n > 2:
+        noise = np.median(np.abs(np.diff(x, 2, axis=1)), axis=1) / scale
+    return wander, noise, qrs
+
+# Metrics of the leads of a batch; returns arrays (wander, noise, voltage)
+def lead_metrics(batch):
+    wander = np.zeros(len(batch))
+    noise = np.zeros(len(batch))
+    voltage = np.zeros(len(batch))
+    for idx, x in batch.groups:
+        for f in np.unique(batch.freqs[idx]):
+            rows = np.flatnonzero(batch.freqs[idx] == f)
+            for start in range(0, len(rows), BLOCK_LEADS):
+                r = rows[start:start + BLOCK_LEADS]
+                i = idx[r]
+                wander[i], noise[i], qrs = block_metrics(x[r], f)
+                voltage[i] = qrs / batch.gains[i]
+    return wander, noise, voltage
+
+# Scores of the leads of a batch: { score name : array }.
+# calibration : { score name : (slope, intercept) } from calibrate()
+def lead_scores(batch, calibration=None):
+    wander, noise, voltage = lead_metrics(batch)
+    h = {
+        'TQ baseline': np.clip(100.0 - WANDER_WEIGHT * wander, 0.0, 100.0),
+        'TQ noise': np.clip(100.0 - NOISE_WEIGHT * noise, 0.0, 100.0),
+        'TQ range': 100.0 * np.minimum(np.minimum(1.0, voltage / VOLTAGE_RANGE[0]),
+                                       VOLTAGE_RANGE[1] / np.maximum(voltage, 1e-9))
+    }
+    for name, (slope, intercept) in (calibration or { }).items():
+        if name in h:
+            h[name] = np.clip(slope * h[name] + intercept, 0.0, 100.0)
+    h['tracing quality'] = np.minimum(np.minimum(h['TQ baseline'], h['TQ noise']), h['TQ range'])
+    return h
+
+# Estimate tracing quality for a list of ECG JSON objects. Returns one dict
+# per recording, shaped like the 'tracing-quality' results of the API:
+#   { 'all': { score : value }, <lead> : { score : value }, ... }
+# where 'all' has the lowest score of each kind over the leads.
+def estimate(recordings, calibration=None):
+    batch = LeadBatch(recordings)
+    h = lead_scores(batch, calibration)
+    res = [ { } for i in range(batch.count) ]
+    for i, (rec, name) in enumerate(zip(batch.recording, batch.names)):
+        res[rec][name] = { score: int(h[score][i]) for score in SCORES }
+    for tq in res:
+        tq['all'] = { score: min([ v[score] for v in tq.values() ] or [ 0 ]) for score in SCORES }
+    return res
+
+# Split recordings into (passed, rejected) lists of indexes by estimated
+# 'tracing quality'
+def prescreen(recordings, threshold, calibration=None):
+    passed = [ ]
+    rejected = [ ]
+    for idx, tq in enumerate(estimate(recordings, calibration)):
+        if tq['all']['tracing quality'] >= threshold:
+            passed.append(idx)
+        else:
+            rejected.append(idx)
+    return passed, rejected
+
+# ----------------------------------------------------------------------
+# CALIBRATION
+
+# Compare local estimates with server scores for the same recordings.
+# local, server : lists of 'tracing-quality' dicts (as from estimate(), and
+#                 results['tracing-quality'] of ecg-tracing-quality results)
+# Returns { score name : statistics } for every score that was compared,
+# using the scores of each lead and of 'all'. The fit (slope, intercept)
+# maps uncalibrated local scores onto the server's; agreement is the
+# fraction of recordings on the same side of threshold in 'all'.
+def calibrate(local, server, threshold=60):
+    report = { }
+    for score in SCORES:
+        x = [ ]
+        y = [ ]
+        for tq_local, tq_server in zip(local, server):
+            for lead, h in tq_server.items():
+                if isinstance(h, dict) and score in h and score in tq_local.get(lead, { }):
+                    x.append(tq_local[lead][score])
+                    y.append(h[score])
+        if not x:
+            continue
+        x = np.array(x, dtype=np.float64)
+        y = np.array(y, dtype=np.float64)
+        err = x - y
+        h = { 'count': len(x), 'bias': float(err.mean()), 'mae': float(np.abs(err).mean()),
+              'max-error': float(np.abs(err).max()), 'correlation': None, 'fit': (1.0, 0.0) }
+        if len(x) > 1 and x.std() > 0 and y.std() > 0:
+            h['correlation'] = float(np.corrcoef(x, y)[0, 1])
+            slope, intercept = np.polyfit(x, y, 1)
+            h['fit'] = (float(slope), float(intercept))
+        report[score] = h
+
+    # pass/fail agreement on the overall score
+    both = [ (l['all']['tracing quality'] >= threshold, s['all']['tracing quality'] >= threshold)
+             for l, s in zip(local, server) if 'all' in s ]
+    report['threshold'] = {
+        'threshold': threshold,
+        'count': len(both),
+        'agree': sum([ 1 for l, s in both if l == s ]),
+        # would be rejected locally although the server passes them
+        'false-reject': sum([ 1 for l, s in both if s and not l ]),
+        # would be uploaded although the server fails them
+        'false-pass': sum([ 1 for l, s in both if l and not s ])
+    }
+    return report
+
+# Corrections to pass to estimate(), from a calibrate() report: one per
+# component score. 'tracing quality' is not corrected itself, since it is
+# the lowest of the corrected components.
+def calibration_fit(report):
+    return { score: report[score]['fit'] for score in [ 'TQ baseline', 'TQ noise', 'TQ range' ]
+             if score in report }
+
+def print_calibration(report, indent="\t"):
+    for score in SCORES:
+        if score not in report:
+            continue
+        h = report[score]
+        corr = ("%0.3f" % h['correlation']) if h['correlation'] is not None else '-'
+        print(indent + "%-16s n %4d  bias %+6.1f  mae %5.1f  max %5.1f  r %s  fit %0.3fx%+0.1f" % (score, h['count'], h['bias'], h['mae'], h['max-error'], corr, h['fit'][0], h['fit'][1]))
+    h = report['threshold']
+    if h['count']:
+        print(indent + "Threshold %g: agree %d/%d (%0.1f%%)  false reject %d  false pass %d" % (h['threshold'], h['agree'], h['count'], 100.0 * h['agree'] / h['count'], h['false-reject'], h['false-pass']))
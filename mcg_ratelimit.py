@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Client-side pacing for MCG API requests.
+#
+# TokenBucket limits the request rate (requests/second with a burst
+# allowance). AdaptiveConcurrency limits the number of requests in flight
+# with an AIMD policy:
+#   - additive increase: +1 to the limit for every 'limit' requests that
+#     complete while latency stays near the baseline
+#   - multiplicative decrease: the limit is halved on HTTP 429/5xx or a
+#     connection error or timeout (not on local errors such as an expired
+#     token, which say nothing about the server), and cut by 10% when
+#     latency stays above 'tolerance' times the baseline for 'limit'
+#     completions in a row. As in TCP, the limit is decreased at most once
+#     per 'limit' completions, so a burst of slow or throttled requests
+#     counts as one congestion event.
+# Requests of different analysis types and sizes take very different
+# times, so each request's latency is compared with the baseline of its
+# kind (latency_key(): analysis type and number of inputs), the median of
+# the recent latencies of that kind. Only the ratios are smoothed, so a
+# mix of small and large requests, or a jittery server, does not look
+# like overload.
+#
+# RateController combines the two and is what MCGClient uses (limiter=).
+# report() returns the current limits and observed latency for tuning.
+
+import collections
+import threading
+import time
+from mcg_retry import RETRYABLE_EXCEPTIONS
+
+THROTTLE_STATUS = [ 429, 500, 502, 503, 504 ]
+
+class TokenBucket:
+    # rate  : tokens added per second
+    # burst : bucket capacity (default: one second's worth, at least 1)
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Block until a token is available
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    # Take a token if one is available; never blocks
+    def try_acquire(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+# The kind of request whose latencies make up one baseline: (analysis
+# type, number of inputs)
+def latency_key(data):
+    if not isinstance(data, dict):
+        return None
+    analysis = data.get('analysis')
+    inputs = data.get('input')
+    return (analysis.get('type') if isinstance(analysis, dict) else None,
+            len(inputs) if isinstance(inputs, list) else 0)
+
+class AdaptiveConcurrency:
+    # initial, minimum, maximum : bounds on the number of requests in flight
+    # tolerance                 : latency/baseline ratio treated as overload
+    # window                    : recent latencies kept per kind of request
+    # min_samples               : latencies of a kind needed for its baseline
+    def __init__(self, initial=2, minimum=1, maximum=16, tolerance=2.0, window=100,
+                 min_samples=5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.window = window
+        self.min_samples = min_samples
+        # latency_key : recent latencies
+        self.samples = { }
+        # smoothed latency/baseline ratio
+        self.smoothed = None
+        self.above = 0
+        self.inflight = 0
+        self.since_decrease = 0
+        self.cond = threading.Condition()
+        self.counters = { 'increases': 0, 'decreases': 0, 'throttled': 0 }
+
+    def acquire(self):
+        with self.cond:
+            while self.inflight >= int(self.limit):
+                self.cond.wait()
+            self.inflight += 1
+
+    # Take a slot if one is free; never blocks
+    def try_acquire(self):
+        with self.cond:
+            if self.inflight >= int(self.limit):
+                return False
+            self.inflight += 1
+            return True
+
+    # Give back a slot taken for a request that was not sent
+    def cancel(self):
+        with self.cond:
+            self.inflight -= 1
+            self.cond.notify_all()
+
+    # Record the outcome of a request: its latency in seconds and HTTP
+    # status, or (status None) the exception it failed with. key is the
+    # request's latency_key().
+    def release(self, latency, status, exc=None, key=None):
+        with self.cond:
+            self.inflight -= 1
+            self.since_decrease += 1
+            if status in THROTTLE_STATUS or isinstance(exc, RETRYABLE_EXCEPTIONS):
+                self.counters['throttled'] += 1
+                self._decrease(0.5)
+            elif status is None:
+                # failed before the server could answer
+                pass
+            else:
+                ratio = self._ratio(key, latency)
+                if ratio is not None:
+                    if self.smoothed is None:
+                        self.smoothed = ratio
+                    else:
+                        self.smoothed = 0.8 * self.smoothed + 0.2 * ratio
+                if self.smoothed is not None and self.smoothed > self.tolerance:
+                    self.above += 1
+                    if self.above >= int(self.limit):
+                        self._decrease(0.9)
+                else:
+                    self.above = 0
+                    if self.limit < self.maximum:
+                        self.limit = min(self.maximum, self.limit + 1.0 / int(self.limit))
+                        self.counters['increases'] += 1
+            self.cond.notify_all()
+
+    # Ratio of latency to the baseline of its kind (None until the kind has
+    # min_samples latencies); the latency is then added to the window
+    def _ratio(self, key, latency):
+        samples = self.samples.get(key)
+        if samples is None:
+            samples = self.samples[key] = collections.deque(maxlen=self.window)
+        ratio = None
+        if len(samples) >= self.min_samples:
+            ratio = latency / max(1e-6, self.baseline(samples))
+        samples.append(latency)
+        return ratio
+
+    def baseline(self, samples):
+        samples = sorted(samples)
+        return samples[len(samples) // 2]
+
+    def _decrease(self, factor):
+        if self.since_decrease < int(self.limit):
+            return
+        self.since_decrease = 0
+        self.limit = max(float(self.minimum), self.limit * factor)
+        self.counters['decreases'] += 1
+
+    def report(self):
+        with self.cond:
+            h = dict(self.counters)
+            h['limit'] = int(self.limit)
+            h['inflight'] = self.inflight
+            h['latency-ratio'] = self.smoothed
+            h['baseline-latency'] = { '%s/%d' % key if key else 'unknown': self.baseline(samples)
+                                      for key, samples in self.samples.items() }
+        return h
+
+class RateController:
+    # rate        : max requests per second (None: unlimited)
+    # burst       : token bucket capacity
+    # concurrency : AdaptiveConcurrency instance (None: unlimited)
+    def __init__(self, rate=None, burst=None, concurrency=None):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.concurrency = concurrency
+
+    def acquire(self):
+        if self.concurrency is not None:
+            self.concurrency.acquire()
+        if self.bucket is not None:
+            self.bucket.acquire()
+
+    # Take a concurrency slot and a token if both are available now; never
+    # blocks. Used for optional requests, such as hedges (mcg_hedge.py).
+    def try_acquire(self):
+        if self.concurrency is not None and not self.concurrency.try_acquire():
+            return False
+        if self.bucket is not None and not self.bucket.try_acquire():
+            if self.concurrency is not None:
+                self.concurrency.cancel()
+            return False
+        return True
+
+    def release(self, latency, status, exc=None, key=None):
+        if self.concurrency is not None:
+            self.concurrency.release(latency, status, exc, key)
+
+    def report(self):
+        h = { 'rate': self.bucket.rate if self.bucket else None }
+        if self.concurrency is not None:
+            h.update(self.concurrency.report())
+        return h
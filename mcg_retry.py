@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Retry policy and circuit breaker for the shared MCG API client.
+#
+# Each failed attempt is classified as retryable or fatal:
+#   retryable : connection errors/resets, timeouts, HTTP 429 and 5xx
+#   fatal     : HTTP 401 and other 4xx responses
+# API error objects (e.g. "Missing 'analysis' in request") are returned
+# with HTTP 200 and are never retried, since resending the same request
+# would fail the same way.
+#
+# Retryable failures are retried with full-jitter exponential backoff
+# (honouring Retry-After when the server sends one). A circuit breaker
+# counts consecutive retryable failures; once it opens, requests fail
+# immediately with CircuitOpenError until the reset timeout has passed
+# and a trial request succeeds.
+#
+# NOTE: a connection reset after the body was uploaded may mean the server
+#       did process (and bill) the request. Keep max_attempts low for
+#       expensive analyses.
+
+import random
+import threading
+import time
+import requests
+
+RETRYABLE_STATUS = [ 429, 500, 502, 503, 504 ]
+
+RETRYABLE_EXCEPTIONS = (requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout,
+                        requests.exceptions.ChunkedEncodingError)
+
+class CircuitOpenError(Exception):
+    pass
+
+# Classify the outcome of one attempt as 'ok', 'retryable' or 'fatal'.
+# Pass either the response or the exception raised by the attempt.
+def classify(response=None, exc=None):
+    if exc is not None:
+        if isinstance(exc, RETRYABLE_EXCEPTIONS):
+            return 'retryable'
+        return 'fatal'
+    if response.status_code in RETRYABLE_STATUS:
+        return 'retryable'
+    if response.status_code >= 400:
+        return 'fatal'
+    return 'ok'
+
+def failure_reason(response=None, exc=None):
+    if exc is not None:
+        return exc.__class__.__name__
+    return "HTTP %d" % response.status_code
+
+class RetryPolicy:
+    # max_attempts : total attempts per request, including the first
+    # base_delay   : backoff before the first retry, in seconds
+    # max_delay    : upper bound on any single backoff
+    def __init__(self, max_attempts=4, base_delay=0.5, max_delay=30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    # Full jitter: uniform in [0, min(max_delay, base_delay * 2^retry)]
+    def backoff(self, retry, response=None):
+        if response is not None and 'Retry-After' in response.headers:
+            try:
+                return min(self.max_delay, float(response.headers['Retry-After']))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** retry)))
+
+class CircuitBreaker:
+    # failure_threshold : consecutive retryable failures that open the circuit
+    # reset_timeout     : seconds to wait before letting a trial request through
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+
+    # Returns True if a request may be sent now
+    def allow(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # let a single trial request through
+                self.state = 'half-open'
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half-open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    # The attempt failed before reaching the server (e.g. an expired token
+    # or an invalid URL), which says nothing about the server's health. A
+    # trial request is handed back, so the next request is the trial.
+    def record_not_sent(self):
+        with self.lock:
+            if self.state == 'half-open':
+                self.state = 'open'
+
+class RetryStats:
+    # Thread-safe counters for monitoring retry behaviour
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = { 'requests': 0, 'attempts': 0, 'retries': 0,
+                          'succeeded': 0, 'fatal': 0, 'gave-up': 0,
+                          'circuit-open': 0 }
+        self.reasons = { }
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def record_failure(self, reason):
+        with self.lock:
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            h = dict(self.counters)
+            h['failures'] = dict(self.reasons)
+        return h
+
+# Call send() until it succeeds, fails fatally, or attempts run out.
+# send() performs one attempt and returns a response or raises. The last
+# response is returned (or the last exception re-raised) when giving up.
+def call_with_retry(send, policy, breaker=None, stats=None):
+    if stats is not None:
+        stats.incr('requests')
+    attempt = 0
+    while True:
+        if breaker is not None and not breaker.allow():
+            if stats is not None:
+                stats.incr('circuit-open')
+            raise CircuitOpenError("MCG API circuit breaker is open; request not sent")
+
+        attempt += 1
+        if stats is not None:
+            stats.incr('attempts')
+        response = None
+        exc = None
+        try:
+            response = send()
+            outcome = classify(response=response)
+        except Exception as e:
+            exc = e
+            outcome = classify(exc=e)
+
+        if outcome == 'ok':
+            if breaker is not None:
+                breaker.record_success()
+            if stats is not None:
+                stats.incr('succeeded')
+            return response
+
+        if stats is not None:
+            stats.record_failure(failure_reason(response, exc))
+        if outcome == 'fatal':
+            if breaker is not None:
+                if response is not None:
+                    # the server answered, so it is not degraded
+                    breaker.record_success()
+                else:
+                    # a local error: only transport exceptions (which are
+                    # retryable) count against the server
+                    breaker.record_not_sent()
+            if stats is not None:
+                stats.incr('fatal')
+        else:
+            if breaker is not None:
+                breaker.record_failure()
+            if attempt < policy.max_attempts:
+                if stats is not None:
+                    stats.incr('retries')
+                delay = policy.backoff(attempt - 1, response)
+                if response is not None:
+                    response.close()
+                time.sleep(delay)
+                continue
+            if stats is not None:
+                stats.incr('gave-up')
+
+        if exc is not None:
+            raise exc
+        return response
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Request body serialization with pre-serialized ECG data.
+#
+# input_for_ecg_json() parses each ECG JSON file into Python lists of ints,
+# and the client then serializes them again for every request. Instead,
+# input_for_raw_ecg() keeps the file's bytes as they are (RawJSON), and
+# serialize_request() splices them straight into the request body, so the
+# samples are never converted. A queued request holds the file bytes rather
+# than a list of int objects, which is several times smaller.
+#
+# The rest of the request is serialized with orjson when it is installed
+# (pip install orjson), otherwise with the standard json module. RawJSON
+# values are written as placeholders and replaced with the raw bytes
+# afterwards (orjson.Fragment is used directly where available).
+#
+# By default the raw bytes are not parsed at all. With validate=True they
+# are parsed once when loaded, to check that they are a JSON object and to
+# keep a summary (frequency, lead names, gain, offset, sample count) for the
+# input checks of mcg_validate.py (validate_request(data, inputs=True)),
+# which skip RawJSON without a summary. Parsing takes far longer than the
+# splice itself (see benchmark_serialize.py).
+
+import hashlib
+import json
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_PLACEHOLDER = '\x00mcg-raw\x00'
+# the placeholder as it appears in the serialized body
+_PLACEHOLDER_BYTES = b'"\\u0000mcg-raw\\u0000"'
+
+_HAS_FRAGMENT = orjson is not None and hasattr(orjson, 'Fragment')
+
+class SampleSummary(list):
+    # Stands in for a signal's sample list in RawJSON.summary: holds the
+    # first and last samples, but has the length of the full list
+    def __init__(self, samples):
+        list.__init__(self, [ samples[0], samples[-1] ] if samples else [ ])
+        self.count = len(samples)
+
+    def __len__(self):
+        return self.count
+
+class RawJSON:
+    # raw     : serialized JSON value (bytes or str)
+    # summary : the value with sample lists replaced by SampleSummary, or
+    #           None if the value was not checked
+    __slots__ = ('raw', 'summary', '_digest')
+
+    def __init__(self, raw, summary=None):
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+        self.raw = raw
+        self.summary = summary
+        self._digest = None
+
+    # SHA-256 of the raw bytes, used in place of the value by request_key()
+    @property
+    def digest(self):
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.raw).hexdigest()
+        return self._digest
+
+def _loads(raw):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def summarize_ecg(data):
+    h = dict(data)
+    signals = [ ]
+    for sig in data.get('signals') or [ ]:
+        if isinstance(sig, dict) and isinstance(sig.get('data'), list):
+            sig = dict(sig, data=SampleSummary(sig['data']))
+        signals.append(sig)
+    h['signals'] = signals
+    return h
+
+# Wrap the contents of an ECG JSON file (bytes or str) as RawJSON.
+# Raises ValueError if validate is set and it is not a JSON object.
+def load_raw_ecg(raw, validate=False):
+    if isinstance(raw, str):
+        raw = raw.encode('utf-8')
+    if not validate:
+        return RawJSON(raw)
+    data = _loads(raw)
+    if not isinstance(data, dict):
+        raise ValueError("ECG JSON must be an object")
+    return RawJSON(raw, summarize_ecg(data))
+
+def read_raw_ecg(path, validate=False):
+    with open(path, 'rb') as f:
+        return load_raw_ecg(f.read(), validate)
+
+# Same input as input_for_ecg_json in the examples, with the ECG data kept
+# as raw bytes. raw may be RawJSON, bytes or str.
+def input_for_raw_ecg(raw, age=40, gender='M', validate=False):
+    if not isinstance(raw, RawJSON):
+        raw = load_raw_ecg(raw, validate)
+    ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return {
+      "type": "ecg",
+      "format": "json",
+      "timestamp": ts,
+      "age": age,
+      "gender": gender,
+      "data": raw
+    }
+
+# Serialize a request (or any JSON value) to bytes, splicing in RawJSON
+def serialize_request(data):
+    raws = [ ]
+    fragments = [ _HAS_FRAGMENT ]
+
+    def default(obj):
+        if isinstance(obj, RawJSON):
+            if fragments[0]:
+                return orjson.Fragment(obj.raw)
+            raws.append(obj.raw)
+            return _PLACEHOLDER
+        raise TypeError("Object of type %s is not JSON serializable" % obj.__class__.__name__)
+
+    body = None
+    if orjson is not None:
+        try:
+            body = orjson.dumps(data, default=default)
+        except TypeError:
+            # e.g. integers too large for orjson
+            del raws[:]
+            fragments[0] = False
+    if body is None:
+        body = json.dumps(data, separators=(',', ':'), default=default).encode('utf-8')
+    if not raws:
+        return body
+    parts = body.split(_PLACEHOLDER_BYTES)
+    if len(parts) != len(raws) + 1:
+        raise ValueError("Request contains the RawJSON placeholder string")
+    out = [ parts[0] ]
+    for raw, part in zip(raws, parts[1:]):
+        out.append(raw)
+        out.append(part)
+    return b''.join(out)
+
+# json.dumps default= hook identifying RawJSON by its digest, for hashing
+def digest_default(obj):
+    if isinstance(obj, RawJSON):
+        return { 'raw-json-sha256': obj.digest }
+    raise TypeError("Object of type %s is not JSON serializable" % obj.__class__.__name__)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Incremental parsing of AnalysisResult responses.
+#
+# decode_response() reads the whole response body and builds every
+# attachment (base64 heatmaps, transform arrays, ...) before returning.
+# StreamingResponse instead reads the body from the socket in chunks and
+# parses one top-level field at a time. The fields before 'attachments'
+# (including 'results') are available as soon as they have arrived, and
+# each attachment is parsed and yielded individually, so only one
+# attachment is held in memory at a time.
+#
+# Stopping early (e.g. after reading 'results') closes the connection
+# instead of returning it to the pool, since the rest of the body is unread.
+# The request's timings (mcg_timing.py) are recorded when it is closed.
+
+import json
+import re
+import time
+from mcg_client import default_client, decode_response
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = b' \t\r\n'
+_QUOTE = ord('"')
+_BACKSLASH = ord('\\')
+_OPEN = b'{['
+
+# next character that matters inside a string / inside a container
+_STRING_RE = re.compile(rb'["\\]')
+_STRUCT_RE = re.compile(rb'["{}\[\]]')
+_SCALAR_END_RE = re.compile(rb'[,}\]\s]')
+
+class _Scanner:
+    # Finds the extent of JSON values in a stream of byte chunks. Only the
+    # value currently being parsed is kept in the buffer.
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buf = bytearray()
+        self.pos = 0
+
+    def fill(self):
+        for chunk in self.chunks:
+            if chunk:
+                self.buf += chunk
+                return True
+        return False
+
+    def discard(self):
+        del self.buf[:self.pos]
+        self.pos = 0
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return chr(self.buf[self.pos])
+            self.discard()
+            if not self.fill():
+                raise ValueError("Unexpected end of response body")
+
+    def expect(self, chars):
+        c = self.peek()
+        if c not in chars:
+            raise ValueError("Expected one of '%s' in response body, got '%s'" % (chars, c))
+        self.pos += 1
+        return c
+
+    def _value_end(self):
+        buf = self.buf
+        i = self.pos
+        if buf[i] not in _OPEN and buf[i] != _QUOTE:
+            while True:
+                m = _SCALAR_END_RE.search(buf, i)
+                if m is not None:
+                    return m.start()
+                i = len(buf)
+                if not self.fill():
+                    return i
+
+        depth = 0
+        in_string = False
+        while True:
+            m = (_STRING_RE if in_string else _STRUCT_RE).search(buf, i)
+            if m is None:
+                i = len(buf)
+                if not self.fill():
+                    raise ValueError("Unexpected end of response body")
+                continue
+            j = m.start()
+            c = buf[j]
+            if in_string:
+                if c == _BACKSLASH:
+                    if j + 1 >= len(buf) and not self.fill():
+                        raise ValueError("Unexpected end of response body")
+                    i = j + 2
+                    continue
+                in_string = False
+                i = j + 1
+                if depth == 0:
+                    return i
+            elif c == _QUOTE:
+                in_string = True
+                i = j + 1
+            elif c in _OPEN:
+                depth += 1
+                i = j + 1
+            else:
+                depth -= 1
+                i = j + 1
+                if depth == 0:
+                    return i
+
+    def read_value(self):
+        self.peek()
+        self.discard()
+        end = self._value_end()
+        value = json.loads(bytes(self.buf[self.pos:end]))
+        self.pos = end
+        return value
+
+def _iter_array(scanner):
+    scanner.expect('[')
+    if scanner.peek() == ']':
+        scanner.pos += 1
+        return
+    while True:
+        yield scanner.read_value()
+        if scanner.expect(',]') == ']':
+            return
+
+# Yield (key, value) for each top-level field of the JSON object in chunks.
+# The value of 'attachments' is a generator over the attachment objects,
+# which must be exhausted before the next field is requested.
+def iter_fields(chunks):
+    scanner = _Scanner(chunks)
+    scanner.expect('{')
+    if scanner.peek() == '}':
+        return
+    while True:
+        key = scanner.read_value()
+        scanner.expect(':')
+        if key == 'attachments' and scanner.peek() == '[':
+            yield key, _iter_array(scanner)
+        else:
+            yield key, scanner.read_value()
+        if scanner.expect(',}') == '}':
+            return
+
+class StreamingResponse:
+    # chunks : iterable of bytes making up the response body
+    # close  : called once the body has been read or abandoned
+    def __init__(self, chunks, close=None):
+        self._close = close
+        self._fields = iter_fields(chunks)
+        self._attachments = None
+        self.has_attachments = False
+        self.header = { }
+        for key, value in self._fields:
+            if key == 'attachments':
+                self._attachments = value
+                self.has_attachments = True
+                return
+            self.header[key] = value
+        self.close()
+
+    @property
+    def object_type(self):
+        return self.header.get('object-type')
+
+    @property
+    def results(self):
+        return self.header.get('results')
+
+    # Yield attachments as they are parsed, optionally only those with the
+    # given attachment name or output extension. Fields after 'attachments'
+    # (e.g. 'warnings') are added to self.header once all have been read.
+    def attachments(self, name=None, output=None):
+        if self._attachments is None:
+            return
+        for att in self._attachments:
+            if name is not None and att.get('name') != name:
+                continue
+            if output is not None and att.get('output') != output:
+                continue
+            yield att
+        self._attachments = None
+        for key, value in self._fields:
+            self.header[key] = value
+        self.close()
+
+    # Read the rest of the response and return it as decode_response would
+    def to_dict(self):
+        atts = list(self.attachments())
+        res = dict(self.header)
+        if self.has_attachments:
+            res['attachments'] = atts
+        return res
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def stream_response(resp, chunk_size=DEFAULT_CHUNK_SIZE):
+    if resp.status_code != 200:
+        h = decode_response(resp)
+        resp.close()
+        return StreamingResponse([ json.dumps(h).encode('utf-8') ])
+    timings = getattr(resp, 'timings', None)
+    if timings is None:
+        try:
+            return StreamingResponse(resp.iter_content(chunk_size), resp.close)
+        except BaseException:
+            # the header could not be parsed
+            resp.close()
+            raise
+
+    def close():
+        # the body is parsed as it arrives, so parsing counts as download
+        if timings.headers_at is not None:
+            timings.add('download', time.perf_counter() - timings.headers_at)
+        timings.bytes_down += resp.raw.tell()
+        timings.outcome = sr.object_type
+        timings.finish(sr.header)
+        resp.close()
+    try:
+        sr = StreamingResponse(resp.iter_content(chunk_size))
+    except BaseException as e:
+        timings.outcome = e.__class__.__name__
+        timings.finish()
+        resp.close()
+        raise
+    sr._close = close
+    if not sr.has_attachments:
+        # already read to the end
+        sr.close()
+    return sr
+
+def send_api_request_stream(server_url, token, data, chunk_size=DEFAULT_CHUNK_SIZE):
+    resp = default_client().post(server_url, token, data, stream=True)
+    return stream_response(resp, chunk_size)
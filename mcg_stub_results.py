@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Synthetic AnalysisResults for the local MCG API stand-in server.
+#
+# build_result() answers a (valid) AnalysisRequest with an AnalysisResult
+# shaped like the ones returned by the API server:
+#   mcg-aggregate       : the results in
+#                         data/analysis-results.ecg-files.example.json, with
+#                         tracing-quality, diagnosis-matrix and invoice-id
+#                         rebuilt for the submitted inputs
+#   mcg-differential    : per-input tracing-quality and ecg-stats
+#   ecg-tracing-quality : tracing-quality and ecg-stats for each lead
+# plus one attachment per requested output extension (result-json,
+# result-explain-json, feature-json, transform-json, transform-heatmap,
+# report-json, result-diff-csv), in the layout the 5.x-9.x examples parse.
+#
+# ecg-stats are computed from the submitted signals; everything else is
+# pseudo-random but seeded from the input data, so the same request always
+# gets the same answer. NONE of this is an analysis - the values only have
+# the right shape and size for exercising client code.
+
+import base64
+import copy
+import itertools
+import json
+import operator
+import os
+import random
+import threading
+import time
+
+RESULT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data',
+                           'analysis-results.ecg-files.example.json')
+
+ANALYSIS_TYPES = [ 'mcg-aggregate', 'mcg-differential', 'ecg-tracing-quality' ]
+
+# number of points in each synthesized transform
+TRANSFORM_SIZE = 128
+# single-lead transforms are computed for each lead, the others for the pair
+LEAD_TRANSFORMS = { 'amp': 'amplitude spectrum', 'aps': 'auto power spectrum' }
+PAIR_TRANSFORMS = { 'ccr': 'cross correlation', 'coh': 'coherence',
+                    'imr': 'impulse response', 'psa': 'phase shift angle',
+                    'xar': 'cross power spectrum' }
+
+ALGORITHMS = { 'ISC': 'Ischemia', 'HYP': 'Hypertrophy', 'ARR': 'Arrhythmia',
+               'MYO': 'Myocardial Function', 'SEV': 'Disease Severity' }
+
+_canned = None
+_canned_lock = threading.Lock()
+_invoice_lock = threading.Lock()
+_invoice_seq = itertools.count(1)
+
+def canned_result():
+    global _canned
+    if _canned is None:
+        with _canned_lock:
+            if _canned is None:
+                with open(RESULT_FILE, 'r') as f:
+                    _canned = json.loads(f.read())
+    return _canned
+
+def next_invoice_id(analysis_type):
+    with _invoice_lock:
+        seq = next(_invoice_seq)
+    return "%s-%08d-%s" % (time.strftime('%Y-%m-%d'), seq, analysis_type.split('-')[0])
+
+# Name used for an input in results and attachments: its 'name' if given,
+# otherwise its index in the request
+def input_name(h_input, idx):
+    if isinstance(h_input, dict) and h_input.get('name'):
+        return str(h_input['name'])
+    return str(idx)
+
+def input_signals(h_input):
+    data = h_input.get('data') if isinstance(h_input, dict) else None
+    if not isinstance(data, dict):
+        return [ ]
+    return [ s for s in data.get('signals') or [ ] if isinstance(s, dict) ]
+
+def input_rng(h_input, idx):
+    seed = [ idx ]
+    for sig in input_signals(h_input):
+        samples = sig.get('data') or [ ]
+        seed.append(len(samples))
+        seed.append(sum(samples[:256]))
+    return random.Random(repr(seed))
+
+# ----------------------------------------------------------------------
+# ECG STATISTICS
+
+def lead_stats(sig):
+    samples = sig.get('data') or [ 0 ]
+    gain = sig.get('gain') or 1.0
+    offset = sig.get('offset') or 0
+    high = max(samples)
+    low = min(samples)
+    total = sum(samples)
+    baseline = total / len(samples)
+    # count excursions above 60% of the way from baseline to the peak
+    threshold = baseline + 0.6 * (high - baseline)
+    peaks = 0
+    above = False
+    for v in samples:
+        if v > threshold and not above:
+            peaks += 1
+        above = v > threshold
+    return {
+        'count': len(samples),
+        'high': high,
+        'low': low,
+        'baseline': int(baseline),
+        'total': total,
+        'peak_count': peaks,
+        'voltage': (high - low) / gain,
+        'ppv': high - low,
+        'offset': offset
+    }
+
+# Tracing quality scores (0-100) derived from ecg-stats: a wandering
+# baseline, excessive sample-to-sample noise, or an implausible voltage
+# range lower the score
+def lead_quality(sig, stats):
+    samples = sig.get('data') or [ 0 ]
+    span = max(1, stats['ppv'])
+    n = len(samples)
+    quarter = max(1, n // 4)
+    means = [ sum(samples[i:i+quarter]) / len(samples[i:i+quarter])
+              for i in range(0, n, quarter) if samples[i:i+quarter] ]
+    drift = (max(means) - min(means)) / span
+    noise = sum(map(abs, map(operator.sub, samples[1:], samples[:-1]))) / (n * span)
+    voltage = stats['voltage']
+    h = {
+        'TQ baseline': int(max(0, 100 - 200 * drift)),
+        'TQ noise': int(max(0, 100 - 400 * noise)),
+        'TQ range': 100 if 0.2 <= voltage <= 10.0 else 50
+    }
+    h['tracing quality'] = min(h.values())
+    return h
+
+# Return (summary scores, { lead : scores }, { lead : ecg-stats }) for an input
+def input_quality(h_input):
+    leads = { }
+    stats = { }
+    for sig in input_signals(h_input):
+        lead = str(sig.get('name'))
+        stats[lead] = lead_stats(sig)
+        leads[lead] = lead_quality(sig, stats[lead])
+    h = { }
+    for key in [ 'tracing quality', 'TQ baseline', 'TQ noise', 'TQ range' ]:
+        h[key] = min([ q[key] for q in leads.values() ] or [ 0 ])
+    return h, leads, stats
+
+# ----------------------------------------------------------------------
+# ATTACHMENTS
+
+def make_attachment(name, output, inp, group, data, options, mime_type=None, encoding='none'):
+    if mime_type is None:
+        if (options or { }).get('in-place-json'):
+            mime_type = 'application/x-java-object'
+        else:
+            mime_type = 'application/json'
+            data = json.dumps(data)
+    return { 'name': name, 'output': output, 'input': inp, 'group': group,
+             'mime-type': mime_type, 'encoding': encoding, 'data': data }
+
+def diagnosis_names():
+    return sorted(k for k, v in canned_result()['results']['representative'].items()
+                  if not isinstance(v, str))
+
+def result_json(rng, ts):
+    names = diagnosis_names()
+    h = { 'timestamp': ts }
+    for sym, algo_name in ALGORITHMS.items():
+        diagnoses = { }
+        for i, name in enumerate(rng.sample(names, 4)):
+            value = round(rng.uniform(0, 10), 1)
+            diagnoses['%s%d' % (sym, i+1)] = {
+                'name': name,
+                'positive': value > 5,
+                'value': value,
+                'refs': [ { 'type': 'feature', 'component': 'xform',
+                            'source': rng.choice(list(LEAD_TRANSFORMS)),
+                            'item': 'F%d' % rng.randint(1, 32),
+                            'weight': round(rng.random(), 2) } ]
+            }
+        h[sym] = { 'sym': sym, 'name': algo_name, 'diagnoses': diagnoses }
+    return h
+
+def result_explain_json(rng):
+    h = { }
+    for sym, algo_name in ALGORITHMS.items():
+        h[sym] = { 'name': algo_name,
+                   'backtrace': { 'rules': [ 'R%d' % rng.randint(1, 99) for i in range(3) ],
+                                  'score': round(rng.uniform(0, 10), 1) } }
+    return h
+
+def transform_syms(leads):
+    syms = [ ]
+    for xform, name in LEAD_TRANSFORMS.items():
+        for lead in leads:
+            syms.append(('%s.%s' % (xform, lead), xform, name, 'signal', lead))
+    pair = '(%s)' % ','.join(leads[:2])
+    for xform, name in PAIR_TRANSFORMS.items():
+        syms.append(('%s.%s' % (xform, pair), xform, name, 'signal pair', pair))
+    return syms
+
+def feature_json(rng, ts, leads):
+    h = { 'timestamp': ts }
+    for sym, xform, name, source_type, source in transform_syms(leads):
+        features = { }
+        for i in range(8):
+            value = round(rng.uniform(0, 100), 1)
+            features['F%d' % (i+1)] = { 'name': '%s feature %d' % (xform, i+1),
+                                        'positive': value > 50, 'value': value }
+        h[sym] = { 'name': '%s of %s %s' % (name, source_type, source), 'features': features }
+    return h
+
+def transform_json(rng, ts, leads):
+    h = { 'timestamp': ts }
+    for sym, xform, name, source_type, source in transform_syms(leads):
+        h[sym] = {
+            'sym': sym, 'name': name, 'source_type': source_type, 'source': source,
+            'domain': 'frequency', 'label': '%s of %s %s' % (name, source_type, source),
+            'x_label': 'frequency (Hz)', 'y_label': 'magnitude',
+            'data': [ round(rng.uniform(0, 400), 3) for i in range(TRANSFORM_SIZE) ]
+        }
+    return h
+
+def heatmap_svg(rng, title, rows, cols=32):
+    cells = [ ]
+    for y in range(rows):
+        for x in range(cols):
+            level = rng.randint(0, 255)
+            cells.append('<rect x="%d" y="%d" width="10" height="10" fill="rgb(%d,0,%d)"/>'
+                         % (x * 10, y * 10, level, 255 - level))
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d">'
+            '<title>%s</title>%s</svg>' % (cols * 10, rows * 10, title, ''.join(cells)))
+
+def report_json(rng, names, inputs, leads):
+    report = [ ]
+    for idx, h_input in enumerate(inputs):
+        results = { }
+        for name in diagnosis_names():
+            value = round(rng.uniform(0, 10), 1)
+            results[name] = { 'positive': value > 5, 'value': value }
+        report.append({
+            'index': idx,
+            'input': names[idx],
+            'timestamp': h_input.get('timestamp', ''),
+            'results': results,
+            'transforms': { sym: [ round(rng.uniform(0, 400), 3) for i in range(TRANSFORM_SIZE) ]
+                            for sym, _, _, _, _ in transform_syms(leads) }
+        })
+    return report
+
+def diff_csv(rng, names, inputs, options):
+    delim = (options or { }).get('delimiter', ',')
+    diags = diagnosis_names()
+    groups = [ ]
+    for h_input in inputs:
+        group = h_input.get('group')
+        if group not in groups:
+            groups.append(group)
+    members = { 'A': [ n for n, h in zip(names, inputs) if h.get('group') == groups[0] ],
+                'B': [ n for n, h in zip(names, inputs) if len(groups) > 1 and h.get('group') == groups[1] ] }
+
+    def row(group, inp, op):
+        return delim.join([ group, inp, op ] + [ rng.choice('+-X') for d in diags ])
+
+    lines = [ delim.join([ 'groups', 'inputs', 'operation' ] + diags),
+              row('A', '', 'I'), row('B', '', 'I'),
+              row('A*B', '', 'A^B'), row('A*B', '', 'A-B'), row('A*B', '', 'B-A') ]
+    for i, a in enumerate(members['A']):
+        for j, b in enumerate(members['B']):
+            for op in [ 'A%d^B%d', 'A%d-B%d', 'B%d-A%d' ]:
+                ij = (j+1, i+1) if op.startswith('B') else (i+1, j+1)
+                lines.append(row('A*B', '%s,%s' % (a, b), op % ij))
+    return '\n'.join(lines) + '\n'
+
+def build_attachments(data, names, rngs):
+    outputs = data.get('output') or { }
+    inputs = data['input']
+    leads = [ str(s.get('name')) for s in input_signals(inputs[0]) ] or [ 'V5', 'II' ]
+    all_inputs = ','.join(names)
+    ts = int(time.time())
+    atts = [ ]
+    warnings = [ ]
+    for output, options in outputs.items():
+        if output == 'result-json':
+            atts.append(make_attachment('result-group', output, all_inputs, 'all',
+                                        result_json(rngs[0], ts), options))
+            for idx, name in enumerate(names):
+                atts.append(make_attachment('result-sample', output, name, inputs[idx].get('group', ''),
+                                            result_json(rngs[idx], ts), options))
+        elif output == 'result-explain-json':
+            atts.append(make_attachment('result-explain-group', output, all_inputs, 'all',
+                                        result_explain_json(rngs[0]), options))
+            for idx, name in enumerate(names):
+                atts.append(make_attachment('result-explain-sample', output, name, inputs[idx].get('group', ''),
+                                            result_explain_json(rngs[idx]), options))
+        elif output == 'feature-json':
+            atts.append(make_attachment('feature-group', output, all_inputs, 'all',
+                                        feature_json(rngs[0], ts, leads), options))
+            for idx, name in enumerate(names):
+                atts.append(make_attachment('feature-sample', output, name, inputs[idx].get('group', ''),
+                                            feature_json(rngs[idx], ts, leads), options))
+        elif output == 'transform-json':
+            for idx, name in enumerate(names):
+                atts.append(make_attachment('transform-sample', output, name, inputs[idx].get('group', ''),
+                                            transform_json(rngs[idx], ts, leads), options))
+        elif output == 'transform-heatmap':
+            for sym, xform, name, _, _ in transform_syms(leads):
+                svg = heatmap_svg(rngs[0], '%s %s' % (name, sym), len(names))
+                atts.append(make_attachment('transform-heatmap-' + sym, output, all_inputs, 'all',
+                                            base64.b64encode(svg.encode('utf-8')).decode('ascii'),
+                                            options, 'image/svg+xml', 'base64'))
+        elif output == 'report-json':
+            atts.append(make_attachment('report', output, all_inputs, 'all',
+                                        report_json(rngs[0], names, inputs, leads), options))
+        elif output == 'result-diff-csv':
+            atts.append(make_attachment('result-diff-csv', output, all_inputs, 'all',
+                                        diff_csv(rngs[0], names, inputs, options), options,
+                                        'text/csv'))
+        else:
+            warnings.append("Unsupported output extension '%s' ignored" % output)
+    return atts, warnings
+
+# ----------------------------------------------------------------------
+# RESULTS
+
+def aggregate_results(data, names):
+    res = copy.deepcopy(canned_result()['results'])
+    res['tracing-quality'] = { }
+    for idx, h_input in enumerate(data['input']):
+        res['tracing-quality'][names[idx]] = input_quality(h_input)[0]['tracing quality']
+    matrix = res['diagnosis-matrix']
+    for key, values in list(matrix.items()):
+        matrix[key] = [ values[idx % len(values)] for idx in range(len(names)) ]
+    matrix['id'] = list(names)
+    res['sample'] = names[len(names) // 2]
+    return res
+
+def differential_results(data, names):
+    res = { 'tracing-quality': { }, 'ecg-stats': { } }
+    for idx, h_input in enumerate(data['input']):
+        h, leads, stats = input_quality(h_input)
+        res['tracing-quality'][names[idx]] = h['tracing quality']
+        res['ecg-stats'][names[idx]] = stats
+    return res
+
+def tracing_quality_results(data, names):
+    # one summary for the whole request: each lead is scored across inputs
+    merged = { }
+    for h_input in data['input']:
+        for sig in input_signals(h_input):
+            lead = str(sig.get('name'))
+            if lead not in merged:
+                merged[lead] = dict(sig, data=[ ])
+            merged[lead]['data'] = merged[lead]['data'] + list(sig.get('data') or [ ])
+    h_all, leads, stats = input_quality({ 'data': { 'signals': list(merged.values()) } })
+    tq = { 'all': h_all }
+    tq.update(leads)
+    return { 'tracing-quality': tq, 'ecg-stats': stats }
+
+RESULT_BUILDERS = {
+    'mcg-aggregate': aggregate_results,
+    'mcg-differential': differential_results,
+    'ecg-tracing-quality': tracing_quality_results
+}
+
+# Build an AnalysisResult for a request that has passed validation
+def build_result(data):
+    analysis_type = data['analysis']['type']
+    inputs = data['input']
+    names = [ input_name(h, idx) for idx, h in enumerate(inputs) ]
+    rngs = [ input_rng(h, idx) for idx, h in enumerate(inputs) ]
+
+    res = RESULT_BUILDERS[analysis_type](data, names)
+    if data.get('comment'):
+        res['comment'] = data['comment']
+    res['invoice-id'] = next_invoice_id(analysis_type)
+
+    canned = canned_result()
+    h = { k: canned[k] for k in [ 'object-type', 'locale', 'encoding', 'framework' ] }
+    h['id'] = 'STUB/%s' % res['invoice-id'].split('-')[3]
+    h['results'] = res
+    atts = [ ]
+    warnings = [ ]
+    if analysis_type != 'ecg-tracing-quality':
+        atts, warnings = build_attachments(data, names, rngs)
+    h['attachments'] = atts
+    h['warnings'] = warnings
+    return h
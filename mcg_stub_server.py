@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Local stand-in for the MCG API server, for offline testing and benchmarks.
+#
+# POSTs to /api/v1/analyze are handled like the API server does:
+#   - a missing Authorization header, a token not in the accepted list
+#     (token=), or an expired JWT gets an HTTP 401
+#   - malformed AnalysisRequests get an 'error' object with the same
+#     messages as the API server (see mcg_validate.py); inputs failing the
+#     local input checks get an 'error' of the stub's own
+#   - valid requests get a synthesized AnalysisResult for the requested
+#     analysis and outputs (see mcg_stub_results.py). No analysis is
+#     performed.
+#
+# Service latency is simulated as latency + per_input * len(input) seconds,
+# scaled by a log-normal jitter factor, and a fraction of requests can be
+# failed with HTTP 503 to exercise client retries.
+#
+# Compressed request bodies (Content-Encoding: gzip, deflate, zstd) are
+# decoded, and the server keeps upload statistics so the achieved
+# compression ratio can be reported. Unsupported encodings get a 415 with
+# the supported ones in Accept-Encoding (RFC 7694); corrupt bodies a 400.
+#
+# If the 'h2' package is installed (pip install h2), the same port also
+# accepts HTTP/2 with prior knowledge (h2c), with concurrent requests on a
+# connection multiplexed, for testing the HTTP/2 transport (mcg_http2.py).
+#
+# Usage: python mcg_stub_server.py [port] [latency] [jitter] [fail_rate] [token]
+#   latency   : base service time in seconds
+#   jitter    : sigma of the log-normal latency factor (0: constant)
+#   fail_rate : fraction of requests answered with HTTP 503
+#   token     : only accept this API token (default: any unexpired token)
+
+import json
+import math
+import queue
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from mcg_compression import decompress_body, supported_encodings, UnsupportedEncoding
+from mcg_stub_results import ANALYSIS_TYPES, build_result
+from mcg_token import decode_jwt_claims
+from mcg_validate import api_error, validate_request
+from requests.structures import CaseInsensitiveDict
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+    import h2.exceptions
+    import h2.settings
+except ImportError:
+    h2 = None
+
+DEFAULT_PORT = 8080
+API_PATH = '/api/v1/analyze'
+
+# Return an 'error' object for an invalid AnalysisRequest, or None. The
+# stub can only synthesize results for some analysis types, and from inputs
+# that pass the local input checks.
+def check_request(data):
+    h_err = validate_request(data, inputs=True, extensions=True)
+    if h_err is not None and h_err['object-type'] == 'client-error':
+        h_err = api_error("Input not supported by the stub server", h_err['message'])
+    if h_err is None and data['analysis']['type'] not in ANALYSIS_TYPES:
+        h_err = api_error("Extension not found", "Analysis type '%s' not supported by the stub server" % data['analysis']['type'])
+    return h_err
+
+# Response headers other than Content-Type and Content-Length, by status
+def extra_headers(status):
+    if status == 415:
+        return [ ('Accept-Encoding', ', '.join(supported_encodings())) ]
+    return [ ]
+
+H2_PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
+H2_WINDOW = 16 * 1024 * 1024
+
+class H2Session:
+    # One HTTP/2 connection (prior knowledge, no TLS). Each request is
+    # handled on its own thread, so concurrent streams are multiplexed.
+    # Frames are written by a separate thread, so that reading from the
+    # client never waits for a blocked write (and the other way round).
+    def __init__(self, handler):
+        self.handler = handler
+        self.server = handler.server
+        self.sock = handler.connection
+        self.conn = h2.connection.H2Connection(config=h2.config.H2Configuration(
+            client_side=False, header_encoding='utf-8'))
+        # guards self.conn; notified when the client opens its flow-control window
+        self.cond = threading.Condition()
+        self.outbox = queue.Queue()
+        self.streams = { }
+        self.closed = False
+
+    # queue the frames produced so far; called with self.cond held
+    def flush(self):
+        data = self.conn.data_to_send()
+        if data:
+            self.outbox.put(data)
+
+    def write_loop(self):
+        while True:
+            data = self.outbox.get()
+            if data is None:
+                return
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                with self.cond:
+                    self.closed = True
+                    self.cond.notify_all()
+                return
+
+    def run(self):
+        writer = threading.Thread(target=self.write_loop, daemon=True)
+        writer.start()
+        with self.cond:
+            self.conn.initiate_connection()
+            # large windows, so uploads are not throttled by flow control
+            self.conn.update_settings({ h2.settings.SettingCodes.INITIAL_WINDOW_SIZE: H2_WINDOW })
+            self.conn.increment_flow_control_window(H2_WINDOW)
+            self.flush()
+        try:
+            while not self.closed:
+                data = self.handler.rfile.read1(65536)
+                if not data:
+                    break
+                with self.cond:
+                    for event in self.conn.receive_data(data):
+                        self.dispatch(event)
+                    self.flush()
+                    self.cond.notify_all()
+        except OSError:
+            pass
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.outbox.put(None)
+        writer.join()
+
+    def dispatch(self, event):
+        if isinstance(event, h2.events.RequestReceived):
+            self.streams[event.stream_id] = (CaseInsensitiveDict(event.headers), [ ])
+        elif isinstance(event, h2.events.DataReceived):
+            self.streams[event.stream_id][1].append(event.data)
+            self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+        elif isinstance(event, h2.events.StreamEnded):
+            headers, chunks = self.streams.pop(event.stream_id)
+            threading.Thread(target=self.respond, daemon=True,
+                             args=(event.stream_id, headers, b''.join(chunks))).start()
+        elif isinstance(event, h2.events.StreamReset):
+            self.streams.pop(event.stream_id, None)
+        elif isinstance(event, h2.events.ConnectionTerminated):
+            self.closed = True
+
+    def respond(self, stream_id, headers, body):
+        if headers.get(':method') != 'POST':
+            status, body, content_type = 200, b"ERROR /", 'text/plain'
+        else:
+            status, body, content_type = self.server.handle_post(headers.get(':path'), headers, body)
+        try:
+            with self.cond:
+                self.conn.send_headers(stream_id, [ (':status', str(status)),
+                                                    ('content-type', content_type),
+                                                    ('content-length', str(len(body))) ] +
+                                       [ (k.lower(), v) for k, v in extra_headers(status) ])
+                while body:
+                    while not self.closed and self.conn.local_flow_control_window(stream_id) <= 0:
+                        self.cond.wait()
+                    if self.closed:
+                        return
+                    n = min(len(body), self.conn.local_flow_control_window(stream_id),
+                            self.conn.max_outbound_frame_size)
+                    self.conn.send_data(stream_id, body[:n])
+                    body = body[n:]
+                    self.flush()
+                self.conn.end_stream(stream_id)
+                self.flush()
+        except (OSError, h2.exceptions.StreamClosedError):
+            pass
+
+class StubHandler(BaseHTTPRequestHandler):
+    # keep-alive, so the stub exercises client-side connection reuse
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately; without TCP_NODELAY a small
+    # body waits for the client's delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, fmt, *args)
+
+    def send_body(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in extra_headers(status):
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.send_body(200, b"ERROR /", 'text/plain')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        self.send_body(*self.server.handle_post(self.path, self.headers, body))
+
+    def handle(self):
+        # a client speaking HTTP/2 with prior knowledge starts with the
+        # connection preface instead of a request line
+        if h2 is not None and self.rfile.peek(len(H2_PREFACE)).startswith(H2_PREFACE[:3]):
+            H2Session(self).run()
+        else:
+            BaseHTTPRequestHandler.handle(self)
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # listen backlog; the default of 5 resets connections when many clients
+    # connect at once
+    request_queue_size = 128
+
+    # latency   : base service time in seconds
+    # per_input : additional service time per input
+    # jitter    : sigma of the log-normal factor applied to the service time
+    # fail_rate : fraction of requests answered with HTTP 503
+    # tokens    : accepted API tokens (None: any token that is not an
+    #             expired JWT)
+    def __init__(self, address, latency=0.0, verbose=False, per_input=0.0,
+                 jitter=0.0, fail_rate=0.0, tokens=None, seed=None):
+        ThreadingHTTPServer.__init__(self, address, StubHandler)
+        self.latency = latency
+        self.per_input = per_input
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.tokens = tokens
+        self.verbose = verbose
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+
+    # Handle a POST; returns (status, body, content type)
+    def handle_post(self, path, headers, body):
+        length = len(body)
+        encoding = headers.get('Content-Encoding')
+        try:
+            body = decompress_body(body, encoding)
+        except UnsupportedEncoding:
+            return 415, b'Unsupported Content-Encoding', 'text/plain'
+        except ValueError:
+            return 400, b'Corrupt request body', 'text/plain'
+        self.record_upload(length, len(body), encoding)
+
+        if path != API_PATH or not self.authorized(headers.get('Authorization')):
+            return 401, b'Unauthorized', 'text/plain'
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+
+        h_err = check_request(data)
+        inputs = len(data['input']) if h_err is None else 0
+        time.sleep(self.service_time(inputs))
+        if self.should_fail():
+            return 503, b'Service Unavailable', 'text/plain'
+        if h_err is not None:
+            return 200, json.dumps(h_err).encode('utf-8'), 'application/json'
+        return 200, json.dumps(build_result(data)).encode('utf-8'), 'application/json'
+
+    def authorized(self, token):
+        if not token:
+            return False
+        if self.tokens is not None:
+            return token in self.tokens
+        claims = decode_jwt_claims(token)
+        return 'exp' not in claims or claims['exp'] > time.time()
+
+    def service_time(self, inputs):
+        t = self.latency + self.per_input * inputs
+        if t > 0 and self.jitter > 0:
+            with self.rng_lock:
+                t *= math.exp(self.rng.gauss(-0.5 * self.jitter ** 2, self.jitter))
+        return t
+
+    def should_fail(self):
+        if self.fail_rate <= 0:
+            return False
+        with self.rng_lock:
+            return self.rng.random() < self.fail_rate
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = { 'requests': 0, 'compressed': 0,
+                           'wire-bytes': 0, 'body-bytes': 0 }
+
+    def record_upload(self, wire_bytes, body_bytes, encoding):
+        with self.stats_lock:
+            self.stats['requests'] += 1
+            if encoding and encoding != 'identity':
+                self.stats['compressed'] += 1
+            self.stats['wire-bytes'] += wire_bytes
+            self.stats['body-bytes'] += body_bytes
+
+    # Upload statistics: compression ratio is decoded size / bytes on the wire
+    def upload_report(self):
+        with self.stats_lock:
+            h = dict(self.stats)
+        h['ratio'] = 1.0
+        if h['wire-bytes'] > 0:
+            h['ratio'] = h['body-bytes'] / h['wire-bytes']
+        return h
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://%s:%d%s" % (host, port, API_PATH)
+
+# Start a stub server on a background thread. Port 0 picks a free port;
+# the caller reads the endpoint from server.url and calls server.shutdown().
+# Keyword arguments are passed on to StubServer.
+def start_stub_server(port=0, latency=0.0, host='127.0.0.1', **kwargs):
+    server = StubServer((host, port), latency, **kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+if __name__ == '__main__':
+    port = DEFAULT_PORT
+    latency = 0.0
+    jitter = 0.0
+    fail_rate = 0.0
+    tokens = None
+    if len(sys.argv) > 1:
+        port = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        latency = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        jitter = float(sys.argv[3])
+    if len(sys.argv) > 4:
+        fail_rate = float(sys.argv[4])
+    if len(sys.argv) > 5:
+        tokens = [ sys.argv[5] ]
+
+    server = StubServer(('127.0.0.1', port), latency, verbose=True, jitter=jitter,
+                        fail_rate=fail_rate, tokens=tokens)
+    print("MCG API stub listening on %s (latency %0.3fs, jitter %0.2f, fail rate %0.2f)" % (server.url, latency, jitter, fail_rate))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    h = server.upload_report()
+    print("Requests: %d (%d compressed)  Uploaded: %d bytes  Decoded: %d bytes  Ratio: %0.2f" % (h['requests'], h['compressed'], h['wire-bytes'], h['body-bytes'], h['ratio']))
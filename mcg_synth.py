@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Synthetic multi-lead ECG recordings for load tests and benchmarks.
+#
+# random_data() in the numbered examples fills each lead with uniform
+# noise, which is slow to generate and is not an ECG. ECGGenerator builds
+# plausible recordings with NumPy, a whole batch at a time:
+#   - beats at a heart rate drawn per recording from heart_rate (bpm),
+#     with beat-to-beat variability (hrv, fraction of the RR interval)
+#   - each beat is a sum of Gaussian P, Q, R, S and T waves, with
+#     amplitudes (mV) per lead and a QT interval that shortens with the RR
+#     interval (Bazett)
+#   - baseline wander (a respiration-rate sine, amplitude in mV) and
+#     uniform white noise (standard deviation in mV)
+#   - samples are mV * gain + offset, as int16
+# Defaults are the format of the API examples: leads V5 and II, 100 Hz,
+# 8192 samples (an 82-second window). The same seed gives the same
+# recordings.
+#
+# arrays() returns the samples as an int16 array; ecgs() and inputs() give
+# ECG JSON objects and AnalysisRequest inputs ready to send. arrays() makes
+# about 3000 default recordings per second on one core; ecgs() and inputs()
+# are limited by converting the samples to Python lists (about 600 per
+# second).
+#
+# Write a JSONL file of mcg-aggregate requests for jsonl_batch_request.py:
+#   python mcg_synth.py requests.jsonl [num_requests] [inputs_per_request] [seed]
+#
+# Requires numpy.
+
+import json
+import sys
+import time
+from datetime import datetime
+import numpy as np
+
+DEFAULT_LEADS = [ 'V5', 'II' ]
+DEFAULT_FREQUENCY = 100
+DEFAULT_SAMPLES = 8192
+DEFAULT_GAIN = 500.0
+DEFAULT_OFFSET = 1000
+
+# wave : (offset from the R peak in seconds at 60 bpm, width in seconds)
+WAVES = {
+    'P': (-0.20, 0.025),
+    'Q': (-0.03, 0.010),
+    'R': (0.00, 0.012),
+    'S': (0.03, 0.010),
+    'T': (0.28, 0.045)
+}
+WAVE_NAMES = [ 'P', 'Q', 'R', 'S', 'T' ]
+
+# lead : amplitude of each wave in mV
+LEAD_AMPLITUDES = {
+    'I':   [ 0.10, -0.05, 0.90, -0.15, 0.25 ],
+    'II':  [ 0.15, -0.08, 1.20, -0.25, 0.30 ],
+    'III': [ 0.08, -0.05, 0.60, -0.20, 0.15 ],
+    'V1':  [ 0.08,  0.00, 0.30, -1.00, -0.10 ],
+    'V2':  [ 0.10,  0.00, 0.60, -1.20, 0.40 ],
+    'V5':  [ 0.10, -0.10, 1.60, -0.30, 0.35 ],
+    'V6':  [ 0.10, -0.08, 1.30, -0.20, 0.30 ]
+}
+
+RESPIRATION_HZ = (0.15, 0.35)
+
+# recordings generated at a time by arrays()
+CHUNK = 16
+
+class ECGGenerator:
+    # heart_rate : bpm, or a (low, high) range to draw each recording's rate from
+    # hrv        : standard deviation of RR intervals, as a fraction
+    # noise      : standard deviation of the white noise, in mV
+    # wander     : amplitude of baseline wander, in mV
+    # leads      : lead names (see LEAD_AMPLITUDES)
+    # seed       : seed for numpy.random.default_rng
+    def __init__(self, heart_rate=(55, 95), hrv=0.03, noise=0.02, wander=0.1,
+                 leads=None, frequency=DEFAULT_FREQUENCY, samples=DEFAULT_SAMPLES,
+                 gain=DEFAULT_GAIN, offset=DEFAULT_OFFSET, seed=None):
+        if isinstance(heart_rate, (int, float)):
+            heart_rate = (heart_rate, heart_rate)
+        self.heart_rate = heart_rate
+        self.hrv = hrv
+        self.noise = noise
+        self.wander = wander
+        self.leads = list(leads or DEFAULT_LEADS)
+        for lead in self.leads:
+            if lead not in LEAD_AMPLITUDES:
+                raise ValueError("Unknown lead '%s'" % lead)
+        self.frequency = frequency
+        self.samples = samples
+        self.gain = gain
+        self.offset = offset
+        self.rng = np.random.default_rng(seed)
+        self.amplitudes = np.array([ LEAD_AMPLITUDES[lead] for lead in self.leads ], dtype=np.float32)
+
+    # R peak times of n recordings, and the RR interval ending at each:
+    # arrays (n, beats), in seconds. The first peak is before the window
+    # and the last one after it.
+    def _r_peaks(self, n):
+        duration = self.samples / float(self.frequency)
+        rate = self.rng.uniform(self.heart_rate[0], self.heart_rate[1], n)
+        rr = 60.0 / rate
+        beats = int(np.ceil(duration / (0.75 * rr.min()))) + 3
+        intervals = rr[:, None] * (1.0 + self.hrv * self.rng.standard_normal((n, beats)))
+        intervals = np.maximum(intervals, 0.75 * rr[:, None])
+        start = -(1.0 + self.rng.uniform(0.0, 1.0, n)) * rr
+        return start[:, None] + np.cumsum(intervals, axis=1), intervals
+
+    # Samples of n recordings as int16 array (n, leads, samples). They are
+    # made CHUNK recordings at a time, so the float32 intermediates stay
+    # in cache.
+    def arrays(self, n):
+        res = np.empty((n, len(self.leads), self.samples), dtype=np.int16)
+        for i in range(0, n, CHUNK):
+            self._chunk(res[i:i + CHUNK])
+        return res
+
+    # Fill out (n, leads, samples) with n new recordings
+    def _chunk(self, out):
+        n = len(out)
+        peaks, rr = self._r_peaks(n)
+        fs = float(self.frequency)
+        # beats that can reach into the window, as flat arrays
+        keep = peaks * fs < self.samples + 1.0 * fs
+        rows = np.nonzero(keep)[0]
+        pos = (peaks[keep] * fs)[:, None]
+        # QT shortens with the RR interval (Bazett)
+        qt = np.sqrt(rr[keep], dtype=np.float32)[:, None]
+
+        # each wave of each beat is added over +-3.5 widths around its
+        # centre (a few samples) rather than evaluated at every sample, into
+        # every lead at once with the lead's amplitude, with one bincount.
+        # Rows are padded so that samples outside the window fall into
+        # the padding instead of having to be masked out.
+        nleads = len(self.leads)
+        kmax = int(np.ceil(3.5 * max([ w[1] for w in WAVES.values() ]) * np.sqrt(rr.max()) * fs))
+        row = self.samples + 2 * kmax
+        lead_base = np.arange(nleads)[:, None, None] * row
+        base = (rows * nleads * row + kmax)[:, None]
+        idxs = [ ]
+        weights = [ ]
+        for w, name in enumerate(WAVE_NAMES):
+            mu, sigma = WAVES[name]
+            if name == 'T':
+                centre = pos + mu * fs * qt
+                width = sigma * fs * qt
+            else:
+                centre = pos + mu * fs
+                width = np.float32(sigma * fs)
+            k = int(np.ceil(3.5 * np.max(width)))
+            idx = np.rint(centre).astype(np.int64) + np.arange(-k, k + 1)
+            x = (idx - centre).astype(np.float32) / width
+            np.clip(idx, -kmax, self.samples + kmax - 1, out=idx)
+            idx += base
+            g = np.exp(-0.5 * x * x)
+            idxs.append((idx + lead_base).ravel())
+            weights.append((g * self.amplitudes[:, w, None, None]).ravel())
+        mv = np.bincount(np.concatenate(idxs), weights=np.concatenate(weights),
+                         minlength=n * nleads * row)
+        mv = mv.reshape(n, nleads, row)[:, :, kmax:kmax + self.samples].astype(np.float32)
+
+        t = np.arange(self.samples, dtype=np.float32) / np.float32(fs)
+        if self.wander:
+            f = self.rng.uniform(RESPIRATION_HZ[0], RESPIRATION_HZ[1], (n, 1, 1)).astype(np.float32)
+            phase = self.rng.uniform(0.0, 2 * np.pi, (n, len(self.leads), 1)).astype(np.float32)
+            mv += np.float32(self.wander) * np.sin(np.float32(2 * np.pi) * f * t + phase)
+        if self.noise:
+            # uniform, which is several times faster to draw than normal
+            u = self.rng.random(mv.shape, dtype=np.float32)
+            u -= np.float32(0.5)
+            u *= np.float32(self.noise * np.sqrt(12.0))
+            mv += u
+        mv *= np.float32(self.gain)
+        mv += np.float32(self.offset)
+        np.rint(mv, out=mv)
+        np.clip(mv, -32768, 32767, out=mv)
+        out[...] = mv
+
+    # n ECG JSON objects (as in data/ecg_*.json)
+    def ecgs(self, n, timestamp=None):
+        if timestamp is None:
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        res = [ ]
+        for rec in self.arrays(n):
+            res.append({
+                'frequency': self.frequency,
+                'timestamp': timestamp,
+                'signals': [ { 'name': lead, 'gain': self.gain, 'offset': self.offset,
+                               'timestamp': timestamp, 'data': samples.tolist() }
+                             for lead, samples in zip(self.leads, rec) ]
+            })
+        return res
+
+    # n AnalysisRequest inputs
+    def inputs(self, n, age=40, gender='M'):
+        ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        return [ {
+            "type": "ecg",
+            "format": "json",
+            "timestamp": ts,
+            "age": age,
+            "gender": gender,
+            "data": ecg
+        } for ecg in self.ecgs(n, ts) ]
+
+def aggregate_request(inputs, comment=None):
+    return {
+      "object-type": "analysis-request",
+      "analysis": {
+        "type": "mcg-aggregate",
+        "options": { }
+      },
+      "output": { },
+      "input": inputs,
+      "comment": comment or "(FAKE DATA) Generated by mcg_synth.py"
+    }
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.stderr.write("Usage: %s requests.jsonl [num_requests] [inputs_per_request] [seed]\n" % sys.argv[0])
+        sys.exit(-1)
+    outfile = sys.argv[1]
+    num_requests = 100
+    per_request = 3
+    seed = None
+    if len(sys.argv) > 2:
+        num_requests = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        per_request = int(sys.argv[3])
+    if len(sys.argv) > 4:
+        seed = int(sys.argv[4])
+
+    gen = ECGGenerator(seed=seed)
+    start = time.perf_counter()
+    with open(outfile, 'w') as f:
+        for i in range(num_requests):
+            f.write(json.dumps(aggregate_request(gen.inputs(per_request))))
+            f.write('\n')
+    elapsed = time.perf_counter() - start
+    print("Wrote %d requests (%d recordings) to %s in %0.2fs" % (num_requests, num_requests * per_request, outfile, elapsed))
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Per-request phase timings for the shared MCG API client.
+#
+# Every request made through MCGClient.post() gets a RequestTimings record
+# (response.timings) with the time spent in each phase, in seconds:
+#   connect   : DNS lookup and TCP connect (0 if a pooled connection was reused)
+#   tls       : TLS handshake
+#   serialize : building the request body (serialize_request)
+#   compress  : compressing the body (see mcg_compression.py)
+#   upload    : sending headers and body
+#   ttfb      : waiting for the response headers (mostly server processing)
+#   download  : reading the response body
+#   decode    : json.loads of the response (decode_response)
+# Times of retried attempts are added together. The record is complete when
+# post() returns, with the body downloaded and decoded (see TimedResponse),
+# or when the request has failed with an exception. A streamed response's
+# record is complete once it has been parsed (see mcg_stream.py), read as
+# text or JSON, or closed. The record is then passed to the TimingRecorder, which keeps a running summary and calls the registered
+# hooks with it (see mcg_metrics.py for one such hook).
+#
+# Attachments are decoded by the caller after that, so their decode time is
+# only reported in the summary (see retrieve_attachment() in mcg_client.py).
+#
+# The overhead is a few perf_counter() calls per request, so the timings are
+# on by default; set MCG_API_TIMINGS=0 to turn them off.
+
+import collections
+import json
+import math
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+PHASES = [ 'connect', 'tls', 'serialize', 'compress', 'upload', 'ttfb',
+           'download', 'decode' ]
+
+# record of the request being sent on this thread, if any
+_local = threading.local()
+
+def current():
+    return getattr(_local, 'timings', None)
+
+def set_current(timings):
+    _local.timings = timings
+
+class RequestTimings:
+    def __init__(self, url, recorder=None):
+        self.url = url
+        self.recorder = recorder
+        # analysis type of the request, if known
+        self.analysis = None
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.status = None
+        self.attempts = 0
+        self.connections = 0
+        self.bytes_up = 0
+        self.bytes_down = 0
+        # perf_counter() when the response headers arrived
+        self.headers_at = None
+        # object-type of the decoded response ('analysis-result', 'error'),
+        # 'http-<status>', or the name of the exception raised
+        self.outcome = None
+        # the decoded response; only set while the hooks are called
+        self.result = None
+
+    def add(self, phase, seconds):
+        self.phases[phase] += seconds
+
+    # Add the phases and counts of another record (e.g. of the copy of a
+    # hedged request that answered first)
+    def merge(self, other):
+        for phase, seconds in other.phases.items():
+            self.phases[phase] += seconds
+        self.attempts += other.attempts
+        self.connections += other.connections
+        self.bytes_up += other.bytes_up
+        self.bytes_down += other.bytes_down
+        self.headers_at = other.headers_at
+
+    # Complete the record and pass it to the recorder (once)
+    def finish(self, result=None):
+        if self.elapsed is not None:
+            return
+        self.elapsed = time.perf_counter() - self.started
+        if self.recorder is not None:
+            self.result = result
+            self.recorder.record(self)
+            self.result = None
+
+    def to_dict(self):
+        h = dict(self.phases)
+        h.update({ 'url': self.url, 'analysis': self.analysis, 'outcome': self.outcome,
+                   'status': self.status, 'total': self.elapsed,
+                   'attempts': self.attempts, 'connections': self.connections,
+                   'bytes-up': self.bytes_up, 'bytes-down': self.bytes_down })
+        return h
+
+# The response of a timed request. Once the body has been downloaded,
+# finish_downloaded() decodes it and finishes the record, so requests whose
+# caller only looks at status_code are recorded too; the decoded result is
+# kept, and json() and decode_response() return it rather than decoding
+# twice. A streamed response's record is finished when the body is read as
+# text, decoded with json() or the response is closed; without json() the
+# outcome is only known as 'http-<status>'.
+class TimedResponse(requests.Response):
+    decoded = None
+
+    @property
+    def text(self):
+        text = requests.Response.text.fget(self)
+        self.finish_timings()
+        return text
+
+    def json(self, **kwargs):
+        if self.decoded is not None and not kwargs:
+            return self.decoded
+        if self.timings.elapsed is not None:
+            return requests.Response.json(self, **kwargs)
+        return self.decode(**kwargs)
+
+    def decode(self, **kwargs):
+        timings = self.timings
+        start = time.perf_counter()
+        # not Response.json(), which reads self.text
+        res = json.loads(self.content, **kwargs)
+        timings.add('decode', time.perf_counter() - start)
+        timings.outcome = res.get('object-type') if isinstance(res, dict) else None
+        timings.finish(res)
+        return res
+
+    def close(self):
+        requests.Response.close(self)
+        self.finish_timings()
+
+    # A body that is not JSON is left for the caller to fail on
+    def finish_downloaded(self):
+        if self.status_code == 200:
+            try:
+                self.decoded = self.decode()
+            except ValueError:
+                pass
+        self.finish_timings()
+
+    def finish_timings(self):
+        if self.timings.elapsed is None:
+            self.timings.outcome = "http-%d" % self.status_code
+            self.timings.finish()
+
+# ----------------------------------------------------------------------
+# CONNECTION INSTRUMENTATION
+
+class TimedConnectionMixin:
+    def _new_conn(self):
+        start = time.perf_counter()
+        sock = super()._new_conn()
+        rec = current()
+        if rec is not None:
+            rec.add('connect', time.perf_counter() - start)
+            rec.connections += 1
+        return sock
+
+    def connect(self):
+        rec = current()
+        if rec is None:
+            return super().connect()
+        start = time.perf_counter()
+        before = rec.phases['connect']
+        super().connect()
+        # whatever connect() spent beyond _new_conn() is the TLS handshake
+        tls = time.perf_counter() - start - (rec.phases['connect'] - before)
+        if isinstance(self, HTTPSConnection):
+            rec.add('tls', tls)
+
+    def request(self, *args, **kwargs):
+        rec = current()
+        if rec is None:
+            return super().request(*args, **kwargs)
+        start = time.perf_counter()
+        before = rec.phases['connect'] + rec.phases['tls']
+        super().request(*args, **kwargs)
+        # plain HTTP connections are opened inside request()
+        rec.add('upload', time.perf_counter() - start -
+                (rec.phases['connect'] + rec.phases['tls'] - before))
+
+    def getresponse(self):
+        rec = current()
+        if rec is None:
+            return super().getresponse()
+        start = time.perf_counter()
+        response = super().getresponse()
+        rec.headers_at = time.perf_counter()
+        rec.add('ttfb', rec.headers_at - start)
+        return response
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    pass
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+    pass
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+# HTTPAdapter whose connections record connect, TLS, upload and
+# time-to-first-byte into the current RequestTimings
+class TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool
+        }
+
+# ----------------------------------------------------------------------
+# SUMMARY
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, int(math.ceil(pct / 100.0 * len(values))) - 1)]
+
+class TimingRecorder:
+    # window : number of recent requests kept for latency percentiles
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.hooks = [ ]
+        self.recent = collections.deque(maxlen=window)
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.connections = 0
+            self.hook_errors = 0
+            self.sums = dict.fromkeys(PHASES + [ 'total' ], 0.0)
+            self.maxes = dict.fromkeys(PHASES + [ 'total' ], 0.0)
+            self.bytes = { 'up': 0, 'down': 0 }
+            self.attachments = { 'count': 0, 'seconds': 0.0 }
+            self.recent.clear()
+
+    # hook(timings) is called with every completed RequestTimings
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def record(self, timings):
+        with self.lock:
+            self.requests += 1
+            self.connections += timings.connections
+            for phase, seconds in timings.phases.items():
+                self.sums[phase] += seconds
+                self.maxes[phase] = max(self.maxes[phase], seconds)
+            self.sums['total'] += timings.elapsed
+            self.maxes['total'] = max(self.maxes['total'], timings.elapsed)
+            self.bytes['up'] += timings.bytes_up
+            self.bytes['down'] += timings.bytes_down
+            self.recent.append(timings.elapsed)
+        for hook in list(self.hooks):
+            try:
+                hook(timings)
+            except Exception:
+                # a broken hook must not fail the request
+                with self.lock:
+                    self.hook_errors += 1
+
+    def record_attachments(self, seconds, count=1):
+        with self.lock:
+            self.attachments['count'] += count
+            self.attachments['seconds'] += seconds
+
+    # Summary: mean and max seconds per phase, latency percentiles over
+    # the recent window, connections opened, and bytes transferred
+    def report(self):
+        with self.lock:
+            n = self.requests
+            h = {
+                'requests': n,
+                'connections': self.connections,
+                'mean': { k: (v / n if n else 0.0) for k, v in self.sums.items() },
+                'max': dict(self.maxes),
+                'bytes-up': self.bytes['up'],
+                'bytes-down': self.bytes['down'],
+                'attachments': dict(self.attachments),
+                'hook-errors': self.hook_errors
+            }
+            recent = list(self.recent)
+        h['p50'] = percentile(recent, 50)
+        h['p95'] = percentile(recent, 95)
+        h['p99'] = percentile(recent, 99)
+        return h
+
+    def print_report(self, indent="\t"):
+        h = self.report()
+        print(indent + "Requests: %d  Connections opened: %d" % (h['requests'], h['connections']))
+        if not h['requests']:
+            return
+        print(indent + "Mean per request: " + "  ".join("%s %0.1fms" % (p, h['mean'][p] * 1000) for p in PHASES))
+        print(indent + "Total  p50: %0.1fms  p95: %0.1fms  p99: %0.1fms  max: %0.1fms" % (h['p50'] * 1000, h['p95'] * 1000, h['p99'] * 1000, h['max']['total'] * 1000))
+        if h['attachments']['count']:
+            print(indent + "Attachments decoded: %d  (%0.2fms each)" % (h['attachments']['count'], 1000 * h['attachments']['seconds'] / h['attachments']['count']))
+
+_default_recorder = TimingRecorder()
+
+def default_recorder():
+    return _default_recorder
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Cached, expiry-aware MCG API token provider.
+#
+# The token is read from MCG_API_TOKEN, or from the file named by
+# MCG_API_TOKEN_FILE, and kept in memory. The file is re-read only when its
+# modification time or size changes, so a token rotated on disk is picked up
+# without restarting.
+#
+# The JWT 'exp' and 'nbf' claims are decoded locally (the signature is not
+# verified - that is the server's job). A token that is expired, or will
+# expire within min_validity seconds, is refreshed (file reload or the
+# refresh callback) and otherwise rejected with TokenExpiredError before any
+# request data is uploaded.
+
+import base64
+import json
+import os
+import threading
+import time
+
+TOKEN_PATH_KEY = 'MCG_API_TOKEN_FILE'
+TOKEN_KEY = 'MCG_API_TOKEN'
+
+class TokenError(RuntimeError):
+    pass
+
+class TokenExpiredError(TokenError):
+    pass
+
+# Return the claims of a JWT as a dict, or {} if it cannot be decoded
+def decode_jwt_claims(token):
+    if isinstance(token, bytes):
+        token = token.decode('ascii', 'replace')
+    parts = token.split('.')
+    if len(parts) != 3:
+        return { }
+    payload = parts[1] + '=' * (-len(parts[1]) % 4)
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+    except ValueError:
+        return { }
+    if not isinstance(claims, dict):
+        return { }
+    return claims
+
+class TokenProvider:
+    # token          : static token (default: MCG_API_TOKEN)
+    # path           : token file (default: MCG_API_TOKEN_FILE)
+    # refresh        : optional callable returning a new token string,
+    #                  used when the cached token has expired
+    # min_validity   : seconds a token must remain valid to be handed out
+    # leeway         : allowed clock skew, in seconds
+    # check_interval : minimum seconds between checks of the token file
+    def __init__(self, token=None, path=None, refresh=None, min_validity=60,
+                 leeway=30, check_interval=1.0):
+        if token is None and path is None:
+            if TOKEN_KEY in os.environ:
+                token = os.environ[TOKEN_KEY]
+            elif TOKEN_PATH_KEY in os.environ:
+                path = os.environ[TOKEN_PATH_KEY]
+            elif refresh is None:
+                raise TokenError("Missing token! Set either MCG_API_TOKEN or MCG_API_TOKEN_FILE in environment.")
+        self.path = path
+        self.refresh = refresh
+        self.min_validity = min_validity
+        self.leeway = leeway
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.file_sig = None
+        self.checked_at = 0.0
+        self.token = None
+        self.claims = { }
+        if token is not None:
+            self._set_token(token)
+
+    def _set_token(self, token):
+        if isinstance(token, bytes):
+            token = token.decode('ascii')
+        self.token = token.strip()
+        self.claims = decode_jwt_claims(self.token)
+
+    def _reload_if_changed(self, force=False):
+        if self.path is None:
+            return
+        now = time.monotonic()
+        if not force and self.token is not None and now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+        st = os.stat(self.path)
+        sig = (st.st_mtime_ns, st.st_size)
+        if sig != self.file_sig or self.token is None:
+            with open(self.path, 'r') as f:
+                self._set_token(f.read())
+            self.file_sig = sig
+
+    # Seconds until the current token expires (None if it has no 'exp')
+    def expires_in(self):
+        if 'exp' not in self.claims:
+            return None
+        return self.claims['exp'] - time.time()
+
+    def _problem(self, min_validity):
+        now = time.time()
+        if 'nbf' in self.claims and self.claims['nbf'] > now + self.leeway:
+            return "MCG API token is not valid until %s" % time.ctime(self.claims['nbf'])
+        if 'exp' in self.claims and self.claims['exp'] < now - self.leeway + min_validity:
+            return "MCG API token expired (or expires within %ds) at %s" % (min_validity, time.ctime(self.claims['exp']))
+        return None
+
+    # Return a token valid for at least min_validity seconds, refreshing
+    # it if needed. Raises TokenExpiredError if no valid token is available.
+    def get_token(self, min_validity=None):
+        if min_validity is None:
+            min_validity = self.min_validity
+        with self.lock:
+            self._reload_if_changed()
+            problem = None
+            if self.token is not None:
+                problem = self._problem(min_validity)
+                if problem is None:
+                    return self.token
+
+            self._reload_if_changed(force=True)
+            if self.token is not None:
+                problem = self._problem(min_validity)
+            if (self.token is None or problem is not None) and self.refresh is not None:
+                self._set_token(self.refresh())
+                problem = self._problem(min_validity)
+            if problem is not None:
+                raise TokenExpiredError(problem)
+            return self.token
+
+_default_provider = None
+_default_lock = threading.Lock()
+
+def default_token_provider():
+    global _default_provider
+    if _default_provider is None:
+        with _default_lock:
+            if _default_provider is None:
+                _default_provider = TokenProvider()
+    return _default_provider
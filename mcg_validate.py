@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Local validation of AnalysisRequests before upload.
+#
+# validate_request() returns the 'error' object the API server would return
+# for a malformed request, or None if the request looks valid, so a bad
+# request is rejected before its (possibly multi-megabyte) body is sent.
+# The checks on the request envelope run in the same order as on the server
+# and give the same messages (see 2.1_error_handling.py, cases 06-11):
+#   - 'analysis' present, object-type 'analysis-request', 'input' present
+#   - at least one input
+#   - analysis options and each output's options are objects
+#
+# With extensions=True, the analysis type and output names must be in
+# ANALYSIS_TYPES and OUTPUTS, the extensions these examples use. The server
+# may offer others (e.g. for a newer API version or another account), so
+# these lists are not checked by default.
+#
+# With inputs=True, each input is checked as well:
+#   - input type and format, sampling frequency
+#   - signals: known lead names, numeric gain/offset, equal lengths of at
+#     least MIN_DURATION seconds
+# These rules are not documented by the API server: LEADS and MIN_DURATION
+# are local assumptions (the examples send V5 and II, 81.92s long), and the
+# server's own messages for bad inputs are unknown. A problem is therefore
+# returned as a 'client-error' rather than as a server 'error'.
+# Individual samples are not type-checked (only the first and last of each
+# signal), which keeps validation to a few microseconds per request.
+# Pre-serialized ECG data (mcg_serialize.RawJSON) is checked through its
+# summary.
+#
+# MCGClient checks the envelope of every request by default; set
+# MCG_API_VALIDATE to 'inputs', 'extensions' or 'inputs,extensions' to add
+# those checks, or to 0 to turn validation off. Requests without a body
+# (data=None) are not checked.
+
+from datetime import datetime
+from mcg_serialize import RawJSON
+
+# extensions accepted with extensions=True
+ANALYSIS_TYPES = frozenset([ 'mcg-aggregate', 'mcg-differential',
+                             'ecg-tracing-quality' ])
+
+OUTPUTS = frozenset([ 'result-json', 'result-explain-json', 'feature-json',
+                      'transform-json', 'transform-heatmap', 'report-json',
+                      'result-diff-csv' ])
+
+INPUT_TYPES = { 'ecg': frozenset([ 'json' ]) }
+
+# lead names accepted with inputs=True
+LEADS = frozenset([ 'I', 'II', 'III', 'aVR', 'aVL', 'aVF',
+                    'V1', 'V2', 'V3', 'V4', 'V5', 'V6' ])
+
+# shortest recording accepted with inputs=True, in seconds
+MIN_DURATION = 10
+
+NUMBER = (int, float)
+
+def api_error(message, details):
+    return {
+        "object-type": "error",
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "message": message,
+        "details": details
+    }
+
+def request_error(details):
+    return api_error("API request error", details)
+
+# A problem found by the local input checks, which the server may report
+# differently (or not at all)
+def input_error(idx, details):
+    return {
+        "object-type": "client-error",
+        "timestamp": str(datetime.now()),
+        "message": "Input %d: %s" % (idx, details)
+    }
+
+def is_number(v):
+    return isinstance(v, NUMBER) and not isinstance(v, bool)
+
+# Return an error message for a signal, or None
+def check_signal(sig, frequency):
+    if not isinstance(sig, dict):
+        return "signal is not an object"
+    name = sig.get('name')
+    if name not in LEADS:
+        return "unknown lead name '%s'" % name
+    for key in [ 'gain', 'offset' ]:
+        if key in sig and not is_number(sig[key]):
+            return "signal '%s' %s must be a number" % (name, key)
+    if sig.get('gain', 1) == 0:
+        return "signal '%s' gain must not be zero" % name
+    samples = sig.get('data')
+    if not isinstance(samples, list):
+        return "signal '%s' has no sample data" % name
+    if len(samples) < MIN_DURATION * frequency:
+        return "signal '%s' is %0.1fs long, at least %ds required" % (name, len(samples) / frequency, MIN_DURATION)
+    if not (is_number(samples[0]) and is_number(samples[-1])):
+        return "signal '%s' samples must be numbers" % name
+    return None
+
+# Return an error message for an input, or None
+def check_input(h_input):
+    if not isinstance(h_input, dict):
+        return "input is not an object"
+    formats = INPUT_TYPES.get(h_input.get('type'))
+    if formats is None:
+        return "unsupported input type '%s'" % h_input.get('type')
+    if h_input.get('format') not in formats:
+        return "unsupported format '%s' for input type '%s'" % (h_input.get('format'), h_input['type'])
+    data = h_input.get('data')
+    if isinstance(data, RawJSON):
+        # pre-serialized ECG data: check its summary, if it has one
+        if data.summary is None:
+            return None
+        data = data.summary
+    if not isinstance(data, dict):
+        return "missing 'data'"
+    frequency = data.get('frequency')
+    if not is_number(frequency) or frequency <= 0:
+        return "invalid sampling frequency '%s'" % frequency
+    signals = data.get('signals')
+    if not isinstance(signals, list) or not signals:
+        return "no signals provided"
+    length = None
+    seen = set()
+    for sig in signals:
+        problem = check_signal(sig, frequency)
+        if problem is not None:
+            return problem
+        if sig['name'] in seen:
+            return "duplicate lead '%s'" % sig['name']
+        seen.add(sig['name'])
+        if length is None:
+            length = len(sig['data'])
+        elif len(sig['data']) != length:
+            return "signals have different lengths (%d and %d samples)" % (length, len(sig['data']))
+    return None
+
+# Return an 'error' object for an invalid AnalysisRequest, or None. With
+# extensions=True, unknown analysis types and outputs are errors too. With
+# inputs=True, a 'client-error' object for an invalid input.
+def validate_request(data, inputs=False, extensions=False):
+    if not isinstance(data, dict) or 'analysis' not in data:
+        return request_error("Missing 'analysis' in request")
+    if data.get('object-type') != 'analysis-request':
+        # sic: the API server omits the closing quote
+        return request_error("Unsupported object type '%s" % data.get('object-type'))
+    if 'input' not in data:
+        return request_error("Missing 'input' in request")
+    if not isinstance(data['input'], list) or not data['input']:
+        return api_error("Insufficient input data provided", "1+ inputs required")
+
+    analysis = data['analysis']
+    if not isinstance(analysis, dict):
+        return request_error("Invalid 'analysis' in request")
+    if extensions and analysis.get('type') not in ANALYSIS_TYPES:
+        return api_error("Extension not found", "Unknown analysis type '%s'" % analysis.get('type'))
+    if not isinstance(analysis.get('options', { }), dict):
+        return request_error("Invalid analysis options in request")
+
+    outputs = data.get('output', { })
+    if not isinstance(outputs, dict):
+        return request_error("Invalid 'output' in request")
+    for name, options in outputs.items():
+        if extensions and name not in OUTPUTS:
+            return api_error("Extension not found", "Unknown output '%s'" % name)
+        if not isinstance(options, dict):
+            return request_error("Invalid options for output '%s'" % name)
+
+    if not inputs:
+        return None
+    for idx, h_input in enumerate(data['input']):
+        problem = check_input(h_input)
+        if problem is not None:
+            return input_error(idx, problem)
+    return None
@@ -2,30 +2,12 @@
 # (c) Copyright 2023 Premier Heart, LLC
 
 import json
-import requests
 import os
 import random
 import base64
 import sys
 from datetime import datetime
-
-TOKEN_PATH_KEY = 'MCG_API_TOKEN_FILE'
-TOKEN_KEY = 'MCG_API_TOKEN'
-
-def get_api_token():
-    if TOKEN_KEY in os.environ:
-        return os.environ[TOKEN_KEY]
-    elif TOKEN_PATH_KEY in os.environ:
-        with open(os.environ[TOKEN_PATH_KEY], 'r') as f:
-            return f.read().strip()
-    else:
-        raise "Missing token! Set either MCG_API_TOKEN or MCG_API_TOKEN_FILE in environment."
-
-def send_api_request(server_url, token, data):
-    header = { 'Authorization': token,
-               'Content-Type': 'application/json' }
-    response = requests.post(url=server_url, headers=header, json=data)
-    return response
+from mcg_client import get_api_token, send_api_request, decode_response
 
 def build_request(inputs):
     return {
@@ -70,15 +52,6 @@ def input_for_ecg_json(json_str, age=40, gender='M'):
       "data": json.loads(json_str)
     }
 
-def decode_response(resp):
-    if resp.status_code != 200:
-        return {
-                "object-type": "http-error",
-                "timestamp": str(datetime.now),
-                "message": "Unknown error: HTTP %d" % resp.status_code
-        }
-    return json.loads(resp.text)
-
 def print_results_summary(res, indent="\t"):
     print(indent + "Diagnosis generated by %s using input %s as a representative sample" % (res['source'], res['sample']))
     print(indent + "MCG Category: %s" % res['category'])
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# (c) Copyright 2023 Premier Heart, LLC
+# Submit a file of AnalysisRequests through a crash-safe job queue.
+#
+# Like jsonl_batch_request.py, but the state of every request is kept in a
+# SQLite database (see mcg_jobqueue.py), and each result is saved as
+# results_dir/<job id>.json. If the run is interrupted, running it again
+# with the same database resumes where it stopped: requests whose result
+# was saved are not sent again, and the requests that were in flight are
+# sent again. Several runs may work on the same database at once.
+#
+# The requests file is only needed when jobs are added; it is read again
+# for each job, so it must not be changed while jobs are pending. Failed
+# requests (error results) are not resent unless MCG_API_RETRY_FAILED=1.
+#
+# Usage: python queue_batch_request.py queue.db results_dir [requests.jsonl] [url] [workers]
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from jsonl_batch_request import DEFAULT_WORKERS, build_client, submit_request
+from mcg_client import API_URL, client_error
+from mcg_jobqueue import JobQueue, load_jsonl, read_job_request, save_result, saved_result, invoice_id
+from mcg_metrics import shutdown_exporters
+from mcg_token import default_token_provider
+
+RETRY_FAILED_KEY = 'MCG_API_RETRY_FAILED'
+
+# Send one job's request and save its result; returns (path, result)
+def process_job(client, url, token, results_dir, job):
+    try:
+        data = read_job_request(job)
+    except ValueError as e:
+        data = client_error("Invalid JSON in input: %s" % str(e))
+    if not isinstance(data, dict):
+        data = client_error("Input is not a JSON object")
+    result = submit_request(client, url, token, data)
+    return save_result(results_dir, job, result), result
+
+# Send jobs until the queue has no pending jobs left.
+# Returns (number sent, number of non-analysis-result responses).
+def run_jobs(queue, results_dir, url, token, workers=DEFAULT_WORKERS, client=None):
+    if client is None:
+        client = build_client(workers)
+    max_pending = workers * 2
+    count = 0
+    failed = 0
+    more = True
+    pending = { }
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # claim in batches, when half of the slots are free
+            if more and len(pending) <= workers:
+                wanted = max_pending - len(pending)
+                jobs = queue.claim(wanted)
+                more = len(jobs) == wanted
+                for job in jobs:
+                    pending[pool.submit(process_job, client, url, token, results_dir, job)] = job
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                job = pending.pop(fut)
+                path, result = fut.result()
+                count += 1
+                if result.get('object-type') == 'analysis-result':
+                    queue.done(job['id'], path, invoice_id(result))
+                else:
+                    failed += 1
+                    queue.failed(job['id'], result.get('message'), path)
+    queue.flush()
+    return count, failed
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.stderr.write("Usage: %s queue.db results_dir [requests.jsonl] [url] [workers]\n" % sys.argv[0])
+        sys.exit(-1)
+
+    dbfile = sys.argv[1]
+    results_dir = sys.argv[2]
+    infile = None
+    url = API_URL
+    workers = DEFAULT_WORKERS
+    if len(sys.argv) > 3 and sys.argv[3]:
+        infile = sys.argv[3]
+    if len(sys.argv) > 4:
+        url = sys.argv[4]
+    if len(sys.argv) > 5:
+        workers = int(sys.argv[5])
+
+    os.makedirs(results_dir, exist_ok=True)
+    token = default_token_provider()
+    token.get_token()
+    with JobQueue(dbfile) as queue:
+        if infile is not None:
+            print("Added %d jobs from %s" % (load_jsonl(queue, infile), infile))
+        done, reset = queue.recover(saved_result(results_dir))
+        if done or reset:
+            print("Recovered interrupted jobs: %d completed, %d to resend" % (done, reset))
+        if os.environ.get(RETRY_FAILED_KEY) == '1':
+            print("Resending %d failed jobs" % queue.retry_failed())
+
+        client = build_client(workers)
+        try:
+            count, failed = run_jobs(queue, results_dir, url, token, workers, client)
+        finally:
+            shutdown_exporters()
+        print("Submitted %d requests (%d failed). Results in %s" % (count, failed, results_dir))
+        h = queue.counts()
+        print("Jobs: " + "  ".join("%s: %d" % (state, n) for state, n in h.items()))